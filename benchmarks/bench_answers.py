@@ -0,0 +1,100 @@
+"""
+Answer extraction throughput benchmark
+
+Times extract_answer + normalize_text over synthetic completions for the
+shared compiled extractor against the previous implementation (substring
+scans, rfind, replace and json.loads in a try/except), and reports how often
+the two disagree and how.
+
+Usage:
+    python benchmarks/bench_answers.py --num-completions 100000
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import extract_answer, normalize_text, normalize_ground_truth
+
+
+def legacy_normalize_text(text):
+    text = text.lower().strip()
+    text = re.sub(r'[^a-z0-9\s]', '', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text
+
+
+def legacy_extract_answer(text):
+    try:
+        if '{answer:' in text or '{"answer":' in text:
+            start = text.rfind('{')
+            end = text.rfind('}') + 1
+            if start != -1 and end > start:
+                answer_json = text[start:end].replace('answer:', '"answer":').replace("'", '"')
+                parsed = json.loads(answer_json)
+                return parsed.get("answer", "").strip()
+    except:
+        pass
+    return ""
+
+
+def make_completions(num_completions, seed=0):
+    rng = random.Random(seed)
+    words = ["bar", "value", "chart", "year", "the", "highest", "is", "shows", "percent", "{x}", "market"]
+    answers = ["Daifuku", "2094.6", "2,094.6", "20%", "Yes", "12", "Children's", "Asia Pacific", "-0.35"]
+    endings = [
+        "{{answer: '{}'}}",
+        '{{"answer": "{}"}}',
+        "{{answer: {}}}",
+        '{{ "answer" : "{}" }}',
+        "The answer is {}.",
+        "{{answer: '{}'",
+    ]
+    completions, ground_truths = [], []
+    for _ in range(num_completions):
+        answer = rng.choice(answers)
+        reasoning = " ".join(rng.choice(words) for _ in range(rng.randint(20, 200)))
+        completions.append(f"<think>{reasoning}</think>\n" + rng.choice(endings).format(answer))
+        ground_truths.append(rng.choice(answers))
+    return completions, ground_truths
+
+
+def run(extract, normalize, normalize_gt, completions, ground_truths):
+    start = time.perf_counter()
+    matches = [normalize(extract(text)) == normalize_gt(gt) for text, gt in zip(completions, ground_truths)]
+    return time.perf_counter() - start, matches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-completions", type=int, default=100000)
+    parser.add_argument("--show", type=int, default=5, help="Number of disagreements to print")
+    args = parser.parse_args()
+
+    completions, ground_truths = make_completions(args.num_completions)
+
+    legacy_s, _ = run(legacy_extract_answer, legacy_normalize_text, legacy_normalize_text, completions, ground_truths)
+    new_s, _ = run(extract_answer, normalize_text, normalize_ground_truth, completions, ground_truths)
+
+    print(f"\n{'':>10} {'total s':>9} {'completions/s':>14}")
+    print(f"{'legacy':>10} {legacy_s:>9.3f} {args.num_completions / legacy_s:>14,.0f}")
+    print(f"{'compiled':>10} {new_s:>9.3f} {args.num_completions / new_s:>14,.0f}")
+    print(f"Speedup: {legacy_s / new_s:.1f}x")
+
+    differing = [
+        (text, legacy_extract_answer(text), extract_answer(text))
+        for text in completions
+        if legacy_extract_answer(text) != extract_answer(text)
+    ]
+    print(f"\nExtractions that differ: {len(differing)}/{args.num_completions}")
+    for text, old, new in differing[:args.show]:
+        print(f"  ...{text[-40:]!r}: legacy {old!r} -> {new!r}")
+
+
+if __name__ == "__main__":
+    main()
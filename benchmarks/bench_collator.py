@@ -0,0 +1,92 @@
+"""
+Collator label-masking benchmark
+
+Times QwenCompletionCollator on synthetic batches against the previous
+per-position Python matcher, for several batch sizes and sequence lengths.
+
+Usage:
+    python benchmarks/bench_collator.py --batch-sizes 1 4 8 --seq-lens 256 1024 2048
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+from transformers import AutoProcessor
+
+from sft import get_config, QwenCompletionCollator
+
+
+class LegacyCompletionCollator(QwenCompletionCollator):
+    """Collator with the original double-loop template search"""
+    
+    def _mask_labels(self, input_ids, labels):
+        n = len(self.response_token_ids)
+        for i in range(len(input_ids)):
+            start_idx = -1
+            for j in range(len(input_ids[i]) - n + 1):
+                if input_ids[i][j : j + n].tolist() == self.response_token_ids:
+                    start_idx = j + n
+                    break
+            if start_idx != -1:
+                labels[i, :start_idx] = -100
+            else:
+                labels[i, :] = -100
+        return labels
+
+
+def make_features(batch_size, seq_len, template_ids, vocab_size, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    features = []
+    for _ in range(batch_size):
+        length = int(torch.randint(seq_len // 2, seq_len + 1, (1,), generator=generator))
+        input_ids = torch.randint(0, vocab_size, (length,), generator=generator)
+        # Place the assistant header somewhere in the second half, like a prompt followed by an answer
+        start = int(torch.randint(length // 2, length - len(template_ids), (1,), generator=generator))
+        input_ids[start:start + len(template_ids)] = torch.tensor(template_ids)
+        features.append({
+            "input_ids": input_ids,
+            "attention_mask": torch.ones_like(input_ids),
+            "labels": input_ids.clone(),
+            "pixel_values": torch.zeros(4, 8),
+            "image_grid_thw": torch.tensor([[1, 2, 2]]),
+        })
+    return features
+
+
+def time_collate(collator, features, repeats):
+    collator(features)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        batch = collator(features)
+    return (time.perf_counter() - start) / repeats * 1000, batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=None, help="Processor to take the template from (defaults to the SFT config model)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--seq-lens", type=int, nargs="+", default=[256, 1024, 2048])
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    
+    processor = AutoProcessor.from_pretrained(args.model or get_config().model.model_name, trust_remote_code=True)
+    collator = QwenCompletionCollator(processor=processor)
+    legacy = LegacyCompletionCollator(processor=processor)
+    vocab_size = len(processor.tokenizer)
+    
+    print(f"\n{'batch':>6} {'seq_len':>8} {'legacy ms':>10} {'vectorized ms':>14} {'speedup':>8}")
+    for batch_size in args.batch_sizes:
+        for seq_len in args.seq_lens:
+            features = make_features(batch_size, seq_len, collator.response_token_ids, vocab_size)
+            legacy_ms, legacy_batch = time_collate(legacy, features, args.repeats)
+            new_ms, new_batch = time_collate(collator, features, args.repeats)
+            assert torch.equal(legacy_batch["labels"], new_batch["labels"])
+            print(f"{batch_size:>6} {seq_len:>8} {legacy_ms:>10.2f} {new_ms:>14.2f} {legacy_ms / new_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+GRPO log-prob peak-memory benchmark
+
+Measures the peak memory of scoring a group of completions through the LM
+head (forward and backward of the per-token log-probs and entropy GRPO
+uses) with full logits and with chunked_selective_log_softmax, and on CUDA
+with TRL's fused Triton kernel. The group size doubles until a method no
+longer fits in the memory the full-logits path needs for --base-group, so
+the last row of each method is the largest group that fits in that budget.
+
+Defaults match the Qwen3-VL-2B LM head (151,936 x 2,048). On CUDA the peak
+is torch.cuda.max_memory_allocated; on CPU every measurement runs in a
+fresh process and the peak is its resident set size above the inputs.
+
+Usage:
+    python benchmarks/bench_logprobs.py --completion-length 512 --base-group 8
+    python benchmarks/bench_logprobs.py --vocab 32000 --hidden 512 --completion-length 256 --base-group 4
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+import trl.trainer.utils as trl_utils
+
+from grpo.logprobs import chunked_selective_log_softmax
+
+
+def full_logprobs(hidden, weight, targets, temperature):
+    log_softmax = (hidden @ weight.t()).float().div(temperature).log_softmax(dim=-1)
+    log_probs = log_softmax.gather(-1, targets.unsqueeze(-1)).squeeze(-1)
+    entropy = -(log_softmax.exp() * log_softmax).sum(dim=-1)
+    return log_probs, entropy
+
+
+def run(method, hidden, weight, targets, temperature, chunk_size):
+    if method == "full":
+        log_probs, entropy = full_logprobs(hidden, weight, targets, temperature)
+    elif method == "chunked":
+        log_probs, entropy, *_ = chunked_selective_log_softmax(
+            hidden, weight, None, targets, temperature, chunk_size, outputs=("log_probs", "entropy")
+        )
+    else:
+        log_probs, entropy, *_ = trl_utils._ChunkedLogProbFunction.apply(
+            hidden, weight, None, targets, temperature, trl_utils._CHUNKED_LOGPROB_CHUNK_SIZE,
+            None, 1.0, ("log_probs", "entropy")
+        )
+    (log_probs.sum() + 0.01 * entropy.sum()).backward()
+
+
+def make_inputs(num_tokens, args, device):
+    dtype = getattr(torch, args.dtype)
+    generator = torch.Generator().manual_seed(0)
+    hidden = torch.randn(num_tokens, args.hidden, generator=generator).to(device, dtype).requires_grad_()
+    # The LM head is frozen under LoRA; only the hidden states need gradients
+    weight = (torch.randn(args.vocab, args.hidden, generator=generator) * 0.02).to(device, dtype)
+    targets = torch.randint(args.vocab, (num_tokens,), generator=generator).to(device)
+    return hidden, weight, targets
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def cpu_peak(method, num_tokens, args, queue):
+    hidden, weight, targets = make_inputs(num_tokens, args, "cpu")
+    baseline = rss_bytes()
+    run(method, hidden, weight, targets, args.temperature, args.chunk_size)
+    queue.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - baseline)
+
+
+def measure(method, num_tokens, args):
+    """Peak bytes allocated on top of the inputs while scoring ``num_tokens`` tokens"""
+    if torch.cuda.is_available():
+        hidden, weight, targets = make_inputs(num_tokens, args, "cuda")
+        torch.cuda.synchronize()
+        baseline = torch.cuda.memory_allocated()
+        torch.cuda.reset_peak_memory_stats()
+        run(method, hidden, weight, targets, args.temperature, args.chunk_size)
+        torch.cuda.synchronize()
+        return torch.cuda.max_memory_allocated() - baseline
+
+    # Serve large allocations from mmap so freed logits leave the resident set
+    os.environ.setdefault("MALLOC_MMAP_THRESHOLD_", "65536")
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=cpu_peak, args=(method, num_tokens, args, queue))
+    process.start()
+    process.join()
+    return queue.get() if process.exitcode == 0 else float("inf")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vocab", type=int, default=151936)
+    parser.add_argument("--hidden", type=int, default=2048)
+    parser.add_argument("--completion-length", type=int, default=512)
+    parser.add_argument("--base-group", type=int, default=8, help="Group size whose full-logits peak sets the budget")
+    parser.add_argument("--max-group", type=int, default=256)
+    parser.add_argument("--chunk-size", type=int, default=256, help="Tokens per chunk of the chunked path")
+    parser.add_argument("--temperature", type=float, default=0.9)
+    parser.add_argument("--dtype", default="bfloat16" if torch.cuda.is_available() else "float32")
+    args = parser.parse_args()
+
+    methods = ["full", "chunked"]
+    if torch.cuda.is_available() and trl_utils._ChunkedLogProbFunction is not None:
+        methods.append("fused")
+
+    budget = measure("full", args.base_group * args.completion_length, args)
+    print(f"\nvocab {args.vocab}, hidden {args.hidden}, {args.completion_length} tokens per completion, {args.dtype}")
+    print(f"Budget: full-logits peak at group {args.base_group} = {budget / 2**20:.0f} MB\n")
+    print(f"{'method':>8} {'group':>6} {'tokens':>8} {'peak MB':>9}")
+
+    largest = {}
+    for method in methods:
+        group = 1
+        while group <= args.max_group:
+            num_tokens = group * args.completion_length
+            peak = measure(method, num_tokens, args)
+            # Allow for measurement noise, so the full path fits its own budget
+            if peak > 1.05 * budget:
+                break
+            print(f"{method:>8} {group:>6} {num_tokens:>8} {peak / 2**20:>9.0f}")
+            largest[method] = group
+            group *= 2
+
+    print()
+    for method in methods:
+        group = largest.get(method, 0)
+        print(f"Largest group in budget, {method:>8}: {group:>4} "
+              f"({group / args.base_group:g}x the group or completion length of the full path)")
+
+
+if __name__ == "__main__":
+    main()
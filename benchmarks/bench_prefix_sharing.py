@@ -0,0 +1,138 @@
+"""
+Shared-prefix group generation benchmark
+
+Generates GRPO-style batches (every prompt repeated --num-generations times)
+with plain model.generate and with generate_with_shared_prefix, which runs the
+vision encoder and the prompt prefill once per prompt and shares the KV cache
+across the group. Reports seconds per batch and checks that greedy outputs
+are identical.
+
+By default a tiny randomly initialized Qwen3-VL is built, so the benchmark
+runs on CPU without downloading weights (only the processor is loaded); pass
+--full-model to use the trained checkpoint.
+
+Usage:
+    python benchmarks/bench_prefix_sharing.py --num-prompts 2 --num-generations 4
+    python benchmarks/bench_prefix_sharing.py --full-model --max-new-tokens 128
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+from transformers import AutoProcessor, Qwen3VLConfig, Qwen3VLForConditionalGeneration
+
+from common import load_resized_image, generate_with_shared_prefix
+from grpo import GRPOConfig, SYSTEM_PROMPT
+
+
+def make_tiny_model(processor, seed=0):
+    tokenizer = processor.tokenizer
+    config = Qwen3VLConfig(
+        text_config=dict(
+            vocab_size=len(tokenizer), hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+            num_attention_heads=4, num_key_value_heads=2, head_dim=16,
+            rope_scaling={"rope_type": "default", "mrope_section": [2, 3, 3], "mrope_interleaved": True},
+        ),
+        vision_config=dict(
+            depth=2, hidden_size=32, intermediate_size=64, num_heads=2, out_hidden_size=64,
+            patch_size=processor.image_processor.patch_size, spatial_merge_size=processor.image_processor.merge_size,
+            temporal_patch_size=2, num_position_embeddings=64, deepstack_visual_indexes=[0],
+        ),
+        image_token_id=tokenizer.convert_tokens_to_ids("<|image_pad|>"),
+        video_token_id=tokenizer.convert_tokens_to_ids("<|video_pad|>"),
+        vision_start_token_id=tokenizer.convert_tokens_to_ids("<|vision_start|>"),
+        vision_end_token_id=tokenizer.convert_tokens_to_ids("<|vision_end|>"),
+    )
+    torch.manual_seed(seed)
+    model = Qwen3VLForConditionalGeneration(config)
+    model.generation_config.pad_token_id = tokenizer.pad_token_id
+    model.generation_config.eos_token_id = tokenizer.convert_tokens_to_ids("<|im_end|>")
+    return model
+
+
+def make_inputs(processor, image_dir, questions, num_generations, min_pixels, max_pixels):
+    image_paths = sorted(glob.glob(os.path.join(image_dir, "*.png")))[:len(questions)]
+    texts, images = [], []
+    for question, image_path in zip(questions, image_paths):
+        conversation = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": [{"type": "image"}, {"type": "text", "text": question}]}
+        ]
+        text = processor.apply_chat_template(conversation, tokenize=False, add_generation_prompt=True)
+        image = load_resized_image(image_path, min_pixels, max_pixels)
+        texts.extend([text] * num_generations)
+        images.extend([image] * num_generations)
+
+    tokenizer = processor.tokenizer
+    padding_side = tokenizer.padding_side
+    tokenizer.padding_side = "left"
+    try:
+        return processor(text=texts, images=images, padding=True, return_tensors="pt")
+    finally:
+        tokenizer.padding_side = padding_side
+
+
+def time_generate(func, repeats):
+    func()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        outputs = func()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--full-model", action="store_true", help="Benchmark the GRPO config model instead of a tiny one")
+    parser.add_argument("--image-dir", default="ChartQADataset/val/png")
+    parser.add_argument("--num-prompts", type=int, default=2)
+    parser.add_argument("--num-generations", type=int, default=4)
+    parser.add_argument("--max-new-tokens", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    config = GRPOConfig()
+    processor = AutoProcessor.from_pretrained(config.model_name, trust_remote_code=True)
+    if args.full_model:
+        model = Qwen3VLForConditionalGeneration.from_pretrained(
+            config.model_name, torch_dtype=torch.bfloat16, device_map="auto", trust_remote_code=True
+        )
+    else:
+        model = make_tiny_model(processor)
+    model.eval()
+
+    questions = [
+        "What is the highest value in the chart?",
+        "Which category has the lowest share?",
+        "What is the difference between the first and the last year?",
+        "How many bars are above 50?",
+    ]
+    questions = (questions * args.num_prompts)[:args.num_prompts]
+    inputs = make_inputs(
+        processor, args.image_dir, questions, args.num_generations, config.min_pixels, config.max_pixels
+    ).to(model.device)
+    generate_kwargs = {"max_new_tokens": args.max_new_tokens, "do_sample": False}
+
+    plain_s, plain = time_generate(lambda: model.generate(**inputs, **generate_kwargs), args.repeats)
+    shared_s, shared = time_generate(
+        lambda: generate_with_shared_prefix(model, args.num_generations, **inputs, **generate_kwargs), args.repeats
+    )
+
+    prompt_length = inputs["input_ids"].shape[1]
+    print(f"\n{args.num_prompts} prompts x {args.num_generations} generations, "
+          f"{prompt_length} prompt tokens, {args.max_new_tokens} new tokens")
+    print(f"{'plain':>8} {plain_s:>8.3f} s/batch")
+    print(f"{'shared':>8} {shared_s:>8.3f} s/batch ({plain_s / shared_s:.2f}x)")
+    print(f"Greedy outputs identical: {torch.equal(plain, shared)}")
+
+
+if __name__ == "__main__":
+    main()
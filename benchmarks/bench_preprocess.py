@@ -0,0 +1,68 @@
+"""
+SFT preprocessing throughput benchmark
+
+Processes the bundled ChartQA train PNGs into a fresh preprocessing cache with
+an increasing number of worker processes and reports samples/sec per setting.
+
+Usage:
+    python benchmarks/bench_preprocess.py --num-proc 1 2 4 8 --limit 256
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transformers import AutoProcessor
+
+from sft import get_config, load_json_data, PreprocessCache, preprocess_into_cache
+
+
+def benchmark_preprocess(processor, records, image_folder, system_prompt, num_proc):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = PreprocessCache(cache_dir, processor, system_prompt)
+        jobs = [
+            (cache.record_key(item, os.path.join(image_folder, item['image'])), item)
+            for item in records
+        ]
+        
+        start = time.perf_counter()
+        keys = preprocess_into_cache(jobs, image_folder, system_prompt, processor, cache, num_proc)
+        elapsed = time.perf_counter() - start
+    
+    return len(keys), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=None, help="Processor to benchmark (defaults to the SFT config model)")
+    parser.add_argument("--num-proc", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument("--limit", type=int, default=256, help="Number of records to process per setting")
+    args = parser.parse_args()
+    
+    config = get_config()
+    processor = AutoProcessor.from_pretrained(args.model or config.model.model_name, trust_remote_code=True)
+    
+    records = [
+        item for item in load_json_data(config.data.train_file)
+        if os.path.exists(os.path.join(config.data.train_images, item['image']))
+    ][:args.limit]
+    
+    results = []
+    for num_proc in sorted(set(args.num_proc)):
+        count, elapsed = benchmark_preprocess(
+            processor, records, config.data.train_images, config.system_prompt.prompt, num_proc
+        )
+        results.append((num_proc, count, elapsed))
+    
+    baseline = results[0][1] / results[0][2]
+    print(f"\n{'num_proc':>8} {'samples':>8} {'seconds':>8} {'samples/s':>10} {'speedup':>8}")
+    for num_proc, count, elapsed in results:
+        throughput = count / elapsed
+        print(f"{num_proc:>8} {count:>8} {elapsed:>8.2f} {throughput:>10.1f} {throughput / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
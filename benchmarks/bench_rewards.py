@@ -0,0 +1,115 @@
+"""
+GRPO reward throughput benchmark
+
+Times the group reward function on synthetic conversational completions
+against the previous per-completion loop (str() of the completion and one
+tokenizer.encode call per item), reported as milliseconds per 1k completions.
+
+Only token counting and the length reward are vectorized: token counts come
+from the generated ids (or one batched tokenizer call in the "no ids"
+column) and the length reward is a NumPy expression over the group. Format
+and accuracy are still checked once per completion in both versions, so
+they bound the speedup.
+
+Usage:
+    python benchmarks/bench_rewards.py --num-completions 1024 4096
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transformers import AutoProcessor
+
+from grpo import (
+    GRPOConfig,
+    compute_format_reward,
+    compute_accuracy_reward,
+    compute_length_reward,
+    create_reward_function,
+)
+
+
+def create_legacy_reward_function(processor, config):
+    """Reward function as it was before batching"""
+    def combined_reward_func(prompts, completions, ground_truth, **kwargs):
+        rewards = []
+        for completion, gt in zip(completions, ground_truth):
+            response = str(completion)
+            if "<|im_start|>assistant" in response:
+                response = response.split("<|im_start|>assistant")[-1].strip()
+            num_tokens = len(processor.tokenizer.encode(response, add_special_tokens=False))
+
+            r_format_w = config.lambda_format * compute_format_reward(response)
+            r_accuracy_w = config.lambda_accuracy * compute_accuracy_reward(response, gt)
+            r_length_w = config.lambda_length * compute_length_reward(num_tokens, config.target_length, config.max_length)
+            rewards.append(float(r_format_w * (r_accuracy_w + r_length_w) + r_format_w - 1.0))
+        return rewards
+    return combined_reward_func
+
+
+def make_completions(num_completions, tokenizer, seed=0):
+    rng = random.Random(seed)
+    words = ["bar", "value", "chart", "year", "the", "highest", "is", "shows", "percent", "market", "share"]
+    answers = ["Daifuku", "2094.6", "20%", "Yes", "No", "12", "0.35", "Asia Pacific"]
+    completions, ground_truths, completion_ids = [], [], []
+    for _ in range(num_completions):
+        answer = rng.choice(answers)
+        reasoning = " ".join(rng.choice(words) for _ in range(rng.randint(20, 300)))
+        style = rng.random()
+        if style < 0.4:
+            ending = f"{{answer: '{answer}'}}"
+        elif style < 0.8:
+            ending = f'{{"answer": "{answer}"}}'
+        else:
+            ending = f"The answer is {answer}."
+        text = f"<think>{reasoning}</think>\n{ending}"
+        completions.append([{"role": "assistant", "content": text}])
+        ground_truths.append(rng.choice(answers))
+        completion_ids.append(tokenizer.encode(text, add_special_tokens=False))
+    return completions, ground_truths, completion_ids
+
+
+def time_call(func, repeats, **kwargs):
+    func(**kwargs)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        rewards = func(**kwargs)
+    return (time.perf_counter() - start) / repeats, rewards
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=None, help="Processor to tokenize with (defaults to the GRPO config model)")
+    parser.add_argument("--num-completions", type=int, nargs="+", default=[1024, 4096])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    config = GRPOConfig()
+    processor = AutoProcessor.from_pretrained(args.model or config.model_name, trust_remote_code=True)
+    legacy = create_legacy_reward_function(processor, config)
+    batched = create_reward_function(processor, config)
+
+    print(f"\n{'completions':>12} {'legacy ms/1k':>13} {'batched ms/1k':>14} {'no ids ms/1k':>13} {'speedup':>8}")
+    for num_completions in args.num_completions:
+        completions, ground_truths, completion_ids = make_completions(num_completions, processor.tokenizer)
+        prompts = [None] * num_completions
+        scale = 1000 / num_completions * 1000
+
+        legacy_s, _ = time_call(legacy, args.repeats, prompts=prompts, completions=completions, ground_truth=ground_truths)
+        batched_s, _ = time_call(
+            batched, args.repeats, prompts=prompts, completions=completions,
+            ground_truth=ground_truths, completion_ids=completion_ids
+        )
+        no_ids_s, _ = time_call(batched, args.repeats, prompts=prompts, completions=completions, ground_truth=ground_truths)
+        print(
+            f"{num_completions:>12} {legacy_s * scale:>13.1f} {batched_s * scale:>14.1f} "
+            f"{no_ids_s * scale:>13.1f} {legacy_s / batched_s:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
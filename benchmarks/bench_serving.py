@@ -0,0 +1,97 @@
+"""
+Micro-batching server benchmark
+
+Replays ChartQA questions against serve.MicroBatcher with Poisson arrivals
+at --rate requests per second and reports p50/p99 latency, mean batch size
+and throughput for each --max-batch-sizes setting. A max batch size of 1
+answers requests one at a time, like the test_model.py loop.
+
+By default a tiny randomly initialized Qwen3-VL is built, so the benchmark
+runs on CPU without downloading weights (only the processor is loaded); pass
+--full-model to serve the checkpoint itself.
+
+Usage:
+    python benchmarks/bench_serving.py --num-requests 64 --rate 20
+    python benchmarks/bench_serving.py --full-model --rate 4 --max-batch-sizes 1 4 8 16
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+from transformers import AutoProcessor, Qwen3VLForConditionalGeneration
+
+from bench_prefix_sharing import make_tiny_model
+from serve import MicroBatcher, format_stats
+
+
+def load_requests(test_file, test_images, num_requests):
+    with open(test_file, 'r', encoding='utf-8') as f:
+        items = [item for item in json.load(f) if os.path.exists(os.path.join(test_images, item['image']))]
+    items = (items * num_requests)[:num_requests]
+    return [{"id": i, "image": item['image'], "question": item['question']} for i, item in enumerate(items)]
+
+
+def replay(batcher, requests, rate, seed=0):
+    """Submit ``requests`` with exponential inter-arrival times and wait for every answer"""
+    rng = random.Random(seed)
+    futures = []
+    next_arrival = time.perf_counter()
+    for request in requests:
+        delay = next_arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        futures.append(batcher.submit(request))
+        next_arrival += rng.expovariate(rate)
+    batcher.close()
+    return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="Nhaass/Qwen3-VL-2B-ChartQA-GRPO")
+    parser.add_argument("--full-model", action="store_true", help="Serve --model instead of a tiny model")
+    parser.add_argument("--test-file", default="ChartQADataset/val/val_augmented.json")
+    parser.add_argument("--test-images", default="ChartQADataset/val/png")
+    parser.add_argument("--num-requests", type=int, default=64)
+    parser.add_argument("--rate", type=float, default=20.0, help="Mean arrivals per second")
+    parser.add_argument("--max-batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--max-wait-ms", type=float, default=20.0)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    args = parser.parse_args()
+
+    processor = AutoProcessor.from_pretrained(args.model, trust_remote_code=True)
+    if args.full_model:
+        model = Qwen3VLForConditionalGeneration.from_pretrained(
+            args.model, torch_dtype=torch.float16, device_map="auto", trust_remote_code=True
+        )
+    else:
+        model = make_tiny_model(processor)
+    model.eval()
+    requests = load_requests(args.test_file, args.test_images, args.num_requests)
+
+    # Warm-up so the first timed batch does not pay for initialization
+    replay(MicroBatcher(model, processor, max_new_tokens=4, image_dir=args.test_images), requests[:2], args.rate)
+
+    print(f"\n{args.num_requests} requests at {args.rate:g}/s, max wait {args.max_wait_ms:g} ms, "
+          f"{args.max_new_tokens} new tokens")
+    for max_batch_size in args.max_batch_sizes:
+        batcher = MicroBatcher(
+            model,
+            processor,
+            max_batch_size=max_batch_size,
+            max_wait_ms=args.max_wait_ms,
+            max_new_tokens=args.max_new_tokens,
+            image_dir=args.test_images
+        )
+        replay(batcher, requests, args.rate)
+        print(f"max batch {max_batch_size:>3}: {format_stats(batcher.stats.summary())}")
+
+
+if __name__ == "__main__":
+    main()
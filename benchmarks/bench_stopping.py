@@ -0,0 +1,115 @@
+"""
+Answer early-stopping benchmark
+
+Generates greedy responses for ChartQA samples without an answer processor,
+with StopAfterAnswer and with ConstrainedAnswer, and reports generated
+tokens, wall-clock time per batch and the parse-failure rate (responses
+without an extractable answer) of each, plus how many extracted answers
+differ from the unconstrained run.
+
+Usage:
+    python benchmarks/bench_stopping.py --num-samples 64 --batch-size 8 --max-new-tokens 512
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+from transformers import AutoProcessor, Qwen3VLForConditionalGeneration
+
+from common import (
+    MIN_PIXELS,
+    MAX_PIXELS,
+    load_resized_image,
+    generate_batch,
+    StopAfterAnswer,
+    ConstrainedAnswer,
+    extract_answer,
+)
+from grpo import SYSTEM_PROMPT
+
+
+def make_batches(test_file, test_images, num_samples, batch_size, processor):
+    with open(test_file, 'r', encoding='utf-8') as f:
+        items = [item for item in json.load(f) if os.path.exists(os.path.join(test_images, item['image']))]
+    items = items[:num_samples]
+
+    batches = []
+    for start in range(0, len(items), batch_size):
+        texts, images = [], []
+        for item in items[start:start + batch_size]:
+            conversation = [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": [{"type": "image"}, {"type": "text", "text": item['question']}]}
+            ]
+            texts.append(processor.apply_chat_template(conversation, tokenize=False, add_generation_prompt=True))
+            images.append(load_resized_image(os.path.join(test_images, item['image']), MIN_PIXELS, MAX_PIXELS))
+        batches.append((texts, images))
+    return batches
+
+
+def run(model, processor, batches, max_new_tokens, answer_stop=None):
+    times, num_tokens, answers = [], [], []
+    for texts, images in batches:
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        responses, counts = generate_batch(
+            model, processor, texts, images, max_new_tokens=max_new_tokens, answer_stop=answer_stop
+        )
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+        num_tokens.extend(counts)
+        answers.extend(extract_answer(response) for response in responses)
+    return times, num_tokens, answers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="Nhaass/Qwen3-VL-2B-ChartQA-GRPO")
+    parser.add_argument("--test-file", default="ChartQADataset/val/val_augmented.json")
+    parser.add_argument("--test-images", default="ChartQADataset/val/png")
+    parser.add_argument("--num-samples", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=512)
+    args = parser.parse_args()
+
+    model = Qwen3VLForConditionalGeneration.from_pretrained(
+        args.model, torch_dtype=torch.float16, device_map="auto", trust_remote_code=True
+    )
+    model.eval()
+    processor = AutoProcessor.from_pretrained(args.model, trust_remote_code=True)
+    batches = make_batches(args.test_file, args.test_images, args.num_samples, args.batch_size, processor)
+
+    # Warm-up so the first timed batch does not pay for CUDA initialization
+    run(model, processor, batches[:1], 8)
+
+    answer_stop = StopAfterAnswer.for_model(model, processor.tokenizer)
+    constrained = ConstrainedAnswer.for_model(model, processor.tokenizer)
+    runs = {
+        name: run(model, processor, batches, args.max_new_tokens, answer_processor)
+        for name, answer_processor in (("full", None), ("stop at answer", answer_stop), ("constrained", constrained))
+    }
+    full_times, full_tokens, full_answers = runs["full"]
+
+    print(f"\n{'':>16} {'tokens/sample':>14} {'max tokens':>11} {'s/batch':>9} {'parse failures':>15} {'differ':>7}")
+    for name, (times, tokens, answers) in runs.items():
+        failures = sum(not answer for answer in answers)
+        differing = sum(full != answer for full, answer in zip(full_answers, answers))
+        print(f"{name:>16} {sum(tokens) / len(tokens):>14.1f} {max(tokens):>11} {sum(times) / len(times):>9.3f} "
+              f"{failures / len(answers):>15.1%} {differing:>7}")
+    for name in ("stop at answer", "constrained"):
+        times, tokens, _ = runs[name]
+        print(f"{name}: generated tokens {sum(tokens) / sum(full_tokens) - 1:+.1%}, "
+              f"wall-clock {sum(times) / sum(full_times) - 1:+.1%}")
+    print(f"Sequences stopped at their answer: {answer_stop.stopped}/{len(full_tokens)} (stop at answer), "
+          f"{constrained.stopped}/{len(full_tokens)} (constrained)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Shared utilities for ChartQA SFT, GRPO and evaluation
+
+Code that every stage of the pipeline has to agree on lives here, so the
+training and evaluation scripts see the same inputs.
+
+Main Components:
+    - Image preparation: fit_to_budget, load_resized_image, ImageStore, open_image_store,
+      ImageLRUCache
+    - Batched generation: length_sorted_batches, count_generated_tokens, generate_batch,
+      StopAfterAnswer, ConstrainedAnswer, generate_with_shared_prefix
+    - Answer parsing: extract_answer, has_answer_format, ends_with_answer, normalize_text,
+      normalize_ground_truth
+    - Scoring: parse_answer, relaxed_match, GroundTruthIndex (ChartQA relaxed accuracy)
+
+"""
+
+# Image preparation
+from .images import (
+    RESIZE_FACTOR,
+    MIN_PIXELS,
+    MAX_PIXELS,
+    fit_to_budget,
+    load_resized_image,
+    ImageStore,
+    ImageLRUCache,
+    open_image_store,
+)
+
+# Batched generation
+from .generation import (
+    length_sorted_batches,
+    count_generated_tokens,
+    StopAfterAnswer,
+    ConstrainedAnswer,
+    generate_with_shared_prefix,
+    generate_batch,
+)
+
+# Answer parsing
+from .answers import (
+    extract_answer,
+    has_answer_format,
+    ends_with_answer,
+    normalize_text,
+    normalize_ground_truth,
+)
+
+# Scoring
+from .scoring import (
+    RELAXED_TOLERANCE,
+    ParsedAnswer,
+    parse_answer,
+    relaxed_match,
+    GroundTruthIndex,
+)
+
+# Define public API
+__all__ = [
+    # Images
+    "RESIZE_FACTOR",
+    "MIN_PIXELS",
+    "MAX_PIXELS",
+    "fit_to_budget",
+    "load_resized_image",
+    "ImageStore",
+    "ImageLRUCache",
+    "open_image_store",
+    
+    # Generation
+    "length_sorted_batches",
+    "count_generated_tokens",
+    "StopAfterAnswer",
+    "ConstrainedAnswer",
+    "generate_with_shared_prefix",
+    "generate_batch",
+    
+    # Answers
+    "extract_answer",
+    "has_answer_format",
+    "ends_with_answer",
+    "normalize_text",
+    "normalize_ground_truth",
+    
+    # Scoring
+    "RELAXED_TOLERANCE",
+    "ParsedAnswer",
+    "parse_answer",
+    "relaxed_match",
+    "GroundTruthIndex",
+]
@@ -0,0 +1,69 @@
+import re
+from functools import lru_cache
+
+# {answer: 'x'}, {"answer": "x"}, {'answer': x}, ... with any spacing; the
+# value is everything up to the closing brace, quotes are stripped afterwards
+ANSWER_PATTERN = re.compile(r"""\{\s*["']?answer["']?\s*:\s*([^{}]*?)\s*\}""")
+FORMAT_MARKERS = ('{answer:', '{"answer":')
+
+_NON_ALNUM = re.compile(r'[^a-z0-9\s]+')
+_QUOTES = "\"'"
+
+
+def has_answer_format(text: str) -> bool:
+    """Whether a response contains the ``{answer: ...}`` marker the prompt asks for"""
+    return FORMAT_MARKERS[0] in text or FORMAT_MARKERS[1] in text
+
+
+def extract_answer(text: str) -> str:
+    """
+    Extract the final answer from a response
+
+    Takes the last ``{answer: ...}`` object in the text. Keys and values may
+    use single, double or no quotes, so numbers and unquoted words are
+    returned as they are written.
+
+    Args:
+        text: Model response
+
+    Returns:
+        Answer text, or an empty string when the response has no answer object
+    """
+    # Walk back from the last "answer" to the brace that opens its object;
+    # only when that is not an answer object try the previous occurrence
+    end = len(text)
+    while True:
+        key = text.rfind('answer', 0, end)
+        if key == -1:
+            return ""
+        start = text.rfind('{', 0, key)
+        if start == -1:
+            return ""
+        match = ANSWER_PATTERN.match(text, start)
+        if match is not None:
+            value = match.group(1)
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in _QUOTES:
+                value = value[1:-1]
+            return value.strip()
+        end = key
+
+
+def ends_with_answer(text: str) -> bool:
+    """Whether a response ends with a complete ``{answer: ...}`` object"""
+    text = text.rstrip()
+    if not text.endswith('}'):
+        return False
+    start = text.rfind('{')
+    match = ANSWER_PATTERN.match(text, start) if start != -1 else None
+    return match is not None and match.end() == len(text)
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, drop everything but letters, digits and spaces, collapse whitespace"""
+    return " ".join(_NON_ALNUM.sub('', text.lower()).split())
+
+
+@lru_cache(maxsize=65536)
+def normalize_ground_truth(ground_truth: str) -> str:
+    """``normalize_text`` of a ground truth, cached since every label is scored many times"""
+    return normalize_text(ground_truth)
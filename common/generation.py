@@ -0,0 +1,426 @@
+from typing import List, Optional, Sequence, Tuple
+
+import torch
+from transformers import LogitsProcessor, LogitsProcessorList
+
+from .answers import ends_with_answer
+
+
+def length_sorted_batches(lengths: Sequence[int], batch_size: int) -> List[List[int]]:
+    """
+    Group sample indices into batches of similar prompt length
+    
+    Indices are sorted longest first, so every batch pads to a length close to
+    that of its members and the largest batch runs first, which surfaces
+    out-of-memory errors at the start of a run.
+    
+    Args:
+        lengths: Prompt length of every sample
+        batch_size: Maximum number of samples per batch
+    
+    Returns:
+        List of batches of sample indices
+    """
+    order = sorted(range(len(lengths)), key=lambda idx: lengths[idx], reverse=True)
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+def _stop_token_ids(model, tokenizer) -> List[int]:
+    eos_token_id = getattr(model.generation_config, "eos_token_id", None)
+    if eos_token_id is None:
+        eos_token_id = tokenizer.eos_token_id
+    stop_ids = list(eos_token_id) if isinstance(eos_token_id, (list, tuple)) else [eos_token_id]
+    if tokenizer.pad_token_id is not None:
+        stop_ids.append(tokenizer.pad_token_id)
+    return [token_id for token_id in stop_ids if token_id is not None]
+
+
+def count_generated_tokens(completion_ids: torch.Tensor, stop_ids: Sequence[int]) -> List[int]:
+    """
+    Number of generated tokens before the first stop token of every row
+    
+    Args:
+        completion_ids: Generated ids without the prompt, shape (batch, length)
+        stop_ids: End-of-sequence and padding token ids
+    
+    Returns:
+        Token count per row
+    """
+    is_stop = torch.isin(completion_ids, torch.tensor(stop_ids, device=completion_ids.device))
+    has_stop = is_stop.any(dim=1)
+    first_stop = is_stop.int().argmax(dim=1)
+    lengths = torch.where(has_stop, first_stop, torch.full_like(first_stop, completion_ids.shape[1]))
+    return lengths.tolist()
+
+
+class StopAfterAnswer(LogitsProcessor):
+    """
+    Ends a sequence as soon as its ``{answer: ...}`` object is closed
+    
+    Everything after the answer is discarded by extraction and penalized by
+    the length reward, so once a generated token closes a brace and the
+    response ends with a complete answer object, the next token is forced to
+    end-of-sequence. Sequences end with a real EOS, so they are neither
+    reported as truncated nor masked as such. Only rows whose last token
+    contains ``}`` are decoded, and only their last ``window`` tokens. While
+    a ``<think>`` block is open, answers drafted in the reasoning are ignored.
+    
+    Set ``prompt_length`` to the padded prompt length before every
+    ``generate`` call so the prompt's own format example is never matched.
+    """
+    
+    def __init__(self, tokenizer, eos_token_id: int, window: int = 64):
+        self.tokenizer = tokenizer
+        self.eos_token_id = eos_token_id
+        self.window = window
+        self.prompt_length = 0
+        self.brace_ids = torch.tensor(
+            [token_id for token, token_id in tokenizer.get_vocab().items() if '}' in token], dtype=torch.long
+        )
+        think_ids = tokenizer.convert_tokens_to_ids(["<think>", "</think>"])
+        if None in think_ids or tokenizer.unk_token_id in think_ids:
+            think_ids = None
+        self.think_ids = think_ids
+        self.stopped = 0
+    
+    @classmethod
+    def for_model(cls, model, tokenizer, window: int = 64) -> "StopAfterAnswer":
+        """Processor that ends sequences with the model's end-of-sequence token"""
+        return cls(tokenizer, _stop_token_ids(model, tokenizer)[0], window)
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if input_ids.shape[1] <= self.prompt_length:
+            return scores
+        if self.brace_ids.device != input_ids.device:
+            self.brace_ids = self.brace_ids.to(input_ids.device)
+        
+        for row in torch.isin(input_ids[:, -1], self.brace_ids).nonzero().flatten().tolist():
+            if self.think_ids is not None:
+                opened = (input_ids[row] == self.think_ids[0]).sum()
+                closed = (input_ids[row] == self.think_ids[1]).sum()
+                if opened > closed:
+                    continue
+            start = max(self.prompt_length, input_ids.shape[1] - self.window)
+            if ends_with_answer(self.tokenizer.decode(input_ids[row, start:], skip_special_tokens=True)):
+                scores[row] = float("-inf")
+                scores[row, self.eos_token_id] = 0.0
+                self.stopped += 1
+        return scores
+
+
+_QUOTE_CHARS = "\"'"
+_ANSWER_KEY = "answer"
+
+
+def _advance_answer(state: Tuple, text: str) -> Optional[Tuple]:
+    """
+    Feed text to the ``{answer: ...}`` automaton, starting after the opening brace
+
+    States are ``(phase, key position, key quote, value quote)``. The grammar
+    is the one ``ANSWER_PATTERN`` accepts: an optionally quoted ``answer``
+    key, a colon, then a value in double or single quotes or a bare value,
+    and the closing brace; values never contain braces or newlines.
+
+    Returns:
+        The state after ``text``, or None when ``text`` leaves the grammar
+    """
+    phase, key_pos, key_quote, value_quote = state
+    for char in text:
+        if phase == "open":
+            if char in _QUOTE_CHARS:
+                phase, key_quote = "key", char
+            elif char == _ANSWER_KEY[0]:
+                phase, key_pos = "key", 1
+            elif not char.isspace():
+                return None
+        elif phase == "key":
+            if key_pos < len(_ANSWER_KEY):
+                if char != _ANSWER_KEY[key_pos]:
+                    return None
+                key_pos += 1
+            elif key_quote:
+                if char != key_quote:
+                    return None
+                phase = "colon"
+            elif char == ':':
+                phase = "value_start"
+            elif char.isspace():
+                phase = "colon"
+            else:
+                return None
+        elif phase == "colon":
+            if char == ':':
+                phase = "value_start"
+            elif not char.isspace():
+                return None
+        elif phase == "value_start":
+            if char in _QUOTE_CHARS:
+                phase, value_quote = "value", char
+            elif char in "{}\n":
+                return None
+            elif not char.isspace():
+                phase = "bare"
+        elif phase == "value":
+            if char == value_quote:
+                phase = "close"
+            elif char in "{}\n":
+                return None
+        elif phase == "bare":
+            if char == '}':
+                phase = "done"
+            elif char in "{\n":
+                return None
+        elif phase == "close":
+            if char == '}':
+                phase = "done"
+            elif not char.isspace():
+                return None
+        else:
+            return None
+    return phase, key_pos, key_quote, value_quote
+
+
+def _read_answer_key(state: Tuple) -> bool:
+    """Whether an automaton state is past the whole ``answer`` key"""
+    phase, key_pos = state[:2]
+    return phase != "open" and not (phase == "key" and key_pos < len(_ANSWER_KEY))
+
+
+class ConstrainedAnswer(StopAfterAnswer):
+    """
+    Constrains the answer object to the ``{answer: "..."}`` grammar once it is opened
+
+    The answer is opened by a brace generated after ``</think>``, or
+    elsewhere by a brace followed by the whole ``answer`` key (``{answer``,
+    ``{"answer"`` or ``{'answer'``). From then on every token is restricted
+    to those that keep the text a valid prefix of an answer object (see
+    ``_advance_answer``), end-of-sequence included only once the object is
+    closed, after which it is forced as in StopAfterAnswer. After
+    ``max_answer_tokens`` tokens inside the object only tokens that close the
+    value are allowed, so an answer is never cut off by ``max_new_tokens``.
+    Braces inside the ``<think>`` block, and braces outside it that are not
+    followed by the key, are left unconstrained.
+
+    The allowed tokens of every automaton state are computed from the decoded
+    vocabulary the first time the state is reached and cached.
+    """
+
+    def __init__(self, tokenizer, eos_token_id: int, window: int = 64, max_answer_tokens: int = 48):
+        super().__init__(tokenizer, eos_token_id, window)
+        self.max_answer_tokens = max_answer_tokens
+        # Special tokens decode to "" and are never allowed inside the object
+        self.token_strings = [
+            (token_id, text)
+            for token_id, text in enumerate(
+                tokenizer.batch_decode([[token_id] for token_id in range(len(tokenizer))], skip_special_tokens=True)
+            )
+            if text
+        ]
+        self.open_brace_ids = torch.tensor(
+            [token_id for token_id, text in self.token_strings if '{' in text], dtype=torch.long
+        )
+        self._allowed = {}
+        self.constrained = 0
+
+    @classmethod
+    def for_model(cls, model, tokenizer, window: int = 64, max_answer_tokens: int = 48) -> "ConstrainedAnswer":
+        """Processor that ends sequences with the model's end-of-sequence token"""
+        return cls(tokenizer, _stop_token_ids(model, tokenizer)[0], window, max_answer_tokens)
+
+    def _allowed_ids(self, state: Tuple) -> Tuple[torch.Tensor, torch.Tensor]:
+        """(token ids that keep the object valid, those of them that close the value or the object) in ``state``"""
+        if state not in self._allowed:
+            allowed, closing = [], []
+            for token_id, text in self.token_strings:
+                next_state = _advance_answer(state, text)
+                if next_state is not None:
+                    allowed.append(token_id)
+                    if next_state[0] == "done" or (next_state[0] == "close" and state[0] != "close"):
+                        closing.append(token_id)
+            self._allowed[state] = (torch.tensor(allowed, dtype=torch.long), torch.tensor(closing, dtype=torch.long))
+        return self._allowed[state]
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if input_ids.shape[1] <= self.prompt_length:
+            return scores
+        if self.open_brace_ids.device != input_ids.device:
+            self.open_brace_ids = self.open_brace_ids.to(input_ids.device)
+
+        generated = input_ids[:, self.prompt_length:]
+        positions = torch.arange(generated.shape[1], device=input_ids.device)
+        is_open = torch.isin(generated, self.open_brace_ids)
+        think_closed = torch.zeros(generated.shape[0], dtype=torch.bool, device=input_ids.device)
+        if self.think_ids is not None:
+            # Braces drafted inside the reasoning do not open the answer
+            thinking = (input_ids == self.think_ids[0]).sum(dim=1) > (input_ids == self.think_ids[1]).sum(dim=1)
+            think_end = torch.where(generated == self.think_ids[1], positions, -1).max(dim=1).values
+            is_open &= (positions > think_end.unsqueeze(1)) & ~thinking.unsqueeze(1)
+            think_closed = (think_end >= 0) & ~thinking
+        last_open = torch.where(is_open, positions, -1).max(dim=1).values
+        # Finished rows keep receiving padding until the whole batch is done
+        last_open[(generated == self.eos_token_id).any(dim=1)] = -1
+
+        for row in (last_open >= 0).nonzero().flatten().tolist():
+            start = int(last_open[row])
+            text = self.tokenizer.decode(generated[row, start:], skip_special_tokens=True)
+            state = _advance_answer(("open", 0, "", ""), text[text.rfind('{') + 1:])
+            if state is None:
+                continue
+            # Without a closed think block any brace may be prose until the answer key follows it
+            if not think_closed[row] and not _read_answer_key(state):
+                continue
+
+            if state[0] == "done":
+                allowed = torch.tensor([self.eos_token_id])
+                self.stopped += 1
+            else:
+                allowed, closing = self._allowed_ids(state)
+                if generated.shape[1] - start > self.max_answer_tokens and len(closing) > 0:
+                    allowed = closing
+                self.constrained += 1
+            allowed = allowed.to(scores.device)
+            row_scores = scores[row, allowed]
+            scores[row] = float("-inf")
+            scores[row, allowed] = row_scores
+        return scores
+
+
+# Per-image inputs of vision-language models; they are consumed by the prefill
+_IMAGE_INPUTS = ("pixel_values", "image_grid_thw")
+
+
+def _unique_row_images(input_ids, image_grid_thw, vision_start_token_id, num_generations):
+    """Indices of the images and pixel-value rows that belong to the first row of every group"""
+    images_per_row = (input_ids == vision_start_token_id).sum(dim=1)
+    if int(images_per_row.sum()) != image_grid_thw.shape[0]:
+        return None
+    
+    image_ends = images_per_row.cumsum(0)
+    patches = image_grid_thw.prod(dim=1)
+    patch_ends = patches.cumsum(0)
+    image_index, patch_index = [], []
+    for row in range(0, input_ids.shape[0], num_generations):
+        for image in range(int(image_ends[row] - images_per_row[row]), int(image_ends[row])):
+            image_index.append(image)
+            patch_index.extend(range(int(patch_ends[image] - patches[image]), int(patch_ends[image])))
+    device = image_grid_thw.device
+    return torch.tensor(image_index, device=device), torch.tensor(patch_index, device=device)
+
+
+@torch.no_grad()
+def generate_with_shared_prefix(model, num_generations: int, input_ids, attention_mask, generate=None, **kwargs):
+    """
+    ``model.generate`` for batches where every prompt is repeated ``num_generations`` times in a row
+    
+    The vision encoder and the prompt prefill run once per distinct prompt,
+    on all but its last token. The KV cache (and the multimodal RoPE offsets)
+    are then repeated for every sample of the group, and generation continues
+    from the cache: each sample feeds the last prompt token itself, so the
+    samples of a group still draw independent first tokens. Prompt cost is
+    paid once per group instead of ``num_generations`` times. Batches that
+    are not made of identical consecutive groups, or carry video inputs, are
+    generated normally.
+    
+    Args:
+        model: Causal or vision-language model
+        num_generations: Number of consecutive copies of every prompt
+        input_ids: Left-padded prompt ids, shape (batch, length)
+        attention_mask: Prompt attention mask
+        generate: ``generate`` to continue with, defaults to ``model.generate``
+        **kwargs: Other model inputs and generation arguments
+    
+    Returns:
+        Prompt and generated ids, as returned by ``generate``
+    """
+    generate = generate or model.generate
+    batch_size, prompt_length = input_ids.shape
+    groups = input_ids.view(-1, num_generations, prompt_length) if batch_size % num_generations == 0 else None
+    if (
+        num_generations == 1
+        or prompt_length < 2
+        or groups is None
+        or not (groups == groups[:, :1]).all()
+        or "video_grid_thw" in kwargs
+    ):
+        return generate(input_ids=input_ids, attention_mask=attention_mask, **kwargs)
+    
+    unique = slice(None, None, num_generations)
+    prefill_inputs = {"input_ids": input_ids[unique, :-1], "attention_mask": attention_mask[unique, :-1]}
+    generate_inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+    for key, value in list(kwargs.items()):
+        # Per-token inputs (token type ids) follow input_ids
+        if isinstance(value, torch.Tensor) and value.shape[:2] == (batch_size, prompt_length):
+            prefill_inputs[key] = value[unique, :-1]
+            generate_inputs[key] = kwargs.pop(key)
+    
+    if kwargs.get("image_grid_thw") is not None:
+        selected = _unique_row_images(
+            input_ids, kwargs["image_grid_thw"], model.config.vision_start_token_id, num_generations
+        )
+        if selected is None:
+            return generate(**generate_inputs, **kwargs)
+        image_index, patch_index = selected
+        prefill_inputs["image_grid_thw"] = kwargs["image_grid_thw"][image_index]
+        prefill_inputs["pixel_values"] = kwargs["pixel_values"][patch_index]
+    for key in _IMAGE_INPUTS:
+        kwargs.pop(key, None)
+    
+    past_key_values = model(**prefill_inputs, use_cache=True, logits_to_keep=1).past_key_values
+    past_key_values.batch_repeat_interleave(num_generations)
+    # Multimodal RoPE keeps per-row position offsets from the prefill
+    for module in model.modules():
+        rope_deltas = getattr(module, "rope_deltas", None)
+        if isinstance(rope_deltas, torch.Tensor) and rope_deltas.shape[0] == batch_size // num_generations:
+            module.rope_deltas = rope_deltas.repeat_interleave(num_generations, dim=0)
+    
+    return generate(**generate_inputs, past_key_values=past_key_values, **kwargs)
+
+
+@torch.no_grad()
+def generate_batch(
+    model,
+    processor,
+    texts: List[str],
+    images: List,
+    max_new_tokens: int = 256,
+    answer_stop: Optional[StopAfterAnswer] = None,
+    **generate_kwargs
+) -> Tuple[List[str], List[int]]:
+    """
+    Generate responses for a batch of chat prompts with left padding
+    
+    Args:
+        model: Vision-language model
+        processor: Model processor
+        texts: Prompts with the chat template applied
+        images: One image per prompt
+        max_new_tokens: Maximum number of generated tokens
+        answer_stop: Ends each response once its answer object is closed
+            (a ConstrainedAnswer also keeps the object well-formed)
+        **generate_kwargs: Extra arguments for ``model.generate``
+    
+    Returns:
+        (responses, token counts) where responses are decoded without the
+        prompt and counts are taken from the generated ids
+    """
+    tokenizer = processor.tokenizer
+    padding_side = tokenizer.padding_side
+    tokenizer.padding_side = "left"
+    try:
+        inputs = processor(text=texts, images=images, padding=True, return_tensors="pt").to(model.device)
+    finally:
+        tokenizer.padding_side = padding_side
+    
+    generate_kwargs.setdefault("do_sample", False)
+    if answer_stop is not None:
+        answer_stop.prompt_length = inputs["input_ids"].shape[1]
+        generate_kwargs["logits_processor"] = LogitsProcessorList(
+            [*generate_kwargs.get("logits_processor", []), answer_stop]
+        )
+    outputs = model.generate(**inputs, max_new_tokens=max_new_tokens, **generate_kwargs)
+    
+    # With left padding every prompt ends at the same position
+    completion_ids = outputs[:, inputs["input_ids"].shape[1]:]
+    num_tokens = count_generated_tokens(completion_ids, _stop_token_ids(model, tokenizer))
+    responses = processor.batch_decode(completion_ids, skip_special_tokens=True)
+    return [response.strip() for response in responses], num_tokens
@@ -0,0 +1,292 @@
+import fcntl
+import json
+import math
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+# Qwen3-VL: 16px patches merged 2x2, so image sides are multiples of 32
+RESIZE_FACTOR = 32
+MIN_PIXELS = 256 * 256
+MAX_PIXELS = 800 * 800
+
+
+def fit_to_budget(
+    height: int,
+    width: int,
+    min_pixels: int = MIN_PIXELS,
+    max_pixels: int = MAX_PIXELS,
+    factor: int = RESIZE_FACTOR
+) -> Tuple[int, int]:
+    """
+    Target size of an image under a pixel budget
+
+    Both sides are rounded to a multiple of ``factor`` and the area is scaled
+    into ``[min_pixels, max_pixels]`` keeping the aspect ratio, which is the
+    rule the Qwen-VL processor applies, so pre-resized images pass through
+    the processor unchanged.
+
+    Args:
+        height: Image height
+        width: Image width
+        min_pixels: Minimum number of pixels
+        max_pixels: Maximum number of pixels
+        factor: Side length granularity
+
+    Returns:
+        (height, width) after resizing
+    """
+    resized_height = round(height / factor) * factor
+    resized_width = round(width / factor) * factor
+
+    if resized_height * resized_width > max_pixels:
+        scale = math.sqrt(height * width / max_pixels)
+        resized_height = max(factor, math.floor(height / scale / factor) * factor)
+        resized_width = max(factor, math.floor(width / scale / factor) * factor)
+    elif resized_height * resized_width < min_pixels:
+        scale = math.sqrt(min_pixels / (height * width))
+        resized_height = math.ceil(height * scale / factor) * factor
+        resized_width = math.ceil(width * scale / factor) * factor
+
+    return resized_height, resized_width
+
+
+def load_resized_image(
+    image_path: str,
+    min_pixels: int = MIN_PIXELS,
+    max_pixels: int = MAX_PIXELS,
+    factor: int = RESIZE_FACTOR
+) -> Image.Image:
+    """Decode an image as RGB and resize it to the pixel budget"""
+    image = Image.open(image_path).convert("RGB")
+    height, width = fit_to_budget(image.height, image.width, min_pixels, max_pixels, factor)
+    if (height, width) != (image.height, image.width):
+        image = image.resize((width, height), Image.Resampling.LANCZOS)
+    return image
+
+
+class ImageStore:
+    """
+    Decoded, pre-resized images shared by SFT, GRPO and evaluation
+
+    Images are decoded and resized to the pixel budget once, then appended as
+    raw uint8 HxWx3 arrays to a single shard file that is memory-mapped for
+    reading. ``index.json`` maps every source path to its offset and shape,
+    together with the source size and mtime so modified files are redone.
+    Each budget gets its own subdirectory of ``store_dir``.
+
+    Writers hold an exclusive lock on the store while appending, so processes
+    sharing a store never interleave records; readers need no lock because
+    the shard is append-only. Fill the store from one process per machine.
+    """
+
+    # Images appended between index writes, bounding what a crash loses
+    index_interval = 256
+
+    def __init__(
+        self,
+        store_dir: str,
+        min_pixels: int = MIN_PIXELS,
+        max_pixels: int = MAX_PIXELS,
+        factor: int = RESIZE_FACTOR
+    ):
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        self.factor = factor
+        self.store_dir = os.path.join(store_dir, f"{min_pixels}-{max_pixels}-{factor}")
+        self.shard_path = os.path.join(self.store_dir, "images.u8")
+        self.index_path = os.path.join(self.store_dir, "index.json")
+        self.lock_path = os.path.join(self.store_dir, "lock")
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.index: Dict[str, Dict] = {}
+        self._read_index()
+        self._shard = None
+
+    def _read_index(self) -> None:
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+
+    def _write_index(self) -> None:
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def _source_stamp(image_path: str) -> Tuple[int, float]:
+        stat = os.stat(image_path)
+        return stat.st_size, stat.st_mtime
+
+    def _key(self, image_path: str) -> str:
+        return os.path.abspath(image_path)
+
+    def contains(self, image_path: str) -> bool:
+        entry = self.index.get(self._key(image_path))
+        if entry is None:
+            return False
+        size, mtime = self._source_stamp(image_path)
+        return entry["source_size"] == size and entry["source_mtime"] == mtime
+
+    def add(self, image_paths: Iterable[str]) -> int:
+        """
+        Decode, resize and append images that are missing or outdated
+
+        The index is re-read under the lock, so images another process added
+        in the meantime are not written twice, and it is rewritten every
+        ``index_interval`` images and at the end.
+
+        Args:
+            image_paths: Paths of source images
+
+        Returns:
+            Number of images written
+        """
+        image_paths = [path for path in image_paths if os.path.exists(path)]
+        if all(self.contains(path) for path in image_paths):
+            return 0
+
+        with open(self.lock_path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._read_index()
+            # Entries read from disk may point past the end of the current memory map
+            self._shard = None
+            missing = [path for path in image_paths if not self.contains(path)]
+            if not missing:
+                return 0
+
+            with open(self.shard_path, 'ab') as shard:
+                # Offsets come from the shard itself: bytes of records whose index
+                # entry was lost in a crash are skipped, never overwritten
+                offset = shard.seek(0, os.SEEK_END)
+                for written, image_path in enumerate(tqdm(missing, desc="Resizing images"), start=1):
+                    try:
+                        image = load_resized_image(image_path, self.min_pixels, self.max_pixels, self.factor)
+                    except Exception as e:
+                        print(f"Error loading image {image_path}: {e}")
+                        continue
+
+                    pixels = np.asarray(image, dtype=np.uint8)
+                    shard.write(pixels.tobytes())
+                    size, mtime = self._source_stamp(image_path)
+                    self.index[self._key(image_path)] = {
+                        "offset": offset,
+                        "height": pixels.shape[0],
+                        "width": pixels.shape[1],
+                        "source_size": size,
+                        "source_mtime": mtime,
+                    }
+                    offset += pixels.nbytes
+                    if written % self.index_interval == 0:
+                        # Records must be on disk before the index points at them
+                        shard.flush()
+                        self._write_index()
+
+            self._write_index()
+
+        return len(missing)
+
+    def size(self, image_path: str) -> Tuple[int, int]:
+        """(width, height) of a stored image"""
+        entry = self.index[self._key(image_path)]
+        return entry["width"], entry["height"]
+
+    def load_array(self, image_path: str) -> np.ndarray:
+        """Read-only HxWx3 uint8 view of a stored image"""
+        entry = self.index[self._key(image_path)]
+        if self._shard is None:
+            self._shard = np.memmap(self.shard_path, dtype=np.uint8, mode='r')
+        num_bytes = entry["height"] * entry["width"] * 3
+        flat = self._shard[entry["offset"]:entry["offset"] + num_bytes]
+        return flat.reshape(entry["height"], entry["width"], 3)
+
+    def load(self, image_path: str) -> Image.Image:
+        """
+        Load an image at the store's budget
+
+        Falls back to decoding and resizing the source when the image has not
+        been added to the store yet.
+        """
+        if not self.contains(image_path):
+            return load_resized_image(image_path, self.min_pixels, self.max_pixels, self.factor)
+        return Image.fromarray(np.array(self.load_array(image_path)))
+
+    def __getstate__(self):
+        # Memory maps are reopened lazily in every worker process
+        state = self.__dict__.copy()
+        state["_shard"] = None
+        return state
+
+
+class ImageLRUCache:
+    """
+    Least-recently-used cache of decoded images bounded by memory size
+
+    The size of an entry is its raw pixel buffer (width * height * bands), so
+    ``max_mb`` bounds the decoded pixel memory held by the cache. Every
+    DataLoader worker holds its own cache.
+    """
+
+    def __init__(self, max_mb: float = 512):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Image.Image]" = OrderedDict()
+
+    @staticmethod
+    def _image_bytes(image: Image.Image) -> int:
+        return image.width * image.height * len(image.getbands())
+
+    def get(self, key: str) -> Optional[Image.Image]:
+        image = self._entries.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def put(self, key: str, image: Image.Image) -> None:
+        num_bytes = self._image_bytes(image)
+        if num_bytes > self.max_bytes or key in self._entries:
+            return
+        self._entries[key] = image
+        self.num_bytes += num_bytes
+        while self.num_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.num_bytes -= self._image_bytes(evicted)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def open_image_store(
+    store_dir: Optional[str],
+    image_paths: Iterable[str] = (),
+    min_pixels: int = MIN_PIXELS,
+    max_pixels: int = MAX_PIXELS
+) -> Optional[ImageStore]:
+    """
+    Open (and fill) the image store, or return None when disabled
+
+    Args:
+        store_dir: Root directory of the store, None to disable it
+        image_paths: Images to make sure are present
+        min_pixels: Minimum number of pixels per image
+        max_pixels: Maximum number of pixels per image
+
+    Returns:
+        Image store or None
+    """
+    if store_dir is None:
+        return None
+    store = ImageStore(store_dir, min_pixels=min_pixels, max_pixels=max_pixels)
+    added = store.add(image_paths)
+    print(f"Image store: {len(store.index)} images, {added} added ({store.store_dir})")
+    return store
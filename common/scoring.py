@@ -0,0 +1,164 @@
+import json
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Union
+
+# ChartQA relaxed accuracy: numeric answers within 5% of the target count as correct
+RELAXED_TOLERANCE = 0.05
+
+_NUMBER = re.compile(r'[-+]?(?:\d{1,3}(?:,\d{3})+|\d+)?(?:\.\d+)?')
+_CURRENCY = "$€£¥"
+_PERCENT_SUFFIXES = ("%", "percent", "per cent")
+# Scale words are kept and compared; charts often state the scale on the axis only,
+# so a value with a scale also matches a target written without one
+_SCALES = {
+    "thousand": 1e3, "k": 1e3,
+    "million": 1e6, "mn": 1e6, "m": 1e6,
+    "billion": 1e9, "bn": 1e9, "b": 1e9,
+    "trillion": 1e12,
+}
+# Other units written after a value are dropped
+_UNIT_SUFFIXES = ("dollars", "usd", "euros", "eur", "points", "pts", "people", "years")
+# Like normalize_text, but a separator between two digits is kept, so "1,5" and "15" stay apart
+_TEXT_DROP = re.compile(r'(?!(?<=\d)[.,](?=\d))[^a-z0-9\s]')
+
+
+@dataclass(frozen=True)
+class ParsedAnswer:
+    """An answer normalized once: its text form and, when numeric, its value and scale"""
+    text: str
+    number: Optional[float] = None
+    is_percent: bool = False
+    scale: Optional[float] = None
+
+
+def parse_answer(answer: str) -> ParsedAnswer:
+    """
+    Parse an answer into its normalized text and numeric value
+
+    Currency symbols, thousands separators, percent signs and trailing unit
+    words are handled, so "$2,094.6", "2094.6 million" and "2094.6" share the
+    value 2094.6. Percentages keep their written value and are flagged, and
+    scale words ("million", "bn", "k", ...) are recorded in ``scale``.
+    Separators only make a number when the digit grouping is valid.
+
+    Args:
+        answer: Answer as written in the dataset or by the model
+
+    Returns:
+        Parsed answer
+    """
+    text = " ".join(_TEXT_DROP.sub('', answer.lower()).split())
+    value = answer.strip().lower().lstrip(_CURRENCY).strip()
+
+    is_percent = False
+    scale = None
+    for suffix in _PERCENT_SUFFIXES:
+        if value.endswith(suffix):
+            value, is_percent = value[:-len(suffix)].rstrip(), True
+            break
+    else:
+        head, _, unit = value.rpartition(" ")
+        if head and unit in _SCALES:
+            value, scale = head.rstrip(), _SCALES[unit]
+        elif head and unit in _UNIT_SUFFIXES:
+            value = head.rstrip()
+        else:
+            # Scales attached to the digits: "3k", "1.2bn"
+            for unit in ("bn", "mn", "m", "k", "b"):
+                if value.endswith(unit) and value[:-len(unit)][-1:].isdigit():
+                    value, scale = value[:-len(unit)], _SCALES[unit]
+                    break
+
+    value = value.lstrip(_CURRENCY)
+    if any(char.isdigit() for char in value) and _NUMBER.fullmatch(value):
+        return ParsedAnswer(text, float(value.replace(",", "")), is_percent, scale)
+    return ParsedAnswer(text)
+
+
+def _within_tolerance(prediction: float, target: float, tolerance: float) -> bool:
+    if target == 0:
+        return prediction == 0
+    return abs(prediction - target) / abs(target) <= tolerance
+
+
+def relaxed_match(
+    prediction: Union[str, ParsedAnswer],
+    target: Union[str, ParsedAnswer],
+    tolerance: float = RELAXED_TOLERANCE
+) -> bool:
+    """
+    ChartQA relaxed accuracy of one prediction
+
+    Numeric answers match when within ``tolerance`` relative error of the
+    target; when only one side is written as a percentage, the fraction form
+    ("0.2" for "20%") is accepted as well. When both sides state a scale,
+    the scaled values are compared ("2 million" matches "2000 thousand" but
+    not "2 billion"); a scale on one side only is taken to be the axis scale.
+    Other answers must match exactly after normalization.
+
+    Args:
+        prediction: Predicted answer
+        target: Ground-truth answer
+        tolerance: Relative tolerance for numeric answers
+
+    Returns:
+        Whether the prediction is correct
+    """
+    if isinstance(prediction, str):
+        prediction = parse_answer(prediction)
+    if isinstance(target, str):
+        target = parse_answer(target)
+
+    if prediction.number is not None and target.number is not None:
+        if prediction.scale is not None and target.scale is not None:
+            return _within_tolerance(prediction.number * prediction.scale, target.number * target.scale, tolerance)
+        if _within_tolerance(prediction.number, target.number, tolerance):
+            return True
+        if prediction.is_percent != target.is_percent:
+            scale = 100.0 if prediction.is_percent else 0.01
+            return _within_tolerance(prediction.number, target.number * scale, tolerance)
+        return False
+
+    return bool(target.text) and prediction.text == target.text
+
+
+class GroundTruthIndex:
+    """
+    Ground truths parsed once, looked up by their label string
+
+    Built from the dataset files at load time so that scoring a rollout is a
+    dictionary lookup and a numeric compare. Labels that were not indexed are
+    parsed on first use and kept.
+    """
+
+    def __init__(self, labels: Iterable[str] = ()):
+        self.entries: Dict[str, ParsedAnswer] = {}
+        self.add(labels)
+
+    @classmethod
+    def from_files(cls, data_files: Iterable[Optional[str]]) -> "GroundTruthIndex":
+        """Index the labels of every record of the given dataset JSON files"""
+        index = cls()
+        for data_file in data_files:
+            if not data_file:
+                continue
+            with open(data_file, 'r', encoding='utf-8') as f:
+                index.add(item['label'] for item in json.load(f))
+        return index
+
+    def add(self, labels: Iterable[str]) -> None:
+        for label in labels:
+            label = str(label)
+            if label not in self.entries:
+                self.entries[label] = parse_answer(label)
+
+    def __getitem__(self, label: str) -> ParsedAnswer:
+        label = str(label)
+        parsed = self.entries.get(label)
+        if parsed is None:
+            parsed = self.entries[label] = parse_answer(label)
+        return parsed
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -8,10 +8,15 @@ and training utilities.
 Main Components:
     - GRPOConfig: Configuration dataclass for GRPO training parameters
     - Model loading utilities: load_model, load_processor
-    - Data utilities: ChartQAGRPODataset, load_datasets
-    - Reward functions: compute_format_reward, compute_accuracy_reward, compute_length_reward
-    - Training: create_grpo_trainer, create_reward_function
-    - Callbacks: RewardLoggingCallback
+    - Data utilities: ChartQAGRPODataset, LazyImageTransform, load_datasets
+    - Reward functions: compute_format_reward, compute_accuracy_reward, compute_length_reward,
+      group-level compute_reward_components / combine_rewards, RewardCache
+    - Reward execution: RewardExecutor (thread/process/async pools with timeouts)
+    - Curriculum: PromptDifficultyTracker, CurriculumSampler
+    - Rollout reuse: RolloutStore (on-disk rollouts replayed within a staleness window)
+    - Log-probs: chunked_selective_log_softmax, chunked_logprob_kernel (memory-bounded LM head)
+    - Training: FilteredGRPOTrainer, create_grpo_trainer, create_reward_function
+    - Callbacks: RewardLoggingCallback, CurriculumCallback
 
 """
 
@@ -30,6 +35,7 @@ from .model import (
 # Data utilities
 from .data_loader import (
     ChartQAGRPODataset,
+    LazyImageTransform,
     load_datasets,
     SYSTEM_PROMPT,
 )
@@ -38,17 +44,53 @@ from .data_loader import (
 from .rewards import (
     normalize_text,
     extract_answer,
+    completion_to_text,
     compute_format_reward,
     compute_accuracy_reward,
     compute_length_reward,
+    compute_format_rewards,
+    compute_accuracy_rewards,
+    compute_length_rewards,
+    count_completion_tokens,
+    compute_reward_components,
+    combine_rewards,
+    RewardCache,
     create_reward_function,
 )
 
+# Reward execution
+from .reward_executor import (
+    RewardTask,
+    RewardExecutor,
+)
+
+# Curriculum
+from .curriculum import (
+    CURRICULUM_STATE_FILE,
+    PromptDifficultyTracker,
+    CurriculumSampler,
+)
+
+# Rollout reuse
+from .rollouts import RolloutStore
+
+# Log-probs
+from .logprobs import (
+    chunked_selective_log_softmax,
+    chunked_logprob_kernel,
+)
+
 # Trainer utilities
-from .trainer import create_grpo_trainer
+from .trainer import (
+    FilteredGRPOTrainer,
+    create_grpo_trainer,
+)
 
 # Callbacks
-from .callbacks import RewardLoggingCallback
+from .callbacks import (
+    RewardLoggingCallback,
+    CurriculumCallback,
+)
 
 # Define public API
 __all__ = [
@@ -65,20 +107,47 @@ __all__ = [
     
     # Data
     "ChartQAGRPODataset",
+    "LazyImageTransform",
     "load_datasets",
     "SYSTEM_PROMPT",
     
     # Rewards
     "normalize_text",
     "extract_answer",
+    "completion_to_text",
     "compute_format_reward",
     "compute_accuracy_reward",
     "compute_length_reward",
+    "compute_format_rewards",
+    "compute_accuracy_rewards",
+    "compute_length_rewards",
+    "count_completion_tokens",
+    "compute_reward_components",
+    "combine_rewards",
+    "RewardCache",
     "create_reward_function",
     
+    # Reward execution
+    "RewardTask",
+    "RewardExecutor",
+    
+    # Curriculum
+    "CURRICULUM_STATE_FILE",
+    "PromptDifficultyTracker",
+    "CurriculumSampler",
+    
+    # Rollout reuse
+    "RolloutStore",
+    
+    # Log-probs
+    "chunked_selective_log_softmax",
+    "chunked_logprob_kernel",
+    
     # Training
+    "FilteredGRPOTrainer",
     "create_grpo_trainer",
     
     # Callbacks
     "RewardLoggingCallback",
+    "CurriculumCallback",
 ]
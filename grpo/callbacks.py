@@ -1,9 +1,15 @@
+import os
+
 import torch
 from transformers import TrainerCallback
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
+
+from .curriculum import CURRICULUM_STATE_FILE
 
 class RewardLoggingCallback(TrainerCallback):
-    def __init__(self):
+    def __init__(self, reward_cache=None):
         self.step_metrics = []
+        self.reward_cache = reward_cache
     
     def on_log(self, args, state, control, logs=None, **kwargs):
         if logs is not None:
@@ -20,6 +26,11 @@ class RewardLoggingCallback(TrainerCallback):
                 'completions_mean_length': logs.get('completions/mean_length', 0),
                 'completions_clipped_ratio': logs.get('completions/clipped_ratio', 0),
                 'clip_ratio_region': logs.get('clip_ratio/region_mean', 0),
+                'reward_format': logs.get('rewards/format/mean', 0),
+                'reward_accuracy': logs.get('rewards/accuracy/mean', 0),
+                'reward_length': logs.get('rewards/length/mean', 0),
+                'reward_var': logs.get('curriculum/reward_var'),
+                'signal_per_gpu_hour': logs.get('curriculum/signal_per_gpu_hour'),
                 'lr': logs.get('learning_rate', 0),
                 'step_time': logs.get('step_time', 0),
             }
@@ -31,7 +42,13 @@ class RewardLoggingCallback(TrainerCallback):
             print(f"{'='*80}")
             print(f"  Loss:           {metrics['loss']:.4f}")
             print(f"  Reward:         {metrics['reward_mean']:.4f} ± {metrics['reward_std']:.4f}")
+            print(f"  Components:     format {metrics['reward_format']:.3f} | accuracy {metrics['reward_accuracy']:.3f} | length {metrics['reward_length']:.3f}")
+            if self.reward_cache is not None:
+                cache = self.reward_cache
+                print(f"  Reward Cache:   {cache.hits} hits / {cache.misses} misses ({cache.hit_rate:.1%}), {len(cache)} entries")
             print(f"  Zero Std Frac:  {metrics['frac_reward_zero_std']:.2%}")
+            if metrics['reward_var'] is not None:
+                print(f"  Curriculum:     group reward var {metrics['reward_var']:.4f} | {metrics['signal_per_gpu_hour']:.1f} informative groups/GPU-hour")
             print(f"  KL Divergence:  {metrics['kl']:.6f}")
             print(f"  Entropy:        {metrics['entropy']:.4f}")
             print(f"  Completion Len: {metrics['completions_mean_length']:.1f} tokens")
@@ -42,3 +59,18 @@ class RewardLoggingCallback(TrainerCallback):
                 print(f"  GPU Memory:     {gpu_mem:.2f} GB")
             
             print(f"{'='*80}\n")
+
+class CurriculumCallback(TrainerCallback):
+    """Saves the prompt difficulty tracker into every checkpoint and the output directory at the end of training"""
+    
+    def __init__(self, tracker):
+        self.tracker = tracker
+    
+    def on_save(self, args, state, control, **kwargs):
+        if state.is_world_process_zero:
+            checkpoint_dir = os.path.join(args.output_dir, f"{PREFIX_CHECKPOINT_DIR}-{state.global_step}")
+            self.tracker.save(os.path.join(checkpoint_dir, CURRICULUM_STATE_FILE))
+    
+    def on_train_end(self, args, state, control, **kwargs):
+        if state.is_world_process_zero:
+            self.tracker.save(os.path.join(args.output_dir, CURRICULUM_STATE_FILE))
@@ -1,4 +1,7 @@
 from dataclasses import dataclass
+from typing import Optional
+
+from common import MIN_PIXELS, MAX_PIXELS
 
 @dataclass
 class GRPOConfig:
@@ -11,15 +14,42 @@ class GRPOConfig:
     
     max_new_tokens: int = 512
     temperature: float = 0.9
+    stop_at_answer: bool = False
+    constrain_answer: bool = False
+    share_prompt_prefill: bool = False
     
     lambda_format: float = 1.0
     lambda_accuracy: float = 1.0
     lambda_length: float = 0.5
     
+    relaxed_tolerance: float = 0.05
+    reward_cache_size: int = 4096
+    
+    # serial ignores reward_timeout and thread cannot abort a hung scorer; use process for hard timeouts
+    reward_backend: str = "serial"
+    reward_workers: int = 4
+    reward_timeout: Optional[float] = 30.0
+    reward_chunk_size: Optional[int] = None
+    
     target_length: int = 200
     max_length: int = 256
     
+    filter_zero_std_groups: bool = True
+    oversample_factor: int = 1
+    
+    curriculum_sampling: bool = False
+    curriculum_momentum: float = 0.7
+    curriculum_min_weight: float = 0.02
+    
+    rollout_store_dir: Optional[str] = None
+    reuse_rollouts: bool = False
+    rollout_staleness: int = 4
+    
+    logprob_backend: str = "auto"
+    logprob_chunk_size: int = 256
+    
     kl_coef: float = 0.1
+    num_iterations: int = 1
     clip_range: float = 0.2
     
     train_file: str = "ChartQADataset/train/train_augmented.json"
@@ -27,3 +57,11 @@ class GRPOConfig:
     val_file: str = "ChartQADataset/val/val_augmented.json"
     val_images: str = "ChartQADataset/val/png"
     output_dir: str = "./grpo_checkpoints"
+    resume_from_checkpoint: Optional[str] = None
+    
+    image_store_dir: Optional[str] = "cache/images"
+    min_pixels: int = MIN_PIXELS
+    max_pixels: int = MAX_PIXELS
+    
+    lazy_images: bool = True
+    image_cache_mb: int = 512
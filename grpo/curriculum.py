@@ -0,0 +1,143 @@
+import json
+import os
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+from trl.trainer.utils import RepeatSampler
+
+# Name of the tracker state saved in every checkpoint directory
+CURRICULUM_STATE_FILE = "curriculum_state.json"
+
+class PromptDifficultyTracker:
+    """
+    Running success rate of every training prompt
+    
+    The reward function records which completions were correct; after each
+    generation batch the trainer applies the records (gathered from every
+    process, so all ranks hold the same rates). A prompt's rate is an
+    exponential moving average of its groups' pass rates, starting from
+    ``prior`` until it has been seen. Rates are saved as JSON in every
+    checkpoint and loaded from ``path`` only when training resumes from one,
+    so a fresh run never inherits another run's statistics.
+    """
+    
+    def __init__(self, path: Optional[str] = None, momentum: float = 0.7, prior: float = 0.5, min_weight: float = 0.02):
+        self.path = path
+        self.momentum = momentum
+        self.prior = prior
+        self.min_weight = min_weight
+        self.rates: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.pending: List[tuple] = []
+        
+        # Learning-signal accounting for curriculum metrics
+        self.informative_groups = 0
+        self.gpu_seconds = 0.0
+        self._last_update = None
+        
+        if path and os.path.exists(path):
+            self.load(path)
+    
+    def record(self, prompt_ids: Sequence[str], successes: Sequence[bool], rewards: Sequence[float]) -> None:
+        """Queue the outcome of scored completions until the next ``update``"""
+        self.pending.extend(zip(prompt_ids, (bool(s) for s in successes), (float(r) for r in rewards)))
+    
+    def update(self, records: Sequence[tuple], num_gpus: int = 1) -> Dict[str, float]:
+        """
+        Fold a generation batch into the running rates
+        
+        Args:
+            records: (prompt id, success, reward) of every completion of the batch
+            num_gpus: Number of processes the batch was generated on
+        
+        Returns:
+            Batch metrics: mean within-group reward variance, informative
+            group count and learning signal per GPU-hour
+        """
+        now = time.perf_counter()
+        if self._last_update is not None:
+            self.gpu_seconds += (now - self._last_update) * num_gpus
+        self._last_update = now
+        if not records:
+            return {}
+        
+        prompt_ids, successes, rewards = zip(*records)
+        keys, group = np.unique(np.asarray(prompt_ids), return_inverse=True)
+        sizes = np.bincount(group)
+        pass_rates = np.bincount(group, weights=np.asarray(successes, dtype=np.float64)) / sizes
+        rewards = np.asarray(rewards, dtype=np.float64)
+        means = np.bincount(group, weights=rewards) / sizes
+        variances = np.bincount(group, weights=(rewards - means[group]) ** 2) / sizes
+        
+        for key, rate in zip(keys.tolist(), pass_rates.tolist()):
+            previous = self.rates.get(key)
+            self.rates[key] = rate if previous is None else self.momentum * previous + (1 - self.momentum) * rate
+            self.counts[key] = self.counts.get(key, 0) + 1
+        
+        informative = int((variances > 1e-12).sum())
+        self.informative_groups += informative
+        gpu_hours = self.gpu_seconds / 3600
+        return {
+            "curriculum/reward_var": float(variances.mean()),
+            "curriculum/informative_groups": float(informative),
+            "curriculum/signal_per_gpu_hour": self.informative_groups / gpu_hours if gpu_hours > 0 else 0.0,
+            "curriculum/batch_pass_rate": float(pass_rates.mean()),
+            "curriculum/tracked_prompts": float(len(self.rates)),
+        }
+    
+    def weights(self, prompt_ids: Sequence[str]) -> torch.Tensor:
+        """
+        Sampling weight of each prompt: p * (1 - p) of its success rate
+        
+        Intermediate pass rates give the largest within-group reward variance
+        and so the strongest GRPO signal. ``min_weight`` keeps prompts that are
+        always or never solved in rotation, since their rate can change as the
+        policy improves.
+        """
+        rates = np.array([self.rates.get(key, self.prior) for key in prompt_ids], dtype=np.float64)
+        return torch.from_numpy(np.maximum(rates * (1 - rates), self.min_weight))
+    
+    def save(self, path: Optional[str] = None) -> None:
+        path = path or self.path
+        if not path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        state = {key: [rate, self.counts.get(key, 0)] for key, rate in self.rates.items()}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+    
+    def load(self, path: str) -> None:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        self.rates = {key: float(rate) for key, (rate, _) in state.items()}
+        self.counts = {key: int(count) for key, (_, count) in state.items()}
+        print(f"Loaded curriculum state for {len(self.rates)} prompts from {path}")
+
+class CurriculumSampler(RepeatSampler):
+    """
+    RepeatSampler whose prompt batches are drawn by difficulty
+    
+    Each generation batch draws ``batch_size`` distinct prompts with
+    probability proportional to the tracker's weights, read when the batch is
+    drawn so they follow training. The repeat layout and the epoch length are
+    those of TRL's RepeatSampler; the generator is seeded identically on every
+    process and the tracker is kept in sync, so all ranks draw the same batch.
+    """
+    
+    def __init__(self, data_source, prompt_ids: Sequence[str], tracker: PromptDifficultyTracker, **kwargs):
+        super().__init__(data_source, shuffle=True, **kwargs)
+        self.prompt_ids = list(prompt_ids)
+        self.tracker = tracker
+    
+    def __iter__(self):
+        for _ in range(self.num_samples // self.batch_size):
+            weights = self.tracker.weights(self.prompt_ids)
+            chunk = torch.multinomial(weights, self.batch_size, replacement=False, generator=self.generator).tolist()
+            for _ in range(self.repeat_count):
+                for index in chunk:
+                    for _ in range(self.mini_repeat_count):
+                        yield index
@@ -1,55 +1,147 @@
 import os
 import json
-from PIL import Image
 from datasets import Dataset
 from tqdm import tqdm
 
+from common import ImageLRUCache, load_resized_image
+
 SYSTEM_PROMPT = """You are a helpful assistant capable of visual reasoning.
 Provide step-by-step reasoning about the chart, then output your final answer
 in JSON format: {answer: 'your_answer'}"""
 
+class LazyImageTransform:
+    """
+    Dataset transform that decodes images on access
+    
+    Replaces the ``image_path`` column of every fetched row with an
+    ``images`` list, consulting an optional LRU of decoded images first.
+    Picklable, so every DataLoader worker gets its own cache.
+    """
+    
+    def __init__(self, image_store=None, image_cache_mb=0):
+        self.image_store = image_store
+        self.cache = ImageLRUCache(image_cache_mb) if image_cache_mb > 0 else None
+    
+    def load_image(self, image_path):
+        image = self.cache.get(image_path) if self.cache is not None else None
+        if image is None:
+            if self.image_store is not None:
+                image = self.image_store.load(image_path)
+            else:
+                image = load_resized_image(image_path)
+            if self.cache is not None:
+                self.cache.put(image_path, image)
+        return image
+    
+    def __call__(self, batch):
+        output = {key: value for key, value in batch.items() if key != "image_path"}
+        output["images"] = [[self.load_image(path)] for path in batch["image_path"]]
+        return output
+
 class ChartQAGRPODataset:
-    def __init__(self, data_file, image_dir):
+    def __init__(self, data_file, image_dir, image_store=None):
         with open(data_file, 'r', encoding='utf-8') as f:
             self.data = json.load(f)
         self.image_dir = image_dir
+        self.image_store = image_store
+        self.name = os.path.splitext(os.path.basename(data_file))[0]
+    
+    def load_image(self, image_path):
+        if self.image_store is not None:
+            return self.image_store.load(image_path)
+        return load_resized_image(image_path)
+    
+    def prompt_id(self, idx):
+        # Unique across datasets, so train and val prompts never share an id
+        return f"{self.name}-{idx}"
+    
+    def build_prompt(self, item):
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": item['question']}
+        ]
+    
+    def to_lazy_dataset(self, image_cache_mb=512):
+        """
+        Build a dataset that keeps image paths and decodes images on access
+        
+        Only the JSON records are read up front; images are loaded when rows
+        are fetched, so startup time is linear in the number of records and
+        memory is bounded by the decoded image cache.
+        
+        Args:
+            image_cache_mb: Size of the decoded image cache in MB, 0 to disable it
+        
+        Returns:
+            Dataset with prompt, images, ground_truth and prompt_id columns
+        """
+        dataset_dict = {
+            "prompt": [],
+            "image_path": [],
+            "ground_truth": [],
+            "prompt_id": []
+        }
+        
+        for idx, item in enumerate(self.data):
+            image_path = os.path.join(self.image_dir, item['image'])
+            if not os.path.exists(image_path):
+                continue
+            
+            dataset_dict["prompt"].append(self.build_prompt(item))
+            dataset_dict["image_path"].append(image_path)
+            dataset_dict["ground_truth"].append(item['label'])
+            dataset_dict["prompt_id"].append(self.prompt_id(idx))
+        
+        dataset = Dataset.from_dict(dataset_dict)
+        return dataset.with_transform(LazyImageTransform(self.image_store, image_cache_mb))
     
     def to_hf_dataset(self):
         dataset_dict = {
             "prompt": [],
             "images": [],
-            "ground_truth": []
+            "ground_truth": [],
+            "prompt_id": []
         }
         
-        for item in tqdm(self.data, desc="Processing images"):
+        for idx, item in enumerate(tqdm(self.data, desc="Processing images")):
             image_path = os.path.join(self.image_dir, item['image'])
             if not os.path.exists(image_path):
                 continue
             
             try:
-                image = Image.open(image_path).convert('RGB')
+                image = self.load_image(image_path)
                 
-                if max(image.size) > 800:
-                    image.thumbnail((800, 800), Image.Resampling.LANCZOS)
-                
-                messages = [
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": item['question']}
-                ]
-                
-                dataset_dict["prompt"].append(messages)
+                dataset_dict["prompt"].append(self.build_prompt(item))
                 dataset_dict["images"].append([image])
                 dataset_dict["ground_truth"].append(item['label'])
+                dataset_dict["prompt_id"].append(self.prompt_id(idx))
             except Exception:
                 continue
         
         return Dataset.from_dict(dataset_dict)
 
-def load_datasets(train_file, train_images, val_file=None, val_images=None):
-    train_ds = ChartQAGRPODataset(train_file, train_images).to_hf_dataset()
+def load_datasets(
+    train_file,
+    train_images,
+    val_file=None,
+    val_images=None,
+    image_store=None,
+    lazy=True,
+    image_cache_mb=512
+):
+    def build(data_file, image_dir):
+        dataset = ChartQAGRPODataset(data_file, image_dir, image_store)
+        # Filling the store decodes every image up front, which lazy loading exists to avoid
+        if image_store is not None and not lazy:
+            image_store.add(os.path.join(image_dir, item['image']) for item in dataset.data)
+        if lazy:
+            return dataset.to_lazy_dataset(image_cache_mb)
+        return dataset.to_hf_dataset()
+    
+    train_ds = build(train_file, train_images)
     
     val_ds = None
     if val_file and val_images:
-        val_ds = ChartQAGRPODataset(val_file, val_images).to_hf_dataset()
+        val_ds = build(val_file, val_images)
     
     return train_ds, val_ds
@@ -0,0 +1,112 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import torch
+import trl
+import trl.trainer.utils as trl_utils
+from torch.utils.checkpoint import checkpoint
+
+LOGPROB_BACKENDS = ("auto", "fused", "chunked")
+
+# Module globals of trl.trainer.utils read by the fused LM head of add_fused_lm_head (TRL 1.15)
+_TRL_KERNEL_ATTRS = ("_ChunkedLogProbFunction", "_CHUNKED_LOGPROB_CHUNK_SIZE")
+
+def _chunk_logprobs(hidden, weight, bias, targets, temperature, softcap, logit_scale, outputs):
+    logits = torch.nn.functional.linear(hidden, weight, bias).float() * logit_scale
+    if softcap is not None:
+        logits = softcap * torch.tanh(logits / softcap)
+    logits = logits / temperature
+    log_softmax = logits.log_softmax(dim=-1)
+    
+    log_probs = log_softmax.gather(-1, targets.unsqueeze(-1)).squeeze(-1)
+    entropy = -(log_softmax.exp() * log_softmax).sum(dim=-1) if "entropy" in outputs else None
+    log_sum_sq_probs = torch.logsumexp(2 * log_softmax, dim=-1) if "log_sum_sq_probs" in outputs else None
+    mean_logits = logits.mean(dim=-1) if "mean_logits" in outputs else None
+    is_top1 = (logits.argmax(dim=-1) == targets).float() if "is_top1" in outputs else None
+    return log_probs, entropy, log_sum_sq_probs, mean_logits, is_top1
+
+def chunked_selective_log_softmax(
+    hidden,
+    weight,
+    bias,
+    targets,
+    temperature=1.0,
+    chunk_size=256,
+    final_logit_softcapping=None,
+    logit_scale=1.0,
+    outputs=("log_probs",)
+):
+    """
+    Per-token log-probabilities of ``hidden @ weight.T`` computed ``chunk_size`` tokens at a time
+    
+    Each chunk's logits are projected, reduced to the target log-probability
+    (and the requested extra fields) and freed. With gradients enabled every
+    chunk is checkpointed, so backward recomputes one chunk's logits at a time
+    instead of keeping the (tokens, vocab) logits of the whole batch alive.
+    Peak memory grows with ``chunk_size`` instead of the completion count.
+    
+    Args:
+        hidden: Hidden states of the scored positions, shape (num_tokens, hidden_size)
+        weight: LM head weight, shape (vocab_size, hidden_size)
+        bias: LM head bias or None
+        targets: Token whose log-probability is returned, shape (num_tokens,)
+        temperature: Temperature the logits are divided by
+        chunk_size: Number of tokens projected at once
+        final_logit_softcapping: Tanh soft-capping of the logits, if the model uses it
+        logit_scale: Multiplier applied to the logits before soft-capping
+        outputs: Fields to compute among "log_probs", "entropy", "log_sum_sq_probs",
+            "mean_logits" and "is_top1"
+    
+    Returns:
+        (log_probs, entropy, log_sum_sq_probs, mean_logits, is_top1), each of
+        shape (num_tokens,) or None when not requested, like TRL's fused kernel
+    """
+    fields = [[] for _ in range(5)]
+    # An empty batch still runs one (empty) chunk so the fields keep their shapes
+    for start in range(0, max(hidden.size(0), 1), chunk_size):
+        args = (
+            hidden[start:start + chunk_size], weight, bias, targets[start:start + chunk_size],
+            temperature, final_logit_softcapping, logit_scale, outputs
+        )
+        if torch.is_grad_enabled() and (hidden.requires_grad or weight.requires_grad):
+            chunk = checkpoint(_chunk_logprobs, *args, use_reentrant=False)
+        else:
+            chunk = _chunk_logprobs(*args)
+        for values, value in zip(fields, chunk):
+            values.append(value)
+    return tuple(None if values[0] is None else torch.cat(values) for values in fields)
+
+def check_trl_kernel_hooks():
+    """
+    Fail early when the installed TRL no longer exposes the globals chunked_logprob_kernel swaps
+    
+    Raises:
+        RuntimeError: If trl.trainer.utils lacks one of them
+    """
+    missing = [name for name in _TRL_KERNEL_ATTRS if not hasattr(trl_utils, name)]
+    if missing:
+        raise RuntimeError(
+            f"trl.trainer.utils has no {', '.join(missing)}; the chunked log-prob backend "
+            f"supports TRL 1.15 (installed: {trl.__version__}), use logprob_backend='fused'"
+        )
+
+@contextmanager
+def chunked_logprob_kernel(chunk_size=256):
+    """
+    Compute the log-probs of TRL's fused LM head with ``chunked_selective_log_softmax`` inside the block
+    
+    TRL's fused head projects through a Triton kernel that only runs on CUDA;
+    this swaps in the PyTorch implementation, which runs on any device. The
+    fused head reads the kernel and its chunk size from private globals of
+    trl.trainer.utils, so this is tied to the TRL version pinned in
+    requirements.txt; routing the head any other way would bypass the
+    forward of the PEFT and DDP wrappers.
+    """
+    check_trl_kernel_hooks()
+    previous = trl_utils._ChunkedLogProbFunction, trl_utils._CHUNKED_LOGPROB_CHUNK_SIZE
+    trl_utils._ChunkedLogProbFunction = SimpleNamespace(apply=chunked_selective_log_softmax)
+    trl_utils._CHUNKED_LOGPROB_CHUNK_SIZE = chunk_size
+    try:
+        yield
+    finally:
+        trl_utils._ChunkedLogProbFunction, trl_utils._CHUNKED_LOGPROB_CHUNK_SIZE = previous
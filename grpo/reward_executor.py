@@ -0,0 +1,227 @@
+import asyncio
+import inspect
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Sequence
+
+import numpy as np
+
+BACKENDS = ("serial", "thread", "process", "async")
+
+@dataclass
+class RewardTask:
+    """
+    One reward component to compute over a group of completions
+    
+    ``batch_args`` hold one entry per completion and are split into chunks;
+    ``kwargs`` are passed unchanged to every chunk. For the process backend
+    ``func`` must be a module-level function.
+    """
+    func: Callable
+    batch_args: Sequence = ()
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+
+@dataclass
+class ComponentStats:
+    calls: int = 0
+    total_time: float = 0.0
+    last_time: float = 0.0
+    timeouts: int = 0
+    errors: int = 0
+
+def _call(func, args, kwargs):
+    if inspect.iscoroutinefunction(func):
+        return asyncio.run(func(*args, **kwargs))
+    return func(*args, **kwargs)
+
+class RewardExecutor:
+    """
+    Runs reward components concurrently with per-component timeouts
+    
+    Every component of a group, split into chunks of ``chunk_size``
+    completions, is submitted to a thread pool, a process pool or an asyncio
+    loop. A component that misses its deadline or raises gets
+    ``fallback_value`` for the affected completions, so a slow or failing
+    scorer never stalls the training step. Wall time, timeouts and errors are
+    tracked per component.
+    
+    Only the process backend aborts a timed-out call: its workers are
+    terminated and the pool is restarted on the next run. A thread cannot be
+    stopped, so on the thread and async backends a timed-out call keeps its
+    worker busy until it returns, and later chunks queue behind it. The
+    serial backend runs components inline and cannot enforce timeouts at
+    all; it reports calls that overrun theirs. Use ``process`` when a scorer
+    can hang.
+    """
+    
+    def __init__(
+        self,
+        backend: str = "serial",
+        max_workers: int = 4,
+        timeout: Optional[float] = None,
+        timeouts: Optional[Dict[str, float]] = None,
+        chunk_size: Optional[int] = None,
+        fallback_value: float = 0.0
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown reward backend '{backend}', expected one of {BACKENDS}")
+        
+        self.backend = backend
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.chunk_size = chunk_size
+        self.fallback_value = fallback_value
+        self.stats: Dict[str, ComponentStats] = {}
+        # Completions of the last run that got a fallback value in some component
+        self.last_failed = np.zeros(0, dtype=bool)
+        self._pool = None
+        self._reported_overruns = set()
+    
+    @property
+    def pool(self):
+        if self._pool is None:
+            if self.backend in ("thread", "async"):
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="reward")
+            elif self.backend == "process":
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+    
+    def _chunks(self, size):
+        chunk_size = self.chunk_size or size or 1
+        return [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+    
+    def _record(self, name, elapsed, timeouts=0, errors=0):
+        stats = self.stats.setdefault(name, ComponentStats())
+        stats.calls += 1
+        stats.total_time += elapsed
+        stats.last_time = elapsed
+        stats.timeouts += timeouts
+        stats.errors += errors
+    
+    def run(self, tasks: Dict[str, RewardTask], size: int) -> Dict[str, np.ndarray]:
+        """
+        Compute every component over a group of ``size`` completions
+        
+        Args:
+            tasks: Reward tasks keyed by component name
+            size: Number of completions
+        
+        Returns:
+            Dictionary of per-completion float32 arrays keyed by component name
+        """
+        results = {name: np.full(size, self.fallback_value, dtype=np.float32) for name in tasks}
+        chunks = self._chunks(size)
+        self.last_failed = np.zeros(size, dtype=bool)
+        
+        if self.backend == "serial":
+            for name, task in tasks.items():
+                start_time = time.perf_counter()
+                for start, stop in chunks:
+                    args = [arg[start:stop] for arg in task.batch_args]
+                    results[name][start:stop] = _call(task.func, args, task.kwargs)
+                elapsed = time.perf_counter() - start_time
+                self._record(name, elapsed)
+                timeout = self.timeouts.get(name, self.timeout)
+                if timeout is not None and elapsed > timeout and name not in self._reported_overruns:
+                    self._reported_overruns.add(name)
+                    print(
+                        f"Reward component '{name}' took {elapsed:.1f}s, over its {timeout:g}s timeout; "
+                        f"the serial backend cannot enforce timeouts, use the process backend"
+                    )
+            return results
+        
+        if self.backend == "async":
+            return asyncio.run(self._run_async(tasks, chunks, results))
+        
+        submitted = time.perf_counter()
+        timed_out = False
+        futures = {
+            name: [
+                (start, stop, self.pool.submit(_call, task.func, [arg[start:stop] for arg in task.batch_args], task.kwargs))
+                for start, stop in chunks
+            ]
+            for name, task in tasks.items()
+        }
+        
+        for name, chunk_futures in futures.items():
+            timeout = self.timeouts.get(name, self.timeout)
+            deadline = submitted + timeout if timeout is not None else None
+            timeouts = errors = 0
+            for start, stop, future in chunk_futures:
+                remaining = max(0.0, deadline - time.perf_counter()) if deadline is not None else None
+                try:
+                    results[name][start:stop] = future.result(timeout=remaining)
+                except FutureTimeoutError:
+                    # Only drops a chunk that has not started; a running thread cannot be stopped
+                    future.cancel()
+                    self.last_failed[start:stop] = True
+                    timeouts += 1
+                    timed_out = True
+                except Exception as e:
+                    print(f"Reward component '{name}' failed: {e}")
+                    self.last_failed[start:stop] = True
+                    errors += 1
+            self._record(name, time.perf_counter() - submitted, timeouts, errors)
+        
+        if timed_out and self.backend == "process":
+            self._terminate_pool()
+        return results
+    
+    async def _run_async(self, tasks, chunks, results):
+        async def run_chunk(task, start, stop):
+            args = [arg[start:stop] for arg in task.batch_args]
+            if inspect.iscoroutinefunction(task.func):
+                return await task.func(*args, **task.kwargs)
+            # Own pool rather than the loop's default one, whose shutdown would wait for timed-out calls
+            return await asyncio.get_running_loop().run_in_executor(self.pool, partial(task.func, *args, **task.kwargs))
+        
+        async def run_component(name, task):
+            timeout = self.timeouts.get(name, self.timeout)
+            start_time = time.perf_counter()
+            timeouts = errors = 0
+            outcomes = await asyncio.gather(
+                *(asyncio.wait_for(run_chunk(task, start, stop), timeout) for start, stop in chunks),
+                return_exceptions=True
+            )
+            for (start, stop), outcome in zip(chunks, outcomes):
+                if isinstance(outcome, asyncio.TimeoutError):
+                    self.last_failed[start:stop] = True
+                    timeouts += 1
+                elif isinstance(outcome, BaseException):
+                    print(f"Reward component '{name}' failed: {outcome}")
+                    self.last_failed[start:stop] = True
+                    errors += 1
+                else:
+                    results[name][start:stop] = outcome
+            self._record(name, time.perf_counter() - start_time, timeouts, errors)
+        
+        await asyncio.gather(*(run_component(name, task) for name, task in tasks.items()))
+        return results
+    
+    def log(self, log_metric: Callable[[str, float], None]) -> None:
+        """Report the latest timing and cumulative timeouts/errors of every component"""
+        for name, stats in self.stats.items():
+            log_metric(f"reward_time/{name}", stats.last_time)
+            log_metric(f"reward_timeouts/{name}", stats.timeouts)
+            log_metric(f"reward_errors/{name}", stats.errors)
+    
+    def _terminate_pool(self) -> None:
+        """Kill the worker processes, abandoning the calls they are running"""
+        processes = list((getattr(self._pool, "_processes", None) or {}).values())
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+        self._pool = None
+    
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        return state
@@ -1,41 +1,41 @@
-import re
-import json
-
-def normalize_text(text):
-    text = text.lower().strip()
-    text = re.sub(r'[^a-z0-9\s]', '', text)
-    text = re.sub(r'\s+', ' ', text)
-    return text
-
-def extract_answer(text):
-    try:
-        if '{answer:' in text or '{"answer":' in text:
-            start = text.rfind('{')
-            end = text.rfind('}') + 1
-            if start != -1 and end > start:
-                answer_json = text[start:end].replace('answer:', '"answer":').replace("'", '"')
-                parsed = json.loads(answer_json)
-                return parsed.get("answer", "").strip()
-    except:
-        pass
-    return ""
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from common import (
+    extract_answer,
+    has_answer_format,
+    normalize_text,
+    relaxed_match,
+    GroundTruthIndex,
+    RELAXED_TOLERANCE,
+)
+
+from .reward_executor import RewardTask
+
+def completion_to_text(completion):
+    """Text of a completion, either a plain string or a list of chat messages"""
+    if isinstance(completion, str):
+        return completion
+    
+    parts = []
+    for message in completion:
+        content = message.get("content", "")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(part.get("text", "") for part in content if part.get("type") == "text")
+    return "".join(parts).strip()
 
 def compute_format_reward(response):
-    if '{answer:' in response or '{"answer":' in response:
+    if has_answer_format(response):
         return 1.0
     return 0.0
 
-def compute_accuracy_reward(response, ground_truth):
-    pred = extract_answer(response)
-    pred_norm = normalize_text(pred)
-    gt_norm = normalize_text(str(ground_truth))
-    
-    if pred_norm == gt_norm:
-        return 1.0
-    
-    if gt_norm in pred_norm or pred_norm in gt_norm:
+def compute_accuracy_reward(response, ground_truth, tolerance=RELAXED_TOLERANCE):
+    if relaxed_match(extract_answer(response), ground_truth, tolerance):
         return 1.0
-    
     return 0.0
 
 def compute_length_reward(num_tokens, target=256, max_len=512):
@@ -46,31 +46,214 @@ def compute_length_reward(num_tokens, target=256, max_len=512):
     else:
         return -0.5
 
-def create_reward_function(processor, config):
-    def combined_reward_func(prompts, completions, ground_truth, **kwargs):
-        rewards = []
+def compute_format_rewards(responses):
+    """Format reward of every response; the marker check still runs once per response"""
+    return np.fromiter((compute_format_reward(response) for response in responses), dtype=np.float32, count=len(responses))
+
+def compute_accuracy_rewards(responses, ground_truths, ground_truth_index=None, tolerance=RELAXED_TOLERANCE):
+    """Accuracy reward of every response; answers are extracted and matched one response at a time"""
+    if ground_truth_index is not None:
+        ground_truths = [ground_truth_index[gt] for gt in ground_truths]
+    return np.fromiter(
+        (compute_accuracy_reward(response, gt, tolerance) for response, gt in zip(responses, ground_truths)),
+        dtype=np.float32,
+        count=len(responses)
+    )
+
+def compute_length_rewards(num_tokens, target=256, max_len=512):
+    """Length reward of every response, computed on the whole array of token counts"""
+    num_tokens = np.asarray(num_tokens, dtype=np.float32)
+    decay = 1.0 - (num_tokens - target) / (max_len - target)
+    return np.where(num_tokens <= target, 1.0, np.where(num_tokens <= max_len, decay, -0.5)).astype(np.float32)
+
+def count_completion_tokens(responses, tokenizer, completion_ids=None):
+    """
+    Number of tokens of every completion
+    
+    Args:
+        responses: Decoded completions
+        tokenizer: Tokenizer used when ids are not available
+        completion_ids: Generated token ids per completion, as passed by the trainer
+    
+    Returns:
+        Array of token counts
+    """
+    if completion_ids is not None:
+        return np.fromiter((len(ids) for ids in completion_ids), dtype=np.int64, count=len(completion_ids))
+    encoded = tokenizer(list(responses), add_special_tokens=False)["input_ids"]
+    return np.fromiter((len(ids) for ids in encoded), dtype=np.int64, count=len(encoded))
+
+def compute_reward_components(responses, ground_truths, num_tokens, config, ground_truth_index=None, executor=None):
+    """
+    Weighted format, accuracy and length rewards of a group of completions
+    
+    Args:
+        responses: Decoded completions
+        ground_truths: Ground-truth answers
+        num_tokens: Token count of every completion
+        config: GRPO configuration
+        ground_truth_index: Pre-parsed ground truths
+        executor: RewardExecutor running the components concurrently, None to run them inline
+    
+    Returns:
+        Dictionary of per-completion arrays keyed by component name
+    """
+    if ground_truth_index is not None:
+        ground_truths = [ground_truth_index[gt] for gt in ground_truths]
+    
+    tasks = {
+        "format": RewardTask(compute_format_rewards, (responses,)),
+        "accuracy": RewardTask(
+            compute_accuracy_rewards, (responses, ground_truths), {"tolerance": config.relaxed_tolerance}
+        ),
+        "length": RewardTask(
+            compute_length_rewards, (num_tokens,), {"target": config.target_length, "max_len": config.max_length}
+        ),
+    }
+    if executor is None:
+        raw = {name: task.func(*task.batch_args, **task.kwargs) for name, task in tasks.items()}
+    else:
+        raw = executor.run(tasks, len(responses))
+    
+    weights = {"format": config.lambda_format, "accuracy": config.lambda_accuracy, "length": config.lambda_length}
+    return {name: weights[name] * raw[name] for name in tasks}
+
+def combine_rewards(components):
+    r_format = components["format"]
+    return r_format * (components["accuracy"] + components["length"]) + r_format - 1.0
+
+COMPONENT_NAMES = ("format", "accuracy", "length")
+
+class RewardCache:
+    """
+    LRU cache of reward components keyed by (prompt id, completion hash)
+    
+    Rewards depend only on the completion and its prompt's ground truth, so a
+    byte-identical completion for the same prompt reuses the stored components.
+    The cache holds at most ``max_entries`` entries.
+    """
+    
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+    
+    @staticmethod
+    def make_key(prompt_id, response):
+        return prompt_id, hashlib.blake2b(response.encode('utf-8'), digest_size=16).digest()
+    
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+    
+    def __len__(self):
+        return len(self._entries)
+
+def create_reward_function(
+    processor,
+    config,
+    ground_truth_index=None,
+    reward_cache=None,
+    executor=None,
+    difficulty_tracker=None
+):
+    if ground_truth_index is None:
+        ground_truth_index = GroundTruthIndex()
+    
+    def combined_reward_func(
+        prompts,
+        completions,
+        ground_truth,
+        completion_ids=None,
+        prompt_id=None,
+        log_metric=None,
+        log_extra=None,
+        **kwargs
+    ):
+        responses = [completion_to_text(completion) for completion in completions]
         
-        for completion, gt in zip(completions, ground_truth):
-            response = str(completion)
-            
-            if "<|im_start|>assistant" in response:
-                response = response.split("<|im_start|>assistant")[-1].strip()
+        if reward_cache is None:
+            num_tokens = count_completion_tokens(responses, processor.tokenizer, completion_ids)
+            components = compute_reward_components(
+                responses, ground_truth, num_tokens, config, ground_truth_index, executor
+            )
+        else:
+            # Without prompt ids the ground truth identifies what a completion is scored against
+            prompt_keys = prompt_id if prompt_id is not None else ground_truth
+            keys = [RewardCache.make_key(key, response) for key, response in zip(prompt_keys, responses)]
             
-            response_tokens = processor.tokenizer.encode(response, add_special_tokens=False)
-            num_tokens = len(response_tokens)
+            # Score every distinct uncached completion once, including duplicates within this group
+            cached, missing = {}, {}
+            for idx, key in enumerate(keys):
+                if key in cached or key in missing:
+                    reward_cache.hits += 1
+                    continue
+                value = reward_cache.get(key)
+                if value is None:
+                    missing[key] = idx
+                else:
+                    cached[key] = value
+            hits = len(keys) - len(missing)
             
-            r_format = compute_format_reward(response)
-            r_accuracy = compute_accuracy_reward(response, gt)
-            r_length = compute_length_reward(num_tokens, config.target_length, config.max_length)
+            if missing:
+                missing_idx = list(missing.values())
+                missing_responses = [responses[idx] for idx in missing_idx]
+                missing_ids = [completion_ids[idx] for idx in missing_idx] if completion_ids is not None else None
+                num_tokens = count_completion_tokens(missing_responses, processor.tokenizer, missing_ids)
+                computed = compute_reward_components(
+                    missing_responses, [ground_truth[idx] for idx in missing_idx], num_tokens, config,
+                    ground_truth_index, executor
+                )
+                # Fallback values of timed-out or failed components are not memoized
+                failed = executor.last_failed if executor is not None else None
+                for pos, key in enumerate(missing):
+                    value = tuple(float(computed[name][pos]) for name in COMPONENT_NAMES)
+                    if failed is None or not failed[pos]:
+                        reward_cache.put(key, value)
+                    cached[key] = value
             
-            r_format_w = config.lambda_format * r_format
-            r_accuracy_w = config.lambda_accuracy * r_accuracy
-            r_length_w = config.lambda_length * r_length
+            values = np.array([cached[key] for key in keys], dtype=np.float32).reshape(len(keys), len(COMPONENT_NAMES))
+            components = {name: values[:, col] for col, name in enumerate(COMPONENT_NAMES)}
             
-            total_reward = r_format_w * (r_accuracy_w + r_length_w) + r_format_w - 1.0
-            
-            rewards.append(float(total_reward))
+            if log_metric is not None:
+                log_metric("reward_cache/hit_rate", hits / len(keys) if keys else 0.0)
+        
+        rewards = combine_rewards(components)
+        
+        if difficulty_tracker is not None and prompt_id is not None:
+            difficulty_tracker.record(prompt_id, components["accuracy"] > 0, rewards)
+        
+        combined_reward_func.components = components
+        if log_metric is not None and executor is not None:
+            executor.log(log_metric)
+        if log_metric is not None:
+            for name, values in components.items():
+                log_metric(f"rewards/{name}/mean", float(values.mean()))
+        if log_extra is not None:
+            for name, values in components.items():
+                log_extra(f"reward_{name}", values.tolist())
         
-        return rewards
+        return rewards.tolist()
     
+    combined_reward_func.components = {}
+    combined_reward_func.cache = reward_cache
+    combined_reward_func.executor = executor
+    combined_reward_func.difficulty_tracker = difficulty_tracker
     return combined_reward_func
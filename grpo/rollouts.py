@@ -0,0 +1,153 @@
+import glob
+import os
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+class RolloutStore:
+    """
+    On-disk store of GRPO rollouts for reuse across steps and runs
+    
+    Every generation batch is written as one ``.npz`` shard holding the
+    prompt ids, the completion token ids and their behavior-policy logprobs
+    (flat arrays with offsets), the rewards and the optimizer step of the
+    policy that generated them. Shards already in the directory are indexed
+    on start, so a restart or a run with changed hyperparameters can reuse
+    them.
+    
+    A rollout is fresh for step ``s`` when it was generated at most
+    ``staleness`` steps away from ``s``.
+    
+    Shards can also hold the reference-model logprobs of their completions.
+    The reference does not change during training, so these stay valid for
+    any step and spare a replayed batch the reference forward pass.
+    """
+    
+    def __init__(self, directory: str, staleness: int = 4, rank: int = 0, max_open_shards: int = 8):
+        self.directory = directory
+        self.staleness = staleness
+        self.rank = rank
+        self.max_open_shards = max_open_shards
+        os.makedirs(directory, exist_ok=True)
+        
+        # prompt id -> [(step, shard path, row)], oldest first
+        self.index: Dict[str, List[Tuple[int, str, int]]] = defaultdict(list)
+        self._shards: "OrderedDict[str, Dict[str, np.ndarray]]" = OrderedDict()
+        self.num_rollouts = 0
+        self.replayed = 0
+        
+        for path in sorted(glob.glob(os.path.join(directory, "rollouts-*.npz"))):
+            self._index_shard(path, self._load(path))
+        if self.num_rollouts:
+            print(f"Rollout store: {self.num_rollouts} rollouts indexed from {directory}")
+    
+    def _keep(self, path, shard):
+        self._shards[path] = shard
+        self._shards.move_to_end(path)
+        if len(self._shards) > self.max_open_shards:
+            self._shards.popitem(last=False)
+    
+    def _load(self, path):
+        shard = self._shards.get(path)
+        if shard is None:
+            with np.load(path) as data:
+                shard = {key: data[key] for key in data.files}
+        self._keep(path, shard)
+        return shard
+    
+    def _index_shard(self, path, shard):
+        step = int(shard["step"])
+        for row, prompt_id in enumerate(shard["prompt_ids"].tolist()):
+            self.index[prompt_id].append((step, path, row))
+        self.num_rollouts += len(shard["prompt_ids"])
+    
+    def add(
+        self,
+        step: int,
+        prompt_ids: Sequence[str],
+        completion_ids: Sequence[Sequence[int]],
+        logprobs: Sequence[Sequence[float]],
+        rewards: Sequence[float],
+        ref_logprobs: Optional[Sequence[Sequence[float]]] = None
+    ) -> str:
+        """
+        Write one generation batch as a shard
+        
+        Args:
+            step: Optimizer step of the policy that generated the batch
+            prompt_ids: Prompt id of every completion
+            completion_ids: Completion token ids, unpadded
+            logprobs: Behavior-policy logprob of every completion token
+            rewards: Reward of every completion
+            ref_logprobs: Reference-model logprob of every completion token
+        
+        Returns:
+            Path of the written shard
+        """
+        lengths = [len(ids) for ids in completion_ids]
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        tokens = np.zeros(offsets[-1], dtype=np.int32)
+        for row, ids in enumerate(completion_ids):
+            tokens[offsets[row]:offsets[row + 1]] = ids
+        
+        def flatten(rows):
+            flat = np.zeros(offsets[-1], dtype=np.float32)
+            for row, values in enumerate(rows):
+                flat[offsets[row]:offsets[row + 1]] = np.asarray(values, dtype=np.float32)[:lengths[row]]
+            return flat
+        
+        shard = {
+            "step": np.array(step, dtype=np.int64),
+            "prompt_ids": np.array(list(prompt_ids), dtype=str),
+            "offsets": offsets,
+            "tokens": tokens,
+            "logprobs": flatten(logprobs),
+            "rewards": np.asarray(rewards, dtype=np.float32),
+        }
+        if ref_logprobs is not None:
+            shard["ref_logprobs"] = flatten(ref_logprobs)
+        
+        # A crashed write leaves a .tmp file behind, never a truncated shard
+        path = os.path.join(self.directory, f"rollouts-{step:08d}-{self.rank}.npz")
+        suffix = 0
+        while os.path.exists(path):
+            suffix += 1
+            path = os.path.join(self.directory, f"rollouts-{step:08d}-{self.rank}-{suffix}.npz")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **shard)
+        os.replace(tmp_path, path)
+        
+        self._keep(path, shard)
+        self._index_shard(path, shard)
+        return path
+    
+    def lookup(
+        self,
+        prompt_id: str,
+        count: int,
+        step: int
+    ) -> Optional[List[Tuple[int, List[int], np.ndarray, Optional[np.ndarray]]]]:
+        """
+        The ``count`` fresh rollouts of a prompt generated closest to ``step``
+        
+        Returns:
+            (step, completion ids, logprobs, reference logprobs or None) of
+            each rollout, or None when the prompt has fewer than ``count``
+            fresh rollouts
+        """
+        fresh = [entry for entry in self.index.get(prompt_id, ()) if abs(step - entry[0]) <= self.staleness]
+        if len(fresh) < count:
+            return None
+        
+        rollouts = []
+        for rollout_step, path, row in sorted(fresh, key=lambda entry: abs(step - entry[0]))[:count]:
+            shard = self._load(path)
+            start, stop = shard["offsets"][row], shard["offsets"][row + 1]
+            ref_logprobs = shard["ref_logprobs"][start:stop] if "ref_logprobs" in shard else None
+            rollouts.append((rollout_step, shard["tokens"][start:stop].tolist(), shard["logprobs"][start:stop], ref_logprobs))
+        return rollouts
+    
+    def __len__(self):
+        return self.num_rollouts
@@ -2,13 +2,22 @@ import os
 os.environ["CUDA_LAUNCH_BLOCKING"] = "1"
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+from accelerate import PartialState
+
+from common import open_image_store, GroundTruthIndex
 from grpo import (
     GRPOConfig,
     load_model,
     load_processor,
     load_datasets,
+    RewardCache,
+    RewardExecutor,
     create_reward_function,
+    CURRICULUM_STATE_FILE,
+    PromptDifficultyTracker,
+    RolloutStore,
     RewardLoggingCallback,
+    CurriculumCallback,
     create_grpo_trainer
 )
 
@@ -21,30 +30,70 @@ def main():
     model.print_trainable_parameters()
     
     print("\nLoading datasets...")
-    train_dataset, val_dataset = load_datasets(
-        config.train_file,
-        config.train_images,
-        config.val_file,
-        config.val_images
-    )
+    # Without lazy images rank 0 fills the image store while the other ranks wait at the barrier
+    with PartialState().main_process_first():
+        image_store = open_image_store(
+            config.image_store_dir,
+            min_pixels=config.min_pixels,
+            max_pixels=config.max_pixels
+        )
+        train_dataset, val_dataset = load_datasets(
+            config.train_file,
+            config.train_images,
+            config.val_file,
+            config.val_images,
+            image_store=image_store,
+            lazy=config.lazy_images,
+            image_cache_mb=config.image_cache_mb
+        )
     print(f"Train: {len(train_dataset)} samples")
     if val_dataset:
         print(f"Val: {len(val_dataset)} samples")
     
     print("\nSetting up trainer...")
-    reward_func = create_reward_function(processor, config)
-    callbacks = [RewardLoggingCallback()]
+    ground_truth_index = GroundTruthIndex.from_files([config.train_file, config.val_file])
+    reward_cache = RewardCache(config.reward_cache_size) if config.reward_cache_size > 0 else None
+    reward_executor = RewardExecutor(
+        backend=config.reward_backend,
+        max_workers=config.reward_workers,
+        timeout=config.reward_timeout,
+        chunk_size=config.reward_chunk_size
+    )
+    difficulty_tracker = None
+    if config.curriculum_sampling:
+        # Difficulty statistics carry over only when resuming one of this run's checkpoints
+        state_file = None
+        if config.resume_from_checkpoint:
+            state_file = os.path.join(config.resume_from_checkpoint, CURRICULUM_STATE_FILE)
+        difficulty_tracker = PromptDifficultyTracker(
+            state_file,
+            momentum=config.curriculum_momentum,
+            min_weight=config.curriculum_min_weight
+        )
+    reward_func = create_reward_function(
+        processor, config, ground_truth_index, reward_cache, reward_executor, difficulty_tracker
+    )
+    callbacks = [RewardLoggingCallback(reward_cache)]
+    if difficulty_tracker is not None:
+        callbacks.append(CurriculumCallback(difficulty_tracker))
+    
+    rollout_store = None
+    if config.rollout_store_dir:
+        rollout_store = RolloutStore(config.rollout_store_dir, staleness=config.rollout_staleness)
     
     trainer = create_grpo_trainer(
         model, processor, train_dataset, val_dataset,
-        reward_func, config, callbacks
+        reward_func, config, callbacks, difficulty_tracker, rollout_store
     )
     
     print("\n" + "="*80)
     print("Starting GRPO Training")
     print("="*80)
     
-    trainer.train()
+    try:
+        trainer.train(resume_from_checkpoint=config.resume_from_checkpoint)
+    finally:
+        reward_executor.shutdown()
     
     print("\n" + "="*80)
     print("Training Completed")
@@ -1,6 +1,374 @@
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+
+import torch
+from transformers import LogitsProcessorList
+from accelerate.utils import gather_object
+from datasets import IterableDataset
 from trl import GRPOConfig as TRLGRPOConfig, GRPOTrainer
+import trl.trainer.utils as trl_utils
+from trl.trainer.utils import split_pixel_values_by_grid, unsplit_pixel_values_by_grid
+
+from common import StopAfterAnswer, ConstrainedAnswer, generate_with_shared_prefix
+
+from .curriculum import CurriculumSampler
+from .logprobs import LOGPROB_BACKENDS, check_trl_kernel_hooks, chunked_logprob_kernel
+
+def select_rows(batch, indices):
+    """Keep the given samples of a generation batch whose pixel values are split per sample"""
+    def select(value):
+        if value is None:
+            return None
+        if isinstance(value, torch.Tensor):
+            return value if value.ndim == 0 else value[indices]
+        return [value[i] for i in indices.tolist()]
+    
+    return {key: select(value) for key, value in batch.items()}
+
+@contextmanager
+def wrap_generate(model, wrapper):
+    """Route every ``model.generate(**kwargs)`` call inside the block to ``wrapper(generate, **kwargs)``"""
+    previous = model.__dict__.get("generate")
+    model.generate = partial(wrapper, model.generate)
+    try:
+        yield
+    finally:
+        if previous is None:
+            del model.generate
+        else:
+            model.generate = previous
+
+class FilteredGRPOTrainer(GRPOTrainer):
+    """
+    GRPO trainer that spends the update on groups with a learning signal
+    
+    Groups whose generations all received the same reward have zero
+    advantages, so they only add KL and compute. After rewards are computed,
+    such groups are dropped from the loss by zeroing their completion mask.
+    With ``oversample_factor > 1`` the dataloader draws that many times more
+    prompts per generation batch, and the batch handed to the optimizer is
+    filled with informative groups first, topped up with (masked) zero-std
+    groups only when there are not enough. An epoch then takes
+    ``oversample_factor`` times fewer optimizer steps.
+    
+    With a ``difficulty_tracker`` prompts are drawn by a CurriculumSampler
+    and the tracker is updated from every training generation batch.
+    
+    With a ``rollout_store`` every generated training batch is recorded with
+    its behavior-policy logprobs. When ``reuse_rollouts`` is set and every
+    process finds enough fresh stored rollouts for all prompts of its batch,
+    generation is skipped and the stored completions are rescored. Their
+    behavior logprobs become the old logprobs of the clipped objective, so
+    the update is importance-weighted by pi_theta / pi_behavior.
+    
+    The reference of the KL term is the policy with its LoRA adapters
+    disabled (TRL keeps no second model for PEFT), and its logprobs are
+    computed once per generation batch and reused by every inner iteration.
+    Fresh rollouts are stored with their reference logprobs; when a replayed
+    batch has them on every process, the reference forward pass is skipped.
+    
+    With ``stop_at_answer`` transformers-generated completions end once their
+    answer object is closed (see StopAfterAnswer); with ``constrain_answer``
+    the answer object is also kept well-formed once opened (see
+    ConstrainedAnswer); those tokens are sampled from the constrained
+    distribution while the loss scores them under the unconstrained policy.
+    With ``share_prompt_prefill`` each prompt is prefilled once per group and
+    its KV cache shared by the group's samples (see
+    generate_with_shared_prefix).
+    
+    Per-token logprobs of the policy and the reference never materialize the
+    full (tokens, vocab) logits. ``logprob_backend="fused"`` uses TRL's
+    Triton LM-head kernel, ``"chunked"`` the PyTorch
+    chunked_selective_log_softmax with ``logprob_chunk_size`` tokens per
+    chunk, and ``"auto"`` the Triton kernel on CUDA when it is available and
+    the PyTorch path otherwise.
+    """
+    
+    def __init__(
+        self,
+        *args,
+        filter_zero_std=True,
+        oversample_factor=1,
+        difficulty_tracker=None,
+        rollout_store=None,
+        reuse_rollouts=False,
+        stop_at_answer=False,
+        constrain_answer=False,
+        share_prompt_prefill=False,
+        logprob_backend="auto",
+        logprob_chunk_size=256,
+        **kwargs
+    ):
+        if logprob_backend not in LOGPROB_BACKENDS:
+            raise ValueError(f"Unknown logprob backend '{logprob_backend}', expected one of {LOGPROB_BACKENDS}")
+        self.filter_zero_std = filter_zero_std
+        self.oversample_factor = oversample_factor
+        self.difficulty_tracker = difficulty_tracker
+        self.rollout_store = rollout_store
+        self.reuse_rollouts = reuse_rollouts
+        self.share_prompt_prefill = share_prompt_prefill
+        self.logprob_chunk_size = logprob_chunk_size
+        self._rollout_keys = None
+        self._rollout_staleness = None
+        self._replay_ref_logps = None
+        self._generated_ids = None
+        self._last_rewards = None
+        super().__init__(*args, **kwargs)
+        if oversample_factor > 1 and self.accelerator.num_processes > 1:
+            raise ValueError("oversample_factor > 1 requires every group on one process")
+        if rollout_store is not None:
+            rollout_store.rank = self.accelerator.process_index
+        self.answer_stop = None
+        if constrain_answer:
+            self.answer_stop = ConstrainedAnswer(self._tokenizer, self.eos_token_ids[0])
+        elif stop_at_answer:
+            self.answer_stop = StopAfterAnswer(self._tokenizer, self.eos_token_ids[0])
+        if logprob_backend != "fused":
+            check_trl_kernel_hooks()
+        self.chunked_logprobs = logprob_backend == "chunked" or (
+            logprob_backend == "auto"
+            and (trl_utils._ChunkedLogProbFunction is None or self.accelerator.device.type != "cuda")
+        )
+    
+    def get_train_dataloader(self):
+        if self.oversample_factor == 1 or isinstance(self.train_dataset, IterableDataset):
+            return super().get_train_dataloader()
+        return self._get_dataloader(
+            dataset=self.train_dataset,
+            description="Training",
+            batch_size=self._train_batch_size * self.args.steps_per_generation * self.oversample_factor,
+            sampler_fn=self._get_train_sampler,
+            is_training=True,
+        )
+    
+    def _get_train_sampler(self, dataset=None):
+        sampler = super()._get_train_sampler(dataset)
+        if self.difficulty_tracker is not None:
+            dataset = dataset if dataset is not None else self.train_dataset
+            sampler = CurriculumSampler(
+                dataset,
+                prompt_ids=dataset.with_format(None)["prompt_id"],
+                tracker=self.difficulty_tracker,
+                mini_repeat_count=sampler.mini_repeat_count,
+                batch_size=sampler.batch_size,
+                repeat_count=sampler.repeat_count,
+                seed=sampler.seed,
+            )
+        sampler.batch_size *= self.oversample_factor
+        return sampler
+    
+    def _get_per_token_logps_and_entropies(self, *args, **kwargs):
+        if not self.chunked_logprobs:
+            return super()._get_per_token_logps_and_entropies(*args, **kwargs)
+        with chunked_logprob_kernel(self.logprob_chunk_size):
+            return super()._get_per_token_logps_and_entropies(*args, **kwargs)
+    
+    def _update_curriculum(self):
+        tracker = self.difficulty_tracker
+        records, tracker.pending = tracker.pending, []
+        if not self.model.training:
+            return
+        
+        if self.accelerator.num_processes > 1:
+            records = gather_object(records)
+        metrics = tracker.update(records, num_gpus=self.accelerator.num_processes)
+        for name, value in metrics.items():
+            self._metrics["train"][name].append(value)
+    
+    def _calculate_rewards(self, inputs, prompts, completions, completion_ids_list):
+        rewards_per_func = super()._calculate_rewards(inputs, prompts, completions, completion_ids_list)
+        if self._rollout_keys is not None:
+            rewards = (rewards_per_func * self.reward_weights.to(rewards_per_func.device).unsqueeze(0)).nansum(dim=1)
+            start = self.accelerator.process_index * len(prompts)
+            self._last_rewards = rewards[start:start + len(prompts)].tolist()
+        return rewards_per_func
+    
+    def _replay_rollouts(self):
+        """Stored completions for this batch, if every process has fresh ones for all of its prompts"""
+        step = self.state.global_step
+        found = {}
+        for key, count in Counter(self._rollout_keys).items():
+            rollouts = self.rollout_store.lookup(key, count, step)
+            if rollouts is None:
+                found = None
+                break
+            found[key] = rollouts
+        
+        has_ref = found is not None and all(
+            rollout[3] is not None for rollouts in found.values() for rollout in rollouts
+        )
+        
+        # Every process must take the same branches, generation and the reference forward are collective calls
+        flags = torch.tensor([float(found is not None), float(has_ref)], device=self.accelerator.device)
+        available, has_ref = self.accelerator.gather(flags).view(-1, 2).min(dim=0).values.tolist()
+        if available == 0:
+            return None
+        
+        completion_ids, logprobs, ref_logps, staleness = [], [], [], []
+        for key in self._rollout_keys:
+            rollout_step, ids, rollout_logprobs, rollout_ref_logprobs = found[key].pop()
+            completion_ids.append(ids)
+            logprobs.append(rollout_logprobs.tolist())
+            ref_logps.append(rollout_ref_logprobs)
+            staleness.append(abs(step - rollout_step))
+        self._rollout_staleness = staleness
+        if has_ref and self.beta != 0.0:
+            # Restored by _generate_and_score_completions once the batch is scored
+            self._replay_ref_logps = ref_logps
+            self.beta = 0.0
+        return completion_ids, logprobs
+    
+    def _model_generate(self, model, num_generations, generate, **kwargs):
+        if self.answer_stop is not None:
+            kwargs["logits_processor"] = LogitsProcessorList([self.answer_stop])
+        if self.share_prompt_prefill:
+            return generate_with_shared_prefix(model, num_generations, generate=generate, **kwargs)
+        return generate(**kwargs)
+    
+    def _generate_single_turn(self, prompt_ids, images, multimodal_fields, num_generations, has_tool_images=False):
+        if self._rollout_keys is not None and self.reuse_rollouts:
+            replay = self._replay_rollouts()
+            if replay is not None:
+                return replay
+        
+        if (self.answer_stop is not None or self.share_prompt_prefill) and not self.use_vllm:
+            if self.answer_stop is not None:
+                # Prompts are left-padded to the longest one before generate
+                self.answer_stop.prompt_length = max(len(ids) for ids in prompt_ids)
+            model = self.accelerator.unwrap_model(self.model_wrapped)
+            with wrap_generate(model, partial(self._model_generate, model, num_generations)):
+                completion_ids, logprobs = super()._generate_single_turn(
+                    prompt_ids, images, multimodal_fields, num_generations, has_tool_images
+                )
+        else:
+            completion_ids, logprobs = super()._generate_single_turn(
+                prompt_ids, images, multimodal_fields, num_generations, has_tool_images
+            )
+        self._generated_ids = completion_ids
+        return completion_ids, logprobs
+    
+    @torch.no_grad()
+    def _behavior_logps(self, output):
+        logps, _, _ = self._get_per_token_logps_and_entropies(
+            self.model,
+            torch.cat([output["prompt_ids"], output["completion_ids"]], dim=1),
+            torch.cat([output["prompt_mask"], output["completion_mask"]], dim=1),
+            output["completion_ids"].size(1),
+            batch_size=self.args.per_device_train_batch_size,
+            pixel_values=output.get("pixel_values"),
+            image_grid_thw=output.get("image_grid_thw"),
+            num_images=output.get("num_images"),
+            pixel_attention_mask=output.get("pixel_attention_mask"),
+            image_sizes=output.get("image_sizes"),
+            token_type_ids=output.get("token_type_ids"),
+            mm_token_type_ids=output.get("mm_token_type_ids"),
+        )
+        return logps
+    
+    def _update_rollouts(self, output):
+        keys, self._rollout_keys = self._rollout_keys, None
+        metrics = self._metrics["train"]
+        
+        if self._rollout_staleness is not None:
+            # vLLM's importance sampling correction already compares against the sampling logprobs
+            if not (self.use_vllm and self.vllm_importance_sampling_correction):
+                output["old_per_token_logps"] = output["sampling_per_token_logps"]
+            if self._replay_ref_logps is not None:
+                ref_logps = torch.zeros(output["completion_ids"].shape, device=output["completion_ids"].device)
+                for row, values in enumerate(self._replay_ref_logps):
+                    values = torch.from_numpy(values[:ref_logps.size(1)])
+                    ref_logps[row, :len(values)] = values.to(ref_logps.device)
+                output["ref_per_token_logps"] = ref_logps
+            metrics["rollouts/replayed"].append(1.0)
+            metrics["rollouts/staleness"].append(sum(self._rollout_staleness) / len(self._rollout_staleness))
+            metrics["rollouts/ref_cached"].append(float(self._replay_ref_logps is not None))
+            self._rollout_staleness = self._replay_ref_logps = None
+        else:
+            logps = output.get("sampling_per_token_logps", output.get("old_per_token_logps"))
+            if logps is None:
+                logps = self._behavior_logps(output)
+            ref_logps = output.get("ref_per_token_logps")
+            self.rollout_store.add(
+                self.state.global_step,
+                keys,
+                self._generated_ids,
+                logps.float().cpu().numpy(),
+                self._last_rewards,
+                ref_logps.float().cpu().numpy() if ref_logps is not None else None
+            )
+            metrics["rollouts/replayed"].append(0.0)
+        metrics["rollouts/stored"].append(float(len(self.rollout_store)))
+        self._generated_ids = self._last_rewards = None
+    
+    def _generate_and_score_completions(self, inputs):
+        if self.rollout_store is not None and self.model.training and "prompt_id" in inputs[0]:
+            self._rollout_keys = [example["prompt_id"] for example in inputs]
+        beta = self.beta
+        try:
+            output = super()._generate_and_score_completions(inputs)
+        finally:
+            self.beta = beta
+        if self._rollout_keys is not None:
+            self._update_rollouts(output)
+        if self.difficulty_tracker is not None:
+            self._update_curriculum()
+        if not self.model.training or not (self.filter_zero_std or self.oversample_factor > 1):
+            return output
+        
+        num_generations = self.num_generations
+        num_rows = output["advantages"].size(0)
+        if num_rows % num_generations != 0:
+            return output
+        
+        # A group has zero reward std exactly when all its advantages are zero
+        is_zero_std = (output["advantages"].view(-1, num_generations).abs() < 1e-6).all(dim=1)
+        informative = torch.nonzero(~is_zero_std).flatten()
+        uninformative = torch.nonzero(is_zero_std).flatten()
+        
+        num_groups = num_rows // num_generations // self.oversample_factor
+        groups = torch.cat([informative, uninformative])[:num_groups]
+        masked_groups = (groups.unsqueeze(1) == uninformative.unsqueeze(0)).any(dim=1)
+        
+        rows = (groups.unsqueeze(1) * num_generations + torch.arange(num_generations, device=groups.device)).flatten()
+        dropped = rows.numel() != num_rows
+        if dropped:
+            output = split_pixel_values_by_grid(output)
+            output = select_rows(output, rows)
+            output = unsplit_pixel_values_by_grid(output)
+        
+        masked = self.filter_zero_std and bool(masked_groups.any())
+        if masked:
+            row_mask = (~masked_groups).repeat_interleave(num_generations).to(output["completion_mask"].dtype)
+            output["completion_mask"] = output["completion_mask"] * row_mask.unsqueeze(1)
+            if "tool_mask" in output:
+                output["tool_mask"] = output["tool_mask"] * row_mask.unsqueeze(1)
+        
+        # The loss normalizer was counted over every generated row; count only the tokens still trained on
+        if dropped or masked:
+            loss_mask = output["completion_mask"] if "tool_mask" not in output else output["completion_mask"] * output["tool_mask"]
+            output["num_items_in_batch"] = self.accelerator.gather(loss_mask.sum()).sum()
+        
+        num_used = int(min(informative.numel(), num_groups)) * num_generations
+        if not self.filter_zero_std:
+            num_used = rows.numel()
+        metrics = self._metrics["train"]
+        metrics["filter/frac_groups_zero_std"].append(is_zero_std.float().mean().item())
+        metrics["filter/wasted_generation_frac"].append(1.0 - num_used / num_rows)
+        metrics["filter/effective_batch_frac"].append(num_used / rows.numel())
+        return output
 
-def create_grpo_trainer(model, processor, train_dataset, val_dataset, reward_func, config, callbacks):
+def create_grpo_trainer(
+    model,
+    processor,
+    train_dataset,
+    val_dataset,
+    reward_func,
+    config,
+    callbacks,
+    difficulty_tracker=None,
+    rollout_store=None
+):
     grpo_config = TRLGRPOConfig(
         output_dir=config.output_dir,
         
@@ -13,6 +381,7 @@ def create_grpo_trainer(model, processor, train_dataset, val_dataset, reward_fun
         warmup_steps=10,
         
         num_generations=config.num_samples_per_prompt,
+        num_iterations=config.num_iterations,
         max_completion_length=config.max_new_tokens,
         max_prompt_length=2048,
         temperature=config.temperature,
@@ -38,7 +407,7 @@ def create_grpo_trainer(model, processor, train_dataset, val_dataset, reward_fun
         seed=42,
     )
     
-    trainer = GRPOTrainer(
+    trainer = FilteredGRPOTrainer(
         model=model,
         args=grpo_config,
         train_dataset=train_dataset,
@@ -46,6 +415,16 @@ def create_grpo_trainer(model, processor, train_dataset, val_dataset, reward_fun
         reward_funcs=[reward_func],
         processing_class=processor,
         callbacks=callbacks,
+        filter_zero_std=config.filter_zero_std_groups,
+        oversample_factor=config.oversample_factor,
+        difficulty_tracker=difficulty_tracker,
+        rollout_store=rollout_store,
+        reuse_rollouts=config.reuse_rollouts,
+        stop_at_answer=config.stop_at_answer,
+        constrain_answer=config.constrain_answer,
+        share_prompt_prefill=config.share_prompt_prefill,
+        logprob_backend=config.logprob_backend,
+        logprob_chunk_size=config.logprob_chunk_size,
     )
     
     return trainer
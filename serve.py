@@ -0,0 +1,382 @@
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import torch
+from transformers import Qwen3VLForConditionalGeneration, AutoProcessor
+
+from common import (
+    MIN_PIXELS,
+    MAX_PIXELS,
+    load_resized_image,
+    generate_batch,
+    StopAfterAnswer,
+    ConstrainedAnswer,
+    extract_answer,
+    has_answer_format,
+)
+
+SYSTEM_PROMPT = """You are a helpful assistant capable of visual reasoning.
+Provide step-by-step reasoning about the chart, then output your final answer
+in JSON format: {answer: 'your_answer'}"""
+
+class LatencyStats:
+    """
+    Request latencies and batch sizes of a MicroBatcher
+    
+    Latency runs from ``submit`` to the answer being ready, so it includes
+    image decoding, the time spent waiting for a batch and generation.
+    Throughput is measured from the first submitted request to the last answer.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.batch_sizes = []
+        self.first_arrival = None
+        self.last_finish = None
+    
+    def record(self, arrivals, finished):
+        with self._lock:
+            self.latencies.extend(finished - arrival for arrival in arrivals)
+            self.batch_sizes.append(len(arrivals))
+            first = min(arrivals)
+            if self.first_arrival is None or first < self.first_arrival:
+                self.first_arrival = first
+            self.last_finish = finished
+    
+    def summary(self):
+        with self._lock:
+            if not self.latencies:
+                return {"requests": 0, "batches": 0}
+            latencies = np.array(self.latencies) * 1000
+            elapsed = self.last_finish - self.first_arrival
+            return {
+                "requests": len(self.latencies),
+                "batches": len(self.batch_sizes),
+                "mean_batch_size": len(self.latencies) / len(self.batch_sizes),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p99_ms": float(np.percentile(latencies, 99)),
+                "max_ms": float(latencies.max()),
+                "throughput": len(self.latencies) / elapsed if elapsed > 0 else 0.0
+            }
+
+def format_stats(stats):
+    if not stats["requests"]:
+        return "No requests answered"
+    return (f"{stats['requests']} requests in {stats['batches']} batches "
+            f"(mean batch {stats['mean_batch_size']:.1f}), "
+            f"latency p50 {stats['p50_ms']:.0f} ms, p99 {stats['p99_ms']:.0f} ms, "
+            f"throughput {stats['throughput']:.2f} requests/s")
+
+class MicroBatcher:
+    """
+    Groups concurrent requests into dynamic micro-batches for generate_batch
+    
+    A worker thread takes the oldest waiting request and keeps collecting
+    until ``max_batch_size`` requests are in the batch or ``max_wait_ms`` has
+    passed since that request arrived, then answers the whole batch with one
+    ``generate`` call. Under light load a request waits at most
+    ``max_wait_ms`` for company; under heavy load batches fill up at once.
+    
+    ``submit`` only validates the request and hands its image to a pool of
+    ``decode_workers`` threads, so it returns at once and decoding overlaps
+    with the batch being generated; the worker waits for the images of the
+    batch it collected. A request whose image cannot be loaded resolves with
+    the error, and the rest of its batch is still answered.
+    """
+    
+    def __init__(
+        self,
+        model,
+        processor,
+        max_batch_size=8,
+        max_wait_ms=20.0,
+        max_new_tokens=256,
+        answer_stop=None,
+        image_dir="",
+        min_pixels=MIN_PIXELS,
+        max_pixels=MAX_PIXELS,
+        decode_workers=4
+    ):
+        self.model = model
+        self.processor = processor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_new_tokens = max_new_tokens
+        self.answer_stop = answer_stop
+        self.image_dir = os.path.realpath(image_dir)
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        self.stats = LatencyStats()
+        self._queue = queue.Queue()
+        self._decoder = ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="decode")
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+    
+    def submit(self, request):
+        """
+        Queue a request for the next micro-batch
+        
+        Args:
+            request: Dict with the ``image`` path (relative to ``image_dir``) and the ``question``
+        
+        Returns:
+            Future resolving to the answer record
+        
+        Raises:
+            ValueError: If the image or the question is missing, or the image is outside ``image_dir``
+        """
+        arrival = time.perf_counter()
+        if not request.get("image") or not request.get("question"):
+            raise ValueError("Request needs an 'image' and a 'question'")
+        image = self._decoder.submit(
+            load_resized_image, self._image_path(request["image"]), self.min_pixels, self.max_pixels
+        )
+        
+        conversation = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": [
+                {"type": "image"},
+                {"type": "text", "text": request["question"]}
+            ]}
+        ]
+        text = self.processor.apply_chat_template(conversation, tokenize=False, add_generation_prompt=True)
+        
+        future = Future()
+        self._queue.put((request, text, image, arrival, future))
+        return future
+    
+    def _image_path(self, image):
+        # Clients name images relative to image_dir; absolute paths, ".." and symlinks must not leave it
+        path = os.path.realpath(os.path.join(self.image_dir, str(image)))
+        if os.path.commonpath([self.image_dir, path]) != self.image_dir:
+            raise ValueError(f"Image path outside the image directory: {image}")
+        return path
+    
+    def close(self):
+        """Answer every queued request, then stop the worker"""
+        self._queue.put(None)
+        self._worker.join()
+        self._decoder.shutdown()
+    
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        # The wait is measured from the oldest request, so it bounds its queueing delay
+        deadline = first[3] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Answer this batch first, then stop at the sentinel
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+    
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            ready = []
+            for request, text, image, arrival, future in batch:
+                try:
+                    ready.append((request, text, image.result(), arrival, future))
+                except Exception as e:
+                    future.set_exception(e)
+            if not ready:
+                continue
+            requests, texts, images, arrivals, futures = zip(*ready)
+            try:
+                with torch.inference_mode():
+                    responses, num_tokens = generate_batch(
+                        self.model, self.processor, list(texts), list(images),
+                        max_new_tokens=self.max_new_tokens, answer_stop=self.answer_stop
+                    )
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            
+            finished = time.perf_counter()
+            self.stats.record(arrivals, finished)
+            for request, response, response_length, arrival, future in zip(
+                requests, responses, num_tokens, arrivals, futures
+            ):
+                future.set_result({
+                    "id": request.get("id"),
+                    "answer": extract_answer(response),
+                    "has_format": has_answer_format(response),
+                    "response": response,
+                    "response_length": response_length,
+                    "batch_size": len(ready),
+                    "latency_ms": (finished - arrival) * 1000
+                })
+
+def serve_jsonl(batcher, input_file="-", output_file="-"):
+    """
+    Answer the JSONL requests of ``input_file`` and stream answers to ``output_file``
+    
+    Requests are submitted as they are read and every answer is written as
+    soon as its batch finishes, so answers come back in completion order;
+    each carries the ``id`` of its request (its line number when absent).
+    Requests that cannot be read or answered produce an ``error`` record.
+    
+    Args:
+        batcher: MicroBatcher answering the requests
+        input_file: JSONL file with one request per line, or "-" for stdin
+        output_file: JSONL file for the answers, or "-" for stdout
+    
+    Returns:
+        Latency and throughput summary
+    """
+    source = sys.stdin if input_file == "-" else open(input_file, 'r', encoding='utf-8')
+    sink = sys.stdout if output_file == "-" else open(output_file, 'w', encoding='utf-8')
+    lock = threading.Lock()
+    
+    def write(record):
+        with lock:
+            sink.write(json.dumps(record, ensure_ascii=False) + "\n")
+            sink.flush()
+    
+    def write_result(request_id, future):
+        if future.exception() is not None:
+            write({"id": request_id, "error": str(future.exception())})
+        else:
+            write(future.result())
+    
+    try:
+        for line_number, line in enumerate(source):
+            if not line.strip():
+                continue
+            request_id = line_number
+            try:
+                request = json.loads(line)
+                request_id = request.setdefault("id", line_number)
+                future = batcher.submit(request)
+            except Exception as e:
+                write({"id": request_id, "error": str(e)})
+                continue
+            future.add_done_callback(lambda future, request_id=request_id: write_result(request_id, future))
+    finally:
+        # The worker writes answers to the sink until every queued request is done
+        batcher.close()
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    
+    return batcher.stats.summary()
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # POST / answers one request; GET /stats reports latency and throughput
+    
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        if self.path != "/stats":
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+        self._send_json(200, self.server.batcher.stats.summary())
+    
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            future = self.server.batcher.submit(json.loads(self.rfile.read(length)))
+        except Exception as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        try:
+            self._send_json(200, future.result())
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+    
+    def log_message(self, format, *args):
+        pass
+
+def serve_http(batcher, host="127.0.0.1", port=8000):
+    """
+    Answer requests POSTed as JSON to ``http://host:port/`` until interrupted
+    
+    Every connection is handled on its own thread and blocks on its future,
+    so concurrent clients share micro-batches. ``GET /stats`` returns the
+    latency and throughput summary.
+    """
+    server = ThreadingHTTPServer((host, port), _RequestHandler)
+    server.daemon_threads = True
+    server.batcher = batcher
+    print(f"Serving on http://{host}:{server.server_port} "
+          f"(max batch {batcher.max_batch_size}, max wait {batcher.max_wait * 1000:.0f} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+    return batcher.stats.summary()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a ChartQA model with dynamic micro-batching")
+    parser.add_argument("--model-name", default="Nhaass/Qwen3-VL-2B-ChartQA-GRPO")
+    parser.add_argument("--input", help="JSONL requests to answer ('-' for stdin); serves HTTP when omitted")
+    parser.add_argument("--output", default="-", help="JSONL file for the answers ('-' for stdout)")
+    parser.add_argument("--image-dir", default="", help="Directory the request image paths are relative to; paths outside it are rejected")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=20.0, help="Longest a request waits for its batch to fill")
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--stop-at-answer", action="store_true", help="End each response once its answer object is closed")
+    parser.add_argument("--constrain-answer", action="store_true", help="Keep the answer object well-formed once it is opened")
+    args = parser.parse_args()
+    
+    model = Qwen3VLForConditionalGeneration.from_pretrained(
+        args.model_name,
+        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+        device_map="auto",
+        trust_remote_code=True
+    )
+    model.eval()
+    processor = AutoProcessor.from_pretrained(args.model_name, trust_remote_code=True)
+    answer_stop = None
+    if args.constrain_answer:
+        answer_stop = ConstrainedAnswer.for_model(model, processor.tokenizer)
+    elif args.stop_at_answer:
+        answer_stop = StopAfterAnswer.for_model(model, processor.tokenizer)
+    
+    batcher = MicroBatcher(
+        model,
+        processor,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_new_tokens=args.max_new_tokens,
+        answer_stop=answer_stop,
+        image_dir=args.image_dir
+    )
+    if args.input is not None:
+        stats = serve_jsonl(batcher, args.input, args.output)
+    else:
+        stats = serve_http(batcher, args.host, args.port)
+    # Stats go to stderr so they never mix with answers streamed to stdout
+    print(format_stats(stats), file=sys.stderr)
@@ -8,9 +8,13 @@ data collators, and training utilities.
 Main Components:
     - Configuration classes: ModelConfig, LoRAConfig, DataConfig, TrainingConfig, SystemPromptConfig
     - Model utilities: load_model_and_processor, print_trainable_parameters
+    - Vision feature cache: VisionFeatureStore, precompute_vision_features, cached_encoder_outputs
     - Data utilities: load_json_data, format_response, build_conversation, load_and_process_dataset
-    - Custom collator: QwenCompletionCollator
-    - Trainer utilities: create_trainer
+    - Preprocessing cache: PreprocessCache, CachedSFTDataset
+    - Lazy loading: LazySFTDataset
+    - Custom collators: QwenCompletionCollator, QwenPackingCollator
+    - Batching: TokenBudgetBatchSampler, get_sample_lengths
+    - Trainer utilities: create_trainer, TokenBudgetTrainer
     - Callbacks: TrainingMonitorCallback
 
 """
@@ -33,6 +37,8 @@ from .config import (
 from .model import (
     load_model_and_processor,
     print_trainable_parameters,
+    precompute_vision_features,
+    cached_encoder_outputs,
 )
 
 # Data utilities
@@ -41,14 +47,24 @@ from .data_loader import (
     format_response,
     build_conversation,
     process_single_item,
+    CachedSFTDataset,
+    preprocess_into_cache,
+    build_cached_dataset,
+    LazySFTDataset,
     load_and_process_dataset,
 )
 
-# Custom collator
-from .collator import QwenCompletionCollator
+# Preprocessing cache
+from .cache import PreprocessCache, processor_fingerprint, VisionFeatureStore, vision_fingerprint
+
+# Custom collators
+from .collator import QwenCompletionCollator, QwenPackingCollator, mrope_position_ids
+
+# Batching
+from .sampler import TokenBudgetBatchSampler, get_sample_lengths, estimate_num_patches
 
 # Trainer utilities
-from .trainer import create_trainer
+from .trainer import create_trainer, TokenBudgetTrainer
 
 # Callbacks
 from .callbacks import TrainingMonitorCallback
@@ -71,19 +87,39 @@ __all__ = [
     # Model
     "load_model_and_processor",
     "print_trainable_parameters",
+    "precompute_vision_features",
+    "cached_encoder_outputs",
     
     # Data
     "load_json_data",
     "format_response",
     "build_conversation",
     "process_single_item",
+    "CachedSFTDataset",
+    "preprocess_into_cache",
+    "build_cached_dataset",
+    "LazySFTDataset",
     "load_and_process_dataset",
     
+    # Cache
+    "PreprocessCache",
+    "processor_fingerprint",
+    "VisionFeatureStore",
+    "vision_fingerprint",
+    
     # Collator
     "QwenCompletionCollator",
+    "QwenPackingCollator",
+    "mrope_position_ids",
+    
+    # Batching
+    "TokenBudgetBatchSampler",
+    "get_sample_lengths",
+    "estimate_num_patches",
     
     # Training
     "create_trainer",
+    "TokenBudgetTrainer",
     
     # Callbacks
     "TrainingMonitorCallback",
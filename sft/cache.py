@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional
+
+import numpy as np
+import torch
+
+# Bump whenever the layout of a cache entry or the preprocessing itself changes
+CACHE_VERSION = 1
+
+CACHED_ARRAYS = ("input_ids", "pixel_values", "image_grid_thw")
+
+
+def hash_file(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Compute the SHA-256 digest of a file's bytes
+
+    Args:
+        file_path: Path to the file
+        chunk_size: Number of bytes read per chunk
+
+    Returns:
+        Hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def processor_fingerprint(processor) -> str:
+    """
+    Fingerprint everything about the processor that affects preprocessing output:
+    tokenizer identity and vocabulary, chat template and image processor settings.
+
+    Args:
+        processor: Model processor
+
+    Returns:
+        Hex digest identifying the processor configuration
+    """
+    tokenizer = processor.tokenizer
+    image_processor = getattr(processor, "image_processor", None)
+
+    state = {
+        "tokenizer": getattr(tokenizer, "name_or_path", ""),
+        "tokenizer_class": type(tokenizer).__name__,
+        "vocab_size": len(tokenizer),
+        "chat_template": getattr(processor, "chat_template", None) or getattr(tokenizer, "chat_template", None),
+        "image_processor": image_processor.to_dict() if image_processor is not None else None,
+    }
+    payload = json.dumps(state, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class PreprocessCache:
+    """
+    Content-addressed on-disk cache of preprocessed SFT samples.
+
+    Every entry is a directory holding one ``.npy`` file per array in
+    ``CACHED_ARRAYS`` plus a small ``meta.json``, so entries can be opened with
+    ``np.load(mmap_mode='r')`` without reading pixel patches into memory.
+    The key covers the image bytes, the record text, the system prompt, the
+    processor fingerprint and the pixel budget, so only changed records are
+    reprocessed.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        processor,
+        system_prompt: str,
+        max_pixels: Optional[int] = None,
+        image_store=None
+    ):
+        self.cache_dir = cache_dir
+        self.system_prompt = system_prompt
+        self.fingerprint = processor_fingerprint(processor)
+
+        # Images from a store are resized to its budget before they reach the processor
+        self.min_pixels = image_store.min_pixels if image_store is not None else None
+        if image_store is not None:
+            max_pixels = image_store.max_pixels
+        elif max_pixels is None:
+            max_pixels = getattr(getattr(processor, "image_processor", None), "max_pixels", None)
+        self.max_pixels = max_pixels
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def record_key(self, item: Dict, image_path: str) -> str:
+        """Build the cache key of a raw record"""
+        digest = hashlib.sha256()
+        parts = (
+            CACHE_VERSION,
+            hash_file(image_path),
+            item['question'],
+            item['think'],
+            item['label'],
+            self.system_prompt,
+            self.fingerprint,
+            self.min_pixels,
+            self.max_pixels,
+        )
+        for part in parts:
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self._entry_dir(key), "meta.json"))
+
+    def load_meta(self, key: str) -> Dict:
+        with open(os.path.join(self._entry_dir(key), "meta.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def load(self, key: str, mmap: bool = True) -> Dict[str, np.ndarray]:
+        """
+        Load the arrays of a cached sample
+
+        Args:
+            key: Cache key
+            mmap: Memory-map the arrays instead of reading them
+
+        Returns:
+            Dictionary of numpy arrays keyed by name
+        """
+        entry_dir = self._entry_dir(key)
+        mmap_mode = 'r' if mmap else None
+        return {
+            name: np.load(os.path.join(entry_dir, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in CACHED_ARRAYS
+        }
+
+    def save(self, key: str, processed: Dict) -> None:
+        """
+        Store the output of ``process_single_item``
+
+        The entry is written to a temporary directory first and renamed into
+        place, so concurrent writers and interrupted runs never leave a
+        partially written entry behind.
+        """
+        entry_dir = self._entry_dir(key)
+        if os.path.exists(entry_dir):
+            return
+
+        parent_dir = os.path.dirname(entry_dir)
+        os.makedirs(parent_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=parent_dir, prefix=".tmp-")
+
+        try:
+            for name in CACHED_ARRAYS:
+                value = processed[name]
+                if isinstance(value, torch.Tensor):
+                    value = value.cpu().numpy()
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(value))
+
+            image_grid_thw = np.asarray(processed["image_grid_thw"])
+            meta = {
+                "version": CACHE_VERSION,
+                "num_tokens": int(len(processed["input_ids"])),
+                "num_patches": int(image_grid_thw.prod(axis=-1).sum()),
+            }
+            with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # Another worker stored the same entry first
+            if not os.path.exists(entry_dir):
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def vision_fingerprint(model) -> str:
+    """
+    Fingerprint the vision tower whose outputs a ``VisionFeatureStore`` holds:
+    checkpoint name, vision config and parameter dtype.
+
+    Args:
+        model: Qwen-VL model (optionally wrapped by PEFT)
+
+    Returns:
+        Hex digest identifying the vision encoder
+    """
+    config = model.config
+    state = {
+        "model": getattr(config, "name_or_path", ""),
+        "vision_config": config.vision_config.to_dict(),
+        "dtype": str(next(model.parameters()).dtype),
+    }
+    payload = json.dumps(state, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class VisionFeatureStore:
+    """
+    On-disk store of vision encoder outputs, one entry per preprocessed sample.
+
+    Every sample is stored as one ``.npy`` array of shape
+    ``(1 + num_deepstack_layers, num_tokens, hidden_size)``: the merged
+    embeddings of its images, in order, followed by the deepstack features the
+    language model adds to its early layers. Arrays are opened with
+    ``np.load(mmap_mode='r')``. Entries are keyed by the sample's
+    ``PreprocessCache`` key, which already covers the image bytes and the
+    pixel budget, together with the vision tower fingerprint, so looking a
+    sample up never hashes its pixels.
+    """
+
+    def __init__(self, directory: str, fingerprint: str):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        os.makedirs(directory, exist_ok=True)
+
+    def feature_key(self, cache_key: str) -> str:
+        """Build the key of a sample's features from its preprocessing cache key"""
+        payload = f"{CACHE_VERSION}\0{self.fingerprint}\0{cache_key}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.npy")
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def load(self, key: str, mmap: bool = True) -> np.ndarray:
+        return np.load(self._path(key), mmap_mode='r' if mmap else None)
+
+    def save(self, key: str, features: np.ndarray) -> None:
+        """Store the features of one sample, written to a temporary file and renamed into place"""
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-", suffix=".npy")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.ascontiguousarray(features))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -17,6 +17,11 @@ class TrainingMonitorCallback(TrainerCallback):
             # Learning rate
             if "learning_rate" in logs:
                 print(f"📈 Step {step}: LR = {logs['learning_rate']:.2e}")
+            
+            # Batch padding
+            if "padding_efficiency" in logs:
+                print(f"📦 Step {step}: Padding efficiency = {logs['padding_efficiency']:.1%} "
+                      f"({logs['tokens_per_batch']:.0f} tokens/batch)")
     
     def on_epoch_end(self, args, state, control, **kwargs):
         print(f"\n🎯 Epoch {state.epoch} completed!\n")
@@ -1,11 +1,23 @@
 import torch
 from dataclasses import dataclass
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
+
+from .cache import VisionFeatureStore
 
 @dataclass
 class QwenCompletionCollator:
+    """
+    Collator that pads samples and trains only on the assistant response
+    
+    With a ``feature_store``, samples are looked up by their preprocessing
+    ``cache_key`` and the batch carries the cached ``image_embeds`` and ``deepstack_embeds``
+    instead of ``pixel_values``, so the forward pass skips the vision
+    encoder. If any sample of the batch has no key or is missing from the
+    store, the batch falls back to ``pixel_values``.
+    """
     
     processor: Any
+    feature_store: Optional[VisionFeatureStore] = None
     
     def __post_init__(self):
 
@@ -44,44 +56,219 @@ class QwenCompletionCollator:
             padding_value=-100
         )
         
-        pixel_values = torch.cat([f["pixel_values"] for f in features], dim=0)
-        image_grid_thw = torch.cat([f["image_grid_thw"] for f in features], dim=0)
-        
         labels = self._mask_labels(input_ids, labels)
         
         return {
             "input_ids": input_ids,
             "attention_mask": attention_masks,
             "labels": labels,
-            "pixel_values": pixel_values,
+            **self._vision_inputs(features)
+        }
+    
+    def _vision_inputs(self, features: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        """
+        Image inputs of the given samples, in order
+        
+        Returns:
+            ``image_embeds``, ``deepstack_embeds`` and ``image_grid_thw`` when
+            every sample is in the feature store, otherwise ``pixel_values``
+            and ``image_grid_thw``
+        """
+        image_grid_thw = torch.cat([torch.as_tensor(f["image_grid_thw"]) for f in features], dim=0)
+        
+        if self.feature_store is not None and all("cache_key" in f for f in features):
+            cached = []
+            for f in features:
+                key = self.feature_store.feature_key(f["cache_key"])
+                if not self.feature_store.contains(key):
+                    print("⚠️  Vision features missing from the store, running the encoder for this batch")
+                    break
+                cached.append(torch.tensor(self.feature_store.load(key)))
+            else:
+                cached = torch.cat(cached, dim=1)
+                return {
+                    "image_embeds": cached[0],
+                    "deepstack_embeds": cached[1:],
+                    "image_grid_thw": image_grid_thw
+                }
+        
+        return {
+            "pixel_values": torch.cat([torch.as_tensor(f["pixel_values"]) for f in features], dim=0),
             "image_grid_thw": image_grid_thw
         }
     
-    def _mask_labels(self, input_ids: torch.Tensor, labels: torch.Tensor) -> torch.Tensor:
+    def _find_response_starts(self, input_ids: torch.Tensor) -> torch.Tensor:
+        """
+        Locate the assistant response of every row at once
+        
+        Compares all sliding windows of the padded batch against the response
+        template and keeps the last match per row, so multi-turn samples only
+        train on the final answer.
+        
+        Returns:
+            Index of the first response token per row, -1 where the template is missing
+        """
         n = len(self.response_token_ids)
-        masked_count = 0
-        not_found_count = 0
+        batch_size, seq_len = input_ids.shape
+        if seq_len < n:
+            return torch.full((batch_size,), -1, dtype=torch.long, device=input_ids.device)
         
-        for i in range(len(input_ids)):
-            start_idx = -1
-            
+        template = torch.tensor(self.response_token_ids, dtype=input_ids.dtype, device=input_ids.device)
+        matches = (input_ids.unfold(1, n, 1) == template).all(dim=-1)
+        
+        positions = torch.arange(matches.size(1), device=input_ids.device)
+        last_match = torch.where(matches, positions, -1).max(dim=1).values
+        
+        return torch.where(last_match >= 0, last_match + n, last_match)
+    
+    def _mask_labels(self, input_ids: torch.Tensor, labels: torch.Tensor) -> torch.Tensor:
+        start_idx = self._find_response_starts(input_ids)
+        not_found = start_idx < 0
+        
+        positions = torch.arange(input_ids.size(1), device=input_ids.device).unsqueeze(0)
+        prompt_mask = (positions < start_idx.unsqueeze(1)) | not_found.unsqueeze(1)
+        labels = labels.masked_fill(prompt_mask, -100)
+        
+        not_found_count = int(not_found.sum())
+        if not_found_count > 0:
+            print(f"⚠️  Response template not found in {not_found_count}/{len(input_ids)} samples")
+        
+        return labels
 
-            for j in range(len(input_ids[i]) - n + 1):
-                if input_ids[i][j : j + n].tolist() == self.response_token_ids:
-                    start_idx = j + n
-                    break
-            
-            if start_idx != -1:
 
-                labels[i, :start_idx] = -100
-                masked_count += 1
-            else:
-
-                labels[i, :] = -100
-                not_found_count += 1
+def mrope_position_ids(
+    input_ids: torch.Tensor,
+    image_grid_thw: torch.Tensor,
+    image_token_id: int,
+    merge_size: int
+) -> torch.Tensor:
+    """
+    Qwen-VL multimodal rotary positions of a single unpadded sample
+    
+    Text tokens advance all three axes together; the tokens of an image get
+    (temporal, height, width) grid coordinates offset by the position the
+    image starts at, and the following text resumes after the larger side of
+    the merged grid.
+    
+    Args:
+        input_ids: Token ids of shape (seq_len,)
+        image_grid_thw: Grid of every image in the sample, shape (num_images, 3)
+        image_token_id: Id of the image placeholder token
+        merge_size: Spatial merge size of the vision encoder
         
+    Returns:
+        Position ids of shape (3, seq_len)
+    """
+    is_image = (input_ids == image_token_id).tolist()
+    position_ids = torch.zeros(3, len(input_ids), dtype=torch.long)
+    
+    grids = iter(image_grid_thw.tolist())
+    current_pos = 0
+    idx = 0
+    while idx < len(input_ids):
+        if not is_image[idx]:
+            position_ids[:, idx] = current_pos
+            current_pos += 1
+            idx += 1
+            continue
+        
+        t, h, w = next(grids)
+        h, w = h // merge_size, w // merge_size
+        num_tokens = t * h * w
+        position_ids[0, idx:idx + num_tokens] = current_pos + torch.arange(t).repeat_interleave(h * w)
+        position_ids[1, idx:idx + num_tokens] = current_pos + torch.arange(h).repeat_interleave(w).repeat(t)
+        position_ids[2, idx:idx + num_tokens] = current_pos + torch.arange(w).repeat(t * h)
+        current_pos += max(t, h, w)
+        idx += num_tokens
+    
+    return position_ids
+
 
+@dataclass
+class QwenPackingCollator(QwenCompletionCollator):
+    """
+    Collator that packs several samples into each row
+    
+    Samples are placed first-fit-decreasing into rows of at most
+    ``max_seq_length`` tokens. Every sample keeps its own assistant-span label
+    mask and its own position ids starting from zero; the returned
+    ``position_ids`` carry a text row followed by the three multimodal rotary
+    rows, which the model uses to restrict attention to each packed sample.
+    The image inputs follow the order in which images appear in the packed
+    rows. No ``attention_mask`` is returned, since an
+    explicit mask would disable the per-sample boundaries; row padding sits at
+    the end of each row and is excluded from the loss. The boundaries are only
+    derived when the forward pass runs without a KV cache, so the model needs
+    ``config.use_cache = False``.
+    """
+    
+    max_seq_length: int = 1024
+    
+    def __post_init__(self):
+        super().__post_init__()
+        tokenizer = self.processor.tokenizer
+        self.image_token_id = getattr(self.processor, "image_token_id", None)
+        if self.image_token_id is None:
+            self.image_token_id = tokenizer.convert_tokens_to_ids("<|image_pad|>")
+        self.merge_size = self.processor.image_processor.merge_size
+    
+    def _pack(self, lengths: List[int]) -> List[List[int]]:
+        rows, row_lengths = [], []
+        for idx in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+            for row, row_length in enumerate(row_lengths):
+                if row_length + lengths[idx] <= self.max_seq_length:
+                    rows[row].append(idx)
+                    row_lengths[row] += lengths[idx]
+                    break
+            else:
+                rows.append([idx])
+                row_lengths.append(lengths[idx])
+        return rows
+    
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        from torch.nn.utils.rnn import pad_sequence
+        
+        sample_input_ids = [f["input_ids"] for f in features]
+        lengths = [len(ids) for ids in sample_input_ids]
+        
+        # Locate every sample's assistant span in one vectorized pass
+        padded = pad_sequence(sample_input_ids, batch_first=True, padding_value=self.processor.tokenizer.pad_token_id)
+        starts = self._find_response_starts(padded).tolist()
+        not_found_count = sum(start < 0 for start in starts)
         if not_found_count > 0:
-            print(f"⚠️  Response template not found in {not_found_count}/{len(input_ids)} samples")
+            print(f"⚠️  Response template not found in {not_found_count}/{len(features)} samples")
         
-        return labels
+        row_input_ids, row_labels, row_position_ids = [], [], []
+        image_features = []
+        for row in self._pack(lengths):
+            input_ids, labels, position_ids = [], [], []
+            for idx in row:
+                ids = sample_input_ids[idx]
+                sample_labels = features[idx]["labels"].clone()
+                sample_labels[:starts[idx] if starts[idx] >= 0 else len(ids)] = -100
+                
+                rope_ids = mrope_position_ids(ids, features[idx]["image_grid_thw"], self.image_token_id, self.merge_size)
+                text_ids = torch.arange(len(ids)).unsqueeze(0)
+                
+                input_ids.append(ids)
+                labels.append(sample_labels)
+                position_ids.append(torch.cat([text_ids, rope_ids], dim=0))
+                image_features.append(features[idx])
+            
+            row_input_ids.append(torch.cat(input_ids))
+            row_labels.append(torch.cat(labels))
+            row_position_ids.append(torch.cat(position_ids, dim=1))
+        
+        max_len = max(len(ids) for ids in row_input_ids)
+        position_ids = torch.zeros(4, len(row_input_ids), max_len, dtype=torch.long)
+        for row, ids in enumerate(row_position_ids):
+            position_ids[:, row, :ids.size(1)] = ids
+            # Padding continues as its own sequence so it never attends into the last sample
+            position_ids[:, row, ids.size(1):] = torch.arange(max_len - ids.size(1))
+        
+        return {
+            "input_ids": pad_sequence(row_input_ids, batch_first=True, padding_value=self.processor.tokenizer.pad_token_id),
+            "labels": pad_sequence(row_labels, batch_first=True, padding_value=-100),
+            "position_ids": position_ids,
+            **self._vision_inputs(image_features)
+        }
@@ -2,6 +2,8 @@ from dataclasses import dataclass, field
 from typing import Optional
 import os
 
+from common import MIN_PIXELS, MAX_PIXELS
+
 @dataclass
 class ModelConfig:
     model_name: str = "Qwen/Qwen3-VL-2B-Thinking"
@@ -25,6 +27,13 @@ class DataConfig:
     train_images: str = "ChartQADataset/train/png"
     val_images: str = "ChartQADataset/val/png"
     batch_size: int = 4
+    cache_dir: Optional[str] = "cache/sft"
+    lazy: bool = False
+    num_proc: int = 1
+    image_store_dir: Optional[str] = "cache/images"
+    min_pixels: int = MIN_PIXELS
+    max_pixels: int = MAX_PIXELS
+    vision_feature_dir: Optional[str] = None
     
     def __post_init__(self):
         """Convert relative paths to absolute"""
@@ -33,6 +42,12 @@ class DataConfig:
         self.val_file = os.path.join(base_path, self.val_file)
         self.train_images = os.path.join(base_path, self.train_images)
         self.val_images = os.path.join(base_path, self.val_images)
+        if self.cache_dir is not None:
+            self.cache_dir = os.path.join(base_path, self.cache_dir)
+        if self.image_store_dir is not None:
+            self.image_store_dir = os.path.join(base_path, self.image_store_dir)
+        if self.vision_feature_dir is not None:
+            self.vision_feature_dir = os.path.join(base_path, self.vision_feature_dir)
 
 @dataclass
 class TrainingConfig:
@@ -59,6 +74,12 @@ class TrainingConfig:
     report_to: str = "none"
     remove_unused_columns: bool = False
     early_stopping_patience: int = 3
+    dataloader_num_workers: int = 2
+    dataloader_prefetch_factor: int = 2
+    dataloader_pin_memory: bool = True
+    max_tokens_per_batch: Optional[int] = 8192
+    length_bucket_size: int = 256
+    packing: bool = False
 
 @dataclass
 class SystemPromptConfig:
@@ -1,8 +1,14 @@
 import json
 import os
+import torch
 from PIL import Image
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 from functools import partial
+from tqdm import tqdm
+
+from common import ImageStore
+
+from .cache import PreprocessCache
 
 def load_json_data(file_path: str) -> List[Dict]:
     """
@@ -13,6 +19,7 @@ def load_json_data(file_path: str) -> List[Dict]:
         
     Returns:
         List of data items
+    """
     with open(file_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
     return data
@@ -51,12 +58,16 @@ def process_single_item(
     item: Dict,
     image_folder: str,
     system_prompt: str,
-    processor
+    processor,
+    image_store: Optional[ImageStore] = None
 ) -> Dict:
     # Load image
     image_path = os.path.join(image_folder, item['image'])
     try:
-        image = Image.open(image_path).convert("RGB")
+        if image_store is not None:
+            image = image_store.load(image_path)
+        else:
+            image = Image.open(image_path).convert("RGB")
     except Exception as e:
         print(f"Error loading image {image_path}: {e}")
         return None
@@ -102,8 +113,18 @@ def format_and_transform(
     examples: Dict,
     image_folder: str,
     system_prompt: str,
-    processor
+    processor,
+    image_store: Optional[ImageStore] = None
 ) -> Dict:
+    """
+    Process a batch of raw examples for ``datasets.Dataset.map``
+    
+    Args:
+        examples: Batch of raw examples (column name -> list of values)
+        image_folder: Path to image folder
+        system_prompt: System prompt
+        processor: Model processor
+        image_store: Store of pre-resized images
         
     Returns:
         Batch of processed examples
@@ -124,7 +145,7 @@ def format_and_transform(
             "label": examples["label"][i]
         }
         
-        processed = process_single_item(item, image_folder, system_prompt, processor)
+        processed = process_single_item(item, image_folder, system_prompt, processor, image_store)
         
         if processed is not None:
             batch_input_ids.append(processed["input_ids"])
@@ -141,12 +162,293 @@ def format_and_transform(
         "labels": batch_labels
     }
 
+def load_cached_sample(cache: PreprocessCache, key: str) -> Dict:
+    """
+    Rebuild the output of ``process_single_item`` from a cache entry
+    
+    Args:
+        cache: Preprocessing cache
+        key: Cache key of the sample
+        
+    Returns:
+        Processed sample, with its ``cache_key`` for the vision feature store
+    """
+    arrays = cache.load(key)
+    input_ids = torch.tensor(arrays["input_ids"])
+    
+    return {
+        "input_ids": input_ids,
+        "attention_mask": torch.ones_like(input_ids),
+        "pixel_values": torch.tensor(arrays["pixel_values"]),
+        "image_grid_thw": torch.tensor(arrays["image_grid_thw"]),
+        "labels": input_ids.clone(),
+        "cache_key": key
+    }
+
+class CachedSFTDataset(torch.utils.data.Dataset):
+    """
+    Dataset over samples stored in a ``PreprocessCache``
+
+    Arrays are memory-mapped on access, so only the samples of the current
+    batch are ever resident in memory.
+    """
+    
+    def __init__(self, cache: PreprocessCache, keys: List[str]):
+        self.cache = cache
+        self.keys = keys
+    
+    def __len__(self):
+        return len(self.keys)
+    
+    def __getitem__(self, idx: int) -> Dict:
+        return load_cached_sample(self.cache, self.keys[idx])
+    
+    def get_lengths(self) -> List[Tuple[int, int]]:
+        """(text tokens, vision patches) of every sample, read from the cache metadata"""
+        lengths = []
+        for key in self.keys:
+            meta = self.cache.load_meta(key)
+            lengths.append((meta["num_tokens"], meta["num_patches"]))
+        return lengths
+
+# Per-process state of the preprocessing pool, set by ``_init_preprocess_worker``
+_worker_state: Dict = {}
+
+def _init_preprocess_worker(
+    image_folder: str,
+    system_prompt: str,
+    processor,
+    cache: PreprocessCache,
+    image_store: Optional[ImageStore]
+):
+    _worker_state.update(
+        image_folder=image_folder,
+        system_prompt=system_prompt,
+        processor=processor,
+        cache=cache,
+        image_store=image_store
+    )
+
+def _preprocess_into_cache(job: Tuple[str, Dict]) -> Optional[str]:
+    key, item = job
+    processed = process_single_item(
+        item,
+        _worker_state["image_folder"],
+        _worker_state["system_prompt"],
+        _worker_state["processor"],
+        _worker_state["image_store"]
+    )
+    if processed is None:
+        return None
+    _worker_state["cache"].save(key, processed)
+    return key
+
+def preprocess_into_cache(
+    jobs: List[Tuple[str, Dict]],
+    image_folder: str,
+    system_prompt: str,
+    processor,
+    cache: PreprocessCache,
+    num_proc: int = 1,
+    image_store: Optional[ImageStore] = None
+) -> List[str]:
+    """
+    Process records and store them in the cache
+    
+    With ``num_proc > 1`` the records are spread over a process pool; every
+    worker receives its own copy of the processor once at startup and writes
+    its results straight to the cache, so only keys travel back.
+    
+    Args:
+        jobs: (cache key, raw record) pairs to process
+        image_folder: Path to image folder
+        system_prompt: System prompt
+        processor: Model processor
+        cache: Preprocessing cache
+        num_proc: Number of worker processes
+        image_store: Store of pre-resized images
+        
+    Returns:
+        Keys of the records that were processed successfully
+    """
+    init_args = (image_folder, system_prompt, processor, cache, image_store)
+    
+    if num_proc <= 1 or len(jobs) <= 1:
+        _init_preprocess_worker(*init_args)
+        results = [_preprocess_into_cache(job) for job in tqdm(jobs, desc="Preprocessing")]
+    else:
+        import multiprocessing
+        
+        with multiprocessing.Pool(num_proc, initializer=_init_preprocess_worker, initargs=init_args) as pool:
+            results = list(tqdm(
+                pool.imap(_preprocess_into_cache, jobs, chunksize=4),
+                total=len(jobs),
+                desc=f"Preprocessing ({num_proc} workers)"
+            ))
+    
+    return [key for key in results if key is not None]
+
+def build_cached_dataset(
+    data_file: str,
+    image_folder: str,
+    system_prompt: str,
+    processor,
+    cache_dir: str,
+    max_pixels: Optional[int] = None,
+    num_proc: int = 1,
+    image_store: Optional[ImageStore] = None
+) -> CachedSFTDataset:
+    """
+    Build a dataset backed by the on-disk preprocessing cache
+    
+    Records already present in the cache are only hashed; new or changed
+    records are processed and stored.
+    
+    Args:
+        data_file: Path to JSON data file
+        image_folder: Path to image folder
+        system_prompt: System prompt
+        processor: Model processor
+        cache_dir: Directory of the preprocessing cache
+        max_pixels: Image pixel budget (defaults to the processor setting)
+        num_proc: Number of processes used for records missing from the cache
+        image_store: Store of pre-resized images (its budget overrides max_pixels)
+        
+    Returns:
+        Cached dataset
+    """
+    cache = PreprocessCache(cache_dir, processor, system_prompt, max_pixels=max_pixels, image_store=image_store)
+    data = load_json_data(data_file)
+    
+    keys = []
+    jobs = []
+    for item in tqdm(data, desc="Hashing records"):
+        image_path = os.path.join(image_folder, item['image'])
+        if not os.path.exists(image_path):
+            print(f"Error loading image {image_path}: file not found")
+            continue
+        
+        key = cache.record_key(item, image_path)
+        if not cache.contains(key):
+            jobs.append((key, item))
+        keys.append(key)
+    
+    processed = set(preprocess_into_cache(
+        jobs, image_folder, system_prompt, processor, cache, num_proc, image_store
+    ))
+    failed = {key for key, _ in jobs} - processed
+    keys = [key for key in keys if key not in failed]
+    
+    print(f"📦 Cache: {len(keys) - len(processed)} reused, {len(processed)} processed ({cache_dir})")
+    
+    return CachedSFTDataset(cache, keys)
+
+class LazySFTDataset(torch.utils.data.Dataset):
+    """
+    Dataset that keeps only the raw records and processes samples on access
+    
+    Image decoding and the processor run inside ``__getitem__``, i.e. in the
+    DataLoader workers, and only ``num_workers * prefetch_factor`` batches
+    are in flight at any time, so memory does not grow with the dataset.
+    When a ``PreprocessCache`` is given, processed samples are looked up in
+    and written to it on the fly.
+    """
+    
+    # Number of following records tried when a sample cannot be processed
+    max_retries = 8
+    
+    def __init__(
+        self,
+        data: List[Dict],
+        image_folder: str,
+        system_prompt: str,
+        processor,
+        cache: Optional[PreprocessCache] = None,
+        image_store: Optional[ImageStore] = None
+    ):
+        self.image_folder = image_folder
+        self.system_prompt = system_prompt
+        self.processor = processor
+        self.cache = cache
+        self.image_store = image_store
+        self.records = [
+            {key: item[key] for key in ("image", "question", "think", "label")}
+            for item in data
+            if os.path.exists(os.path.join(image_folder, item['image']))
+        ]
+    
+    def __len__(self):
+        return len(self.records)
+    
+    def _load(self, item: Dict) -> Optional[Dict]:
+        if self.cache is None:
+            return process_single_item(
+                item, self.image_folder, self.system_prompt, self.processor, self.image_store
+            )
+        
+        key = self.cache.record_key(item, os.path.join(self.image_folder, item['image']))
+        if not self.cache.contains(key):
+            processed = process_single_item(
+                item, self.image_folder, self.system_prompt, self.processor, self.image_store
+            )
+            if processed is None:
+                return None
+            self.cache.save(key, processed)
+            processed["cache_key"] = key
+            return processed
+        
+        return load_cached_sample(self.cache, key)
+    
+    def get_lengths(self) -> List[Tuple[int, int]]:
+        """
+        Estimate (text tokens, vision patches) of every sample without decoding images
+        
+        Only the image header is read for its size; the chat text is tokenized
+        with a single image placeholder that is expanded to the merged patch count.
+        """
+        from .sampler import estimate_num_patches
+        
+        image_processor = self.processor.image_processor
+        merge_length = image_processor.merge_size ** 2
+        
+        lengths = []
+        for item in self.records:
+            image_path = os.path.join(self.image_folder, item['image'])
+            if self.image_store is not None and self.image_store.contains(image_path):
+                width, height = self.image_store.size(image_path)
+            else:
+                with Image.open(image_path) as image:
+                    width, height = image.size
+            num_patches = estimate_num_patches(width, height, image_processor)
+            
+            conversation = build_conversation(self.system_prompt, item['question'], item['think'], item['label'])
+            conversation[1]["content"] = [
+                {"type": "image"},
+                {"type": "text", "text": item['question']}
+            ]
+            text = self.processor.apply_chat_template(conversation, tokenize=False, add_generation_prompt=False)
+            num_text_tokens = len(self.processor.tokenizer(text, add_special_tokens=False)["input_ids"])
+            
+            lengths.append((num_text_tokens - 1 + num_patches // merge_length, num_patches))
+        return lengths
+    
+    def __getitem__(self, idx: int) -> Dict:
+        for offset in range(self.max_retries):
+            processed = self._load(self.records[(idx + offset) % len(self.records)])
+            if processed is not None:
+                return processed
+        raise RuntimeError(f"Could not process any of {self.max_retries} records starting at index {idx}")
+
 def load_and_process_dataset(
     data_file: str,
     image_folder: str,
     system_prompt: str,
     processor,
-    batch_size: int = 4
+    batch_size: int = 4,
+    cache_dir: Optional[str] = None,
+    lazy: bool = False,
+    num_proc: int = 1,
+    image_store: Optional[ImageStore] = None
 ):
     """
     Load and process dataset
@@ -157,10 +459,45 @@ def load_and_process_dataset(
         system_prompt: System prompt
         processor: Model processor
         batch_size: Batch size for processing
+        cache_dir: If set, serve samples from the on-disk preprocessing cache
+        lazy: Keep raw records and process samples on access
+        num_proc: Number of processes used for preprocessing
+        image_store: Store of pre-resized images, filled with this dataset's images
+            unless ``lazy`` (images missing from it are then decoded on access)
         
     Returns:
         Processed dataset
     """
+    # Filling the store decodes every image up front, which lazy loading exists to avoid
+    if image_store is not None and not lazy:
+        image_store.add(
+            os.path.join(image_folder, item['image']) for item in load_json_data(data_file)
+        )
+    
+    if lazy:
+        cache = None
+        if cache_dir is not None:
+            cache = PreprocessCache(cache_dir, processor, system_prompt, image_store=image_store)
+        return LazySFTDataset(
+            data=load_json_data(data_file),
+            image_folder=image_folder,
+            system_prompt=system_prompt,
+            processor=processor,
+            cache=cache,
+            image_store=image_store
+        )
+    
+    if cache_dir is not None:
+        return build_cached_dataset(
+            data_file=data_file,
+            image_folder=image_folder,
+            system_prompt=system_prompt,
+            processor=processor,
+            cache_dir=cache_dir,
+            num_proc=num_proc,
+            image_store=image_store
+        )
+    
     from datasets import load_dataset
     
     # Load dataset
@@ -172,10 +509,12 @@ def load_and_process_dataset(
             format_and_transform,
             image_folder=image_folder,
             system_prompt=system_prompt,
-            processor=processor
+            processor=processor,
+            image_store=image_store
         ),
         batched=True,
         batch_size=batch_size,
+        num_proc=num_proc if num_proc > 1 else None,
         remove_columns=dataset.column_names
     )
     
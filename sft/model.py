@@ -1,5 +1,8 @@
 from transformers import Qwen3VLForConditionalGeneration, AutoProcessor
+from transformers.models.qwen3_vl.modeling_qwen3_vl import BaseModelOutputWithDeepstackFeatures
 from peft import LoraConfig, get_peft_model
+from tqdm import tqdm
+import numpy as np
 import torch
 
 def load_model_and_processor(config):
@@ -60,3 +63,85 @@ def print_trainable_parameters(model):
     print(f"Trainable params: {trainable_params:,} || "
           f"All params: {all_param:,} || "
           f"Trainable%: {100 * trainable_params / all_param:.2f}%")
+
+
+@torch.no_grad()
+def precompute_vision_features(model, dataset, feature_store, batch_size=16):
+    """
+    Run the vision encoder once over the images of every sample of a dataset
+    
+    LoRA only adapts the language model, so the encoder output of an image is
+    fixed for the whole run. Samples are keyed by their preprocessing cache
+    key, so the dataset has to come from the preprocessing cache; samples
+    already in the store are skipped.
+    
+    Args:
+        model: Qwen-VL model with a frozen vision tower
+        dataset: Processed SFT dataset built with a preprocessing cache
+        feature_store: VisionFeatureStore to fill
+        batch_size: Number of samples encoded per forward pass
+        
+    Returns:
+        Number of samples encoded
+    """
+    trainable = [name for name, param in model.named_parameters() if param.requires_grad and "visual." in name]
+    if trainable:
+        raise ValueError(f"Vision features cannot be cached while the vision tower is trained: {trainable[0]}")
+    
+    was_training = model.training
+    model.eval()
+    
+    pending, seen = [], set()
+    
+    def encode():
+        pixel_values = torch.cat([pixels for _, pixels, _ in pending]).to(model.device)
+        image_grid_thw = torch.cat([grid for _, _, grid in pending]).to(model.device)
+        outputs = model.get_image_features(pixel_values, image_grid_thw, return_dict=True)
+        start = 0
+        for key, _, grid in pending:
+            # Outputs are per image; a sample's entry holds its images in order
+            images = slice(start, start + grid.size(0))
+            start = images.stop
+            features = torch.stack(
+                [torch.cat(outputs.pooler_output[images])]
+                + [torch.cat(layer[images]) for layer in outputs.deepstack_features]
+            )
+            if features.dtype != torch.float16:
+                features = features.float()
+            feature_store.save(key, features.cpu().numpy())
+        pending.clear()
+    
+    for sample in tqdm(dataset, desc="Encoding images"):
+        if "cache_key" not in sample:
+            raise ValueError("Vision features are keyed by the preprocessing cache; set cache_dir to cache them")
+        key = feature_store.feature_key(sample["cache_key"])
+        if key in seen or feature_store.contains(key):
+            continue
+        seen.add(key)
+        pending.append((key, torch.as_tensor(sample["pixel_values"]), torch.as_tensor(sample["image_grid_thw"])))
+        if len(pending) == batch_size:
+            encode()
+    if pending:
+        encode()
+    
+    model.train(was_training)
+    print(f"🖼️  Vision features: {len(seen)} samples encoded ({feature_store.directory})")
+    return len(seen)
+
+def cached_encoder_outputs(image_embeds, deepstack_embeds):
+    """
+    Wrap cached vision features as the ``mm_encoder_outputs`` Qwen3-VL accepts in place of pixels
+    
+    Args:
+        image_embeds: Merged image embeddings of the batch, shape (num_tokens, hidden_size)
+        deepstack_embeds: Deepstack features, shape (num_layers, num_tokens, hidden_size)
+        
+    Returns:
+        Value of the ``mm_encoder_outputs`` forward argument
+    """
+    return {
+        "image": BaseModelOutputWithDeepstackFeatures(
+            pooler_output=(image_embeds,),
+            deepstack_features=[(layer,) for layer in deepstack_embeds]
+        )
+    }
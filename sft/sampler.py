@@ -0,0 +1,148 @@
+import random
+from typing import Iterator, List, Optional, Tuple
+
+import torch
+
+
+def _size_value(size, key: str) -> Optional[int]:
+    if size is None:
+        return None
+    if isinstance(size, dict):
+        return size.get(key)
+    return getattr(size, key, None)
+
+
+def estimate_num_patches(width: int, height: int, image_processor) -> int:
+    """
+    Number of vision patches the Qwen-VL image processor produces for an image
+
+    Mirrors the processor's ``smart_resize``: both sides are rounded to a
+    multiple of ``patch_size * merge_size`` and the area is clamped to the
+    processor's pixel budget.
+
+    Args:
+        width: Image width in pixels
+        height: Image height in pixels
+        image_processor: Qwen-VL image processor
+
+    Returns:
+        Number of patches (``t * h * w`` of ``image_grid_thw``)
+    """
+    from transformers.models.qwen2_vl.image_processing_qwen2_vl import smart_resize
+
+    patch_size = image_processor.patch_size
+    factor = patch_size * image_processor.merge_size
+    size = getattr(image_processor, "size", None)
+    min_pixels = getattr(image_processor, "min_pixels", None) or _size_value(size, "shortest_edge")
+    max_pixels = getattr(image_processor, "max_pixels", None) or _size_value(size, "longest_edge")
+
+    resized_height, resized_width = smart_resize(
+        height, width, factor=factor, min_pixels=min_pixels, max_pixels=max_pixels
+    )
+    return (resized_height // patch_size) * (resized_width // patch_size)
+
+
+def get_sample_lengths(dataset) -> List[Tuple[int, int]]:
+    """
+    Get the (text tokens, vision patches) size of every sample
+
+    Datasets that know their sizes without processing expose ``get_lengths``;
+    processed ``datasets.Dataset`` objects are measured from their columns.
+
+    Args:
+        dataset: SFT dataset
+
+    Returns:
+        List of (num_tokens, num_patches) per sample
+    """
+    if hasattr(dataset, "get_lengths"):
+        return dataset.get_lengths()
+
+    lengths = []
+    for input_ids, image_grid_thw in zip(dataset["input_ids"], dataset["image_grid_thw"]):
+        num_patches = int(torch.as_tensor(image_grid_thw).prod(dim=-1).sum())
+        lengths.append((len(input_ids), num_patches))
+    return lengths
+
+
+def batch_cost(lengths: List[Tuple[int, int]]) -> int:
+    """Tokens processed by a batch: padded text tokens plus vision patches"""
+    if not lengths:
+        return 0
+    return len(lengths) * max(num_tokens for num_tokens, _ in lengths) + sum(num_patches for _, num_patches in lengths)
+
+
+class TokenBudgetBatchSampler(torch.utils.data.Sampler):
+    """
+    Batch sampler that groups samples of similar size under a token budget
+
+    Indices are shuffled, split into buckets of ``bucket_size`` samples and
+    sorted by size inside each bucket, then batches are filled greedily while
+    ``batch_cost`` stays within ``max_tokens``. A sample that exceeds the
+    budget on its own forms a single-sample batch. Batches are built once so
+    the number of steps is fixed; only their order changes between epochs.
+    """
+
+    def __init__(
+        self,
+        lengths: List[Tuple[int, int]],
+        max_tokens: int,
+        max_batch_size: Optional[int] = None,
+        bucket_size: int = 256,
+        shuffle: bool = True,
+        seed: int = 0
+    ):
+        self.lengths = lengths
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.batches = self._build_batches()
+
+    def _build_batches(self) -> List[List[int]]:
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            random.Random(self.seed).shuffle(indices)
+
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = sorted(indices[start:start + self.bucket_size], key=lambda idx: self.lengths[idx])
+
+            # Running maximum and patch sum, so each candidate is priced in O(1)
+            batch, batch_max_tokens, batch_patches = [], 0, 0
+            for idx in bucket:
+                num_tokens, num_patches = self.lengths[idx]
+                full = self.max_batch_size is not None and len(batch) >= self.max_batch_size
+                # batch_cost of the batch with this sample added
+                cost = (len(batch) + 1) * max(batch_max_tokens, num_tokens) + batch_patches + num_patches
+                if batch and (full or cost > self.max_tokens):
+                    batches.append(batch)
+                    batch, batch_max_tokens, batch_patches = [], 0, 0
+                batch.append(idx)
+                batch_max_tokens = max(batch_max_tokens, num_tokens)
+                batch_patches += num_patches
+            if batch:
+                batches.append(batch)
+
+        return batches
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def padding_efficiency(self) -> float:
+        """Fraction of the budgeted positions (text tokens plus vision patches) that are not padding"""
+        real = sum(sum(self.lengths[idx]) for batch in self.batches for idx in batch)
+        padded = sum(batch_cost([self.lengths[idx] for idx in batch]) for batch in self.batches)
+        return real / padded if padded else 1.0
+
+    def __iter__(self) -> Iterator[List[int]]:
+        order = list(range(len(self.batches)))
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(order)
+        for batch_idx in order:
+            yield self.batches[batch_idx]
+
+    def __len__(self) -> int:
+        return len(self.batches)
@@ -1,11 +1,18 @@
 import os
 
+from accelerate import PartialState
+
+from common import open_image_store
 from sft import (
     get_config,
     load_model_and_processor,
     print_trainable_parameters,
     load_and_process_dataset,
+    VisionFeatureStore,
+    vision_fingerprint,
+    precompute_vision_features,
     QwenCompletionCollator,
+    QwenPackingCollator,
     create_trainer,
     TrainingMonitorCallback
 )
@@ -25,32 +32,67 @@ def main():
     print()
     
 
-    print("=" * 80)
-    print("Loading Training Data")
-    print("=" * 80)
-    train_dataset = load_and_process_dataset(
-        data_file=config.data.train_file,
-        image_folder=config.data.train_images,
-        system_prompt=config.system_prompt.prompt,
-        processor=processor,
-        batch_size=config.data.batch_size
-    )
-    print(f"✅ Train dataset: {len(train_dataset)} samples\n")
-    
-    print("=" * 80)
-    print("Loading Validation Data")
-    print("=" * 80)
-    eval_dataset = load_and_process_dataset(
-        data_file=config.data.val_file,
-        image_folder=config.data.val_images,
-        system_prompt=config.system_prompt.prompt,
-        processor=processor,
-        batch_size=config.data.batch_size
-    )
-    print(f"✅ Eval dataset: {len(eval_dataset)} samples\n")
+    # Rank 0 fills the image store and the preprocessing cache; the other
+    # ranks wait at the barrier and then read what it wrote
+    with PartialState().main_process_first():
+        image_store = open_image_store(
+            config.data.image_store_dir,
+            min_pixels=config.data.min_pixels,
+            max_pixels=config.data.max_pixels
+        )
+        
+        print("=" * 80)
+        print("Loading Training Data")
+        print("=" * 80)
+        train_dataset = load_and_process_dataset(
+            data_file=config.data.train_file,
+            image_folder=config.data.train_images,
+            system_prompt=config.system_prompt.prompt,
+            processor=processor,
+            batch_size=config.data.batch_size,
+            cache_dir=config.data.cache_dir,
+            lazy=config.data.lazy,
+            num_proc=config.data.num_proc,
+            image_store=image_store
+        )
+        print(f"✅ Train dataset: {len(train_dataset)} samples\n")
+        
+        print("=" * 80)
+        print("Loading Validation Data")
+        print("=" * 80)
+        eval_dataset = load_and_process_dataset(
+            data_file=config.data.val_file,
+            image_folder=config.data.val_images,
+            system_prompt=config.system_prompt.prompt,
+            processor=processor,
+            batch_size=config.data.batch_size,
+            cache_dir=config.data.cache_dir,
+            lazy=config.data.lazy,
+            num_proc=config.data.num_proc,
+            image_store=image_store
+        )
+        print(f"✅ Eval dataset: {len(eval_dataset)} samples\n")
     
 
-    data_collator = QwenCompletionCollator(processor=processor)
+    feature_store = None
+    if config.data.vision_feature_dir is not None:
+        print("=" * 80)
+        print("Caching Vision Features")
+        print("=" * 80)
+        feature_store = VisionFeatureStore(config.data.vision_feature_dir, vision_fingerprint(model))
+        precompute_vision_features(model, train_dataset, feature_store)
+        precompute_vision_features(model, eval_dataset, feature_store)
+        print()
+    
+    if config.training.packing:
+        data_collator = QwenPackingCollator(
+            processor=processor,
+            feature_store=feature_store,
+            max_seq_length=config.model.max_seq_length
+        )
+        model.config.use_cache = False
+    else:
+        data_collator = QwenCompletionCollator(processor=processor, feature_store=feature_store)
     print()
     
 
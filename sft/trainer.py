@@ -1,5 +1,81 @@
+import torch
+from torch.utils.data import DataLoader
 from transformers import TrainingArguments, EarlyStoppingCallback, Trainer
 
+from .model import cached_encoder_outputs
+from .sampler import TokenBudgetBatchSampler, get_sample_lengths
+
+class TokenBudgetTrainer(Trainer):
+    """
+    Trainer that batches training samples by a token budget
+    
+    With ``max_tokens_per_batch`` set, the training dataloader uses a
+    ``TokenBudgetBatchSampler`` instead of a fixed batch size. Padding
+    efficiency of the batches seen since the last log, over text tokens plus
+    vision patches like the sampler's budget, is added to the logs either way.
+    
+    Batches carrying cached vision features (``image_embeds`` and
+    ``deepstack_embeds``) are fed to the model as encoder outputs, so the
+    vision tower does not run.
+    """
+    
+    def __init__(self, *args, max_tokens_per_batch=None, length_bucket_size=256, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.length_bucket_size = length_bucket_size
+        self._real_tokens = 0
+        self._padded_tokens = 0
+        self._num_batches = 0
+    
+    def get_train_dataloader(self) -> DataLoader:
+        if self.max_tokens_per_batch is None:
+            return super().get_train_dataloader()
+        
+        batch_sampler = TokenBudgetBatchSampler(
+            get_sample_lengths(self.train_dataset),
+            max_tokens=self.max_tokens_per_batch,
+            bucket_size=self.length_bucket_size,
+            seed=self.args.seed
+        )
+        print(f"📦 Token budget batching: {len(batch_sampler)} batches, "
+              f"expected padding efficiency {batch_sampler.padding_efficiency():.1%}")
+        
+        num_workers = self.args.dataloader_num_workers
+        dataloader = DataLoader(
+            self.train_dataset,
+            batch_sampler=batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+            prefetch_factor=self.args.dataloader_prefetch_factor if num_workers > 0 else None,
+            persistent_workers=self.args.dataloader_persistent_workers and num_workers > 0,
+        )
+        return self.accelerator.prepare(dataloader)
+    
+    def compute_loss(self, model, inputs, *args, **kwargs):
+        if model.training and "attention_mask" in inputs:
+            # Count vision patches too, so the metric matches the sampler's token budget
+            attention_mask = inputs["attention_mask"]
+            num_patches = int(inputs["image_grid_thw"].prod(dim=-1).sum()) if "image_grid_thw" in inputs else 0
+            self._real_tokens += int(attention_mask.sum()) + num_patches
+            self._padded_tokens += attention_mask.numel() + num_patches
+            self._num_batches += 1
+        if "image_embeds" in inputs:
+            inputs = dict(inputs)
+            inputs["mm_encoder_outputs"] = cached_encoder_outputs(
+                inputs.pop("image_embeds"), inputs.pop("deepstack_embeds")
+            )
+        return super().compute_loss(model, inputs, *args, **kwargs)
+    
+    def log(self, logs, *args, **kwargs):
+        if self._num_batches > 0 and "loss" in logs:
+            logs["padding_efficiency"] = self._real_tokens / self._padded_tokens
+            logs["tokens_per_batch"] = self._padded_tokens / self._num_batches
+            self._real_tokens = 0
+            self._padded_tokens = 0
+            self._num_batches = 0
+        super().log(logs, *args, **kwargs)
+
 def create_trainer(
     model,
     processor,
@@ -13,9 +89,9 @@ def create_trainer(
     training_args = TrainingArguments(
         output_dir=config.training.output_dir,
         num_train_epochs=config.training.num_train_epochs,
-        per_device_train_batch_size=1,
-        per_device_eval_batch_size=1,
-        gradient_accumulation_steps=8,
+        per_device_train_batch_size=config.training.per_device_train_batch_size,
+        per_device_eval_batch_size=config.training.per_device_train_batch_size,
+        gradient_accumulation_steps=config.training.gradient_accumulation_steps,
         learning_rate=config.training.learning_rate,
         weight_decay=config.training.weight_decay,
         lr_scheduler_type=config.training.lr_scheduler_type,
@@ -35,7 +111,12 @@ def create_trainer(
         greater_is_better=config.training.greater_is_better,
         report_to=config.training.report_to,
         remove_unused_columns=config.training.remove_unused_columns,
-        dataloader_num_workers=0,
+        dataloader_num_workers=config.training.dataloader_num_workers,
+        dataloader_prefetch_factor=(
+            config.training.dataloader_prefetch_factor
+            if config.training.dataloader_num_workers > 0 else None
+        ),
+        dataloader_pin_memory=config.training.dataloader_pin_memory,
         ddp_find_unused_parameters=False,
     )
     
@@ -50,7 +131,7 @@ def create_trainer(
     )
     
 
-    trainer = Trainer(
+    trainer = TokenBudgetTrainer(
         model=model,
         args=training_args,
         train_dataset=train_dataset,
@@ -58,6 +139,8 @@ def create_trainer(
         data_collator=data_collator,
         tokenizer=processor.tokenizer,
         callbacks=callbacks,
+        max_tokens_per_batch=config.training.max_tokens_per_batch,
+        length_bucket_size=config.training.length_bucket_size,
     )
     
     return trainer
@@ -1,141 +1,341 @@
 import os
 import json
+import argparse
 import torch
-from PIL import Image
 from tqdm import tqdm
+from PIL import Image
 from transformers import Qwen3VLForConditionalGeneration, AutoProcessor
 
-def normalize_text(text):
-    import re
-    text = text.lower().strip()
-    text = re.sub(r'[^a-z0-9\s]', '', text)
-    text = re.sub(r'\s+', ' ', text)
-    return text
+from common import (
+    RESIZE_FACTOR,
+    MIN_PIXELS,
+    MAX_PIXELS,
+    fit_to_budget,
+    load_resized_image,
+    open_image_store,
+    length_sorted_batches,
+    generate_batch,
+    StopAfterAnswer,
+    ConstrainedAnswer,
+    extract_answer,
+    has_answer_format,
+    relaxed_match,
+    GroundTruthIndex,
+)
+
+def estimate_prompt_length(item, image_path, processor, image_store=None, min_pixels=MIN_PIXELS, max_pixels=MAX_PIXELS):
+    if image_store is not None and image_store.contains(image_path):
+        width, height = image_store.size(image_path)
+    else:
+        with Image.open(image_path) as image:
+            height, width = fit_to_budget(image.height, image.width, min_pixels, max_pixels)
+    num_image_tokens = (height // RESIZE_FACTOR) * (width // RESIZE_FACTOR)
+    return len(processor.tokenizer.encode(item['question'], add_special_tokens=False)) + num_image_tokens
+
+def shard_results_file(output_file, shard_index=0, num_shards=1):
+    base, _ = os.path.splitext(output_file)
+    return f"{base}.shard{shard_index}-of-{num_shards}.jsonl"
+
+def settings_file(results_file):
+    base, _ = os.path.splitext(results_file)
+    return f"{base}.settings.json"
+
+def read_settings_file(results_file):
+    path = settings_file(results_file)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def check_run_settings(results_file, settings):
+    """
+    Record the settings of a run next to its results file, refusing to resume another run
+    
+    Records are only reused when the results file was written with the same
+    model, test file and generation settings.
+    
+    Args:
+        results_file: Shard results file of the run
+        settings: Settings that determine the predictions
+    
+    Raises:
+        ValueError: If the results file holds records of a run with other or unknown settings
+    """
+    previous = read_settings_file(results_file)
+    if read_results_file(results_file) and previous != settings:
+        if previous is None:
+            reason = "has no settings file"
+        else:
+            changed = sorted(key for key in settings.keys() | previous.keys() if settings.get(key) != previous.get(key))
+            reason = f"was produced with a different {', '.join(changed)}"
+        raise ValueError(
+            f"{results_file} {reason}; pass another --output-file or delete it to start over"
+        )
+    
+    with open(settings_file(results_file), 'w', encoding='utf-8') as f:
+        json.dump(settings, f, indent=2)
+
+def read_results_file(results_file):
+    records = []
+    if not os.path.exists(results_file):
+        return records
+    with open(results_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Last line of a run that was killed mid-write
+                continue
+    return records
+
+def truncate_partial_line(results_file):
+    # Drop an incomplete last line so appended records start on a fresh line
+    if not os.path.exists(results_file):
+        return
+    with open(results_file, 'rb+') as f:
+        content = f.read()
+        if content and not content.endswith(b"\n"):
+            f.truncate(content.rfind(b"\n") + 1)
+
+def summarize_results(records, model_name):
+    records = sorted(records, key=lambda record: record["sample_id"])
+    total = len(records)
+    correct = sum(int(record["correct"]) for record in records)
+    format_correct = sum(int(record["has_format"]) for record in records)
+    total_tokens = [record["response_length"] for record in records]
+    
+    return {
+        "model": model_name,
+        "total": total,
+        "correct": correct,
+        "format_correct": format_correct,
+        "accuracy": correct / total if total > 0 else 0,
+        "format_compliance": format_correct / total if total > 0 else 0,
+        "avg_response_length": sum(total_tokens) / len(total_tokens) if total_tokens else 0,
+        "responses": records
+    }
 
-def extract_answer(text):
-    import re
-    try:
-        if '{answer:' in text or '{"answer":' in text:
-            start = text.rfind('{')
-            end = text.rfind('}') + 1
-            if start != -1 and end > start:
-                answer_json = text[start:end].replace('answer:', '"answer":').replace("'", '"')
-                parsed = json.loads(answer_json)
-                return parsed.get("answer", "").strip()
-    except:
-        pass
-    return ""
+def print_results(results):
+    print(f"\n{'='*80}")
+    print("Test Results")
+    print(f"{'='*80}")
+    print(f"Accuracy: {results['correct']}/{results['total']} = {results['accuracy']*100:.2f}%")
+    print(f"Format Compliance: {results['format_correct']}/{results['total']} = {results['format_compliance']*100:.2f}%")
+    print(f"Avg Response Length: {results['avg_response_length']:.1f} tokens")
+    print(f"{'='*80}")
+
+def merge_results(output_file="test_results.json", num_shards=1, model_name="Nhaass/Qwen3-VL-2B-ChartQA-GRPO"):
+    """
+    Aggregate the per-shard JSONL files of a sharded run into one result file
+    
+    Args:
+        output_file: Final result file, also the base name of the shard files
+        num_shards: Number of shards of the run
+        model_name: Model name recorded in the results
+    
+    Returns:
+        Aggregated results
+    """
+    records = {}
+    shard_settings = None
+    for shard_index in range(num_shards):
+        results_file = shard_results_file(output_file, shard_index, num_shards)
+        if not os.path.exists(results_file):
+            print(f"Missing shard: {results_file}")
+            continue
+        settings = read_settings_file(results_file)
+        if shard_settings is None:
+            shard_settings = settings
+        elif settings != shard_settings:
+            raise ValueError(f"{results_file} was produced with other settings than the previous shards")
+        for record in read_results_file(results_file):
+            records[record["sample_id"]] = record
+    
+    results = summarize_results(list(records.values()), model_name)
+    print_results(results)
+    
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    
+    print(f"\nResults saved to: {output_file}")
+    
+    return results
 
 def test_model(
     model_name="Nhaass/Qwen3-VL-2B-ChartQA-GRPO",
     test_file="ChartQADataset/test/test_augmented.json",
     test_images="ChartQADataset/test/png",
     num_samples=100,
-    output_file="test_results.json"
+    output_file="test_results.json",
+    image_store_dir="cache/images",
+    min_pixels=MIN_PIXELS,
+    max_pixels=MAX_PIXELS,
+    batch_size=8,
+    max_new_tokens=256,
+    model=None,
+    processor=None,
+    shard_index=0,
+    num_shards=1,
+    stop_at_answer=False,
+    constrain_answer=False
 ):
-    print(f"Loading model: {model_name}")
-    model = Qwen3VLForConditionalGeneration.from_pretrained(
-        model_name,
-        torch_dtype=torch.float16,
-        device_map="auto",
-        trust_remote_code=True
-    )
-    processor = AutoProcessor.from_pretrained(model_name, trust_remote_code=True)
+    if model is None:
+        print(f"Loading model: {model_name}")
+        model = Qwen3VLForConditionalGeneration.from_pretrained(
+            model_name,
+            torch_dtype=torch.float16,
+            device_map="auto",
+            trust_remote_code=True
+        )
+    if processor is None:
+        processor = AutoProcessor.from_pretrained(model_name, trust_remote_code=True)
+    model.eval()
     
     print(f"Loading test data: {test_file}")
     with open(test_file, 'r', encoding='utf-8') as f:
         test_data = json.load(f)
+    ground_truth_index = GroundTruthIndex(item['label'] for item in test_data[:num_samples])
+    
+    # Sample ids are positions in the test file, so they are stable across runs and shards
+    results_file = shard_results_file(output_file, shard_index, num_shards)
+    check_run_settings(results_file, {
+        "model_name": model_name,
+        "test_file": os.path.abspath(test_file),
+        "num_samples": num_samples,
+        "max_new_tokens": max_new_tokens,
+        "stop_at_answer": stop_at_answer,
+        "constrain_answer": constrain_answer,
+        "min_pixels": min_pixels,
+        "max_pixels": max_pixels
+    })
+    truncate_partial_line(results_file)
+    done_ids = {record["sample_id"] for record in read_results_file(results_file)}
+    
+    samples = [
+        (sample_id, item) for sample_id, item in enumerate(test_data[:num_samples])
+        if sample_id % num_shards == shard_index
+        and sample_id not in done_ids
+        and os.path.exists(os.path.join(test_images, item['image']))
+    ]
+    if done_ids:
+        print(f"Resuming: {len(done_ids)} samples already in {results_file}")
+    
+    image_store = open_image_store(
+        image_store_dir,
+        image_paths=[os.path.join(test_images, item['image']) for _, item in samples],
+        min_pixels=min_pixels,
+        max_pixels=max_pixels
+    )
     
     system_prompt = """You are a helpful assistant capable of visual reasoning.
 Provide step-by-step reasoning about the chart, then output your final answer
 in JSON format: {answer: 'your_answer'}"""
     
-    results = {
-        "model": model_name,
-        "total": 0,
-        "correct": 0,
-        "format_correct": 0,
-        "responses": []
-    }
+    lengths = [
+        estimate_prompt_length(
+            item, os.path.join(test_images, item['image']), processor, image_store, min_pixels, max_pixels
+        )
+        for _, item in samples
+    ]
+    batches = length_sorted_batches(lengths, batch_size)
+    answer_stop = None
+    if constrain_answer:
+        answer_stop = ConstrainedAnswer.for_model(model, processor.tokenizer)
+    elif stop_at_answer:
+        answer_stop = StopAfterAnswer.for_model(model, processor.tokenizer)
     
-    total_tokens = []
+    print(f"\nEvaluating shard {shard_index + 1}/{num_shards}: {len(samples)} samples in {len(batches)} batches...")
     
-    print(f"\nEvaluating on {min(num_samples, len(test_data))} samples...")
-    
-    for item in tqdm(test_data[:num_samples]):
+    for batch in tqdm(batches):
         try:
-            image_path = os.path.join(test_images, item['image'])
-            image = Image.open(image_path).convert("RGB")
-            
-            if max(image.size) > 800:
-                image.thumbnail((800, 800), Image.Resampling.LANCZOS)
-            
-            conversation = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": [
-                    {"type": "image"},
-                    {"type": "text", "text": item['question']}
-                ]}
-            ]
-            
-            text = processor.apply_chat_template(conversation, tokenize=False, add_generation_prompt=True)
-            inputs = processor(text=[text], images=[image], padding=True, return_tensors="pt").to(model.device)
-            
-            with torch.no_grad():
-                outputs = model.generate(**inputs, max_new_tokens=256, temperature=0.1, do_sample=False)
-            
-            response = processor.decode(outputs[0], skip_special_tokens=True)
-            if "<|im_start|>assistant" in response:
-                response = response.split("<|im_start|>assistant")[-1].strip()
-            
-            response_tokens = processor.tokenizer.encode(response, add_special_tokens=False)
-            total_tokens.append(len(response_tokens))
-            
-            has_format = '{answer:' in response or '{"answer":' in response
-            if has_format:
-                results["format_correct"] += 1
+            texts, images = [], []
+            for idx in batch:
+                _, item = samples[idx]
+                image_path = os.path.join(test_images, item['image'])
+                if image_store is not None:
+                    images.append(image_store.load(image_path))
+                else:
+                    images.append(load_resized_image(image_path, min_pixels, max_pixels))
+                
+                conversation = [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": [
+                        {"type": "image"},
+                        {"type": "text", "text": item['question']}
+                    ]}
+                ]
+                texts.append(processor.apply_chat_template(conversation, tokenize=False, add_generation_prompt=True))
             
-            pred = extract_answer(response)
-            is_correct = normalize_text(pred) == normalize_text(item['label'])
-            if is_correct:
-                results["correct"] += 1
+            responses, num_tokens = generate_batch(
+                model, processor, texts, images, max_new_tokens=max_new_tokens, answer_stop=answer_stop
+            )
             
-            results["responses"].append({
-                "question": item['question'],
-                "ground_truth": item['label'],
-                "prediction": pred,
-                "correct": is_correct,
-                "has_format": has_format,
-                "response_length": len(response_tokens)
-            })
+            records = []
+            for idx, response, response_length in zip(batch, responses, num_tokens):
+                sample_id, item = samples[idx]
+                has_format = has_answer_format(response)
+                pred = extract_answer(response)
+                is_correct = relaxed_match(pred, ground_truth_index[item['label']])
+                
+                records.append({
+                    "sample_id": sample_id,
+                    "question": item['question'],
+                    "ground_truth": item['label'],
+                    "prediction": pred,
+                    "correct": is_correct,
+                    "has_format": has_format,
+                    "response_length": response_length
+                })
             
-            results["total"] += 1
-            
-            del image, inputs, outputs
-            torch.cuda.empty_cache()
+            # Append as we go, so a crash loses at most the batch in flight
+            with open(results_file, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
             
         except Exception as e:
             print(f"Error: {e}")
             continue
     
-    results["accuracy"] = results["correct"] / results["total"] if results["total"] > 0 else 0
-    results["format_compliance"] = results["format_correct"] / results["total"] if results["total"] > 0 else 0
-    results["avg_response_length"] = sum(total_tokens) / len(total_tokens) if total_tokens else 0
-    
-    print(f"\n{'='*80}")
-    print("Test Results")
-    print(f"{'='*80}")
-    print(f"Accuracy: {results['correct']}/{results['total']} = {results['accuracy']*100:.2f}%")
-    print(f"Format Compliance: {results['format_correct']}/{results['total']} = {results['format_compliance']*100:.2f}%")
-    print(f"Avg Response Length: {results['avg_response_length']:.1f} tokens")
-    print(f"{'='*80}")
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
-    
-    print(f"\nResults saved to: {output_file}")
+    if num_shards > 1:
+        results = summarize_results(read_results_file(results_file), model_name)
+        print_results(results)
+        print(f"\nShard results saved to: {results_file}")
+        print("Run with --merge once every shard has finished")
+        return results
     
-    return results
+    return merge_results(output_file, num_shards, model_name)
 
 if __name__ == "__main__":
-    test_model()
+    parser = argparse.ArgumentParser(description="Evaluate a ChartQA model")
+    parser.add_argument("--model-name", default="Nhaass/Qwen3-VL-2B-ChartQA-GRPO")
+    parser.add_argument("--test-file", default="ChartQADataset/test/test_augmented.json")
+    parser.add_argument("--test-images", default="ChartQADataset/test/png")
+    parser.add_argument("--num-samples", type=int, default=100)
+    parser.add_argument("--output-file", default="test_results.json")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--shard-index", type=int, default=0)
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument("--stop-at-answer", action="store_true", help="End each response once its answer object is closed")
+    parser.add_argument("--constrain-answer", action="store_true", help="Keep the answer object well-formed once it is opened")
+    parser.add_argument("--merge", action="store_true", help="Merge the shard files of a finished run")
+    args = parser.parse_args()
+    
+    if args.merge:
+        merge_results(args.output_file, args.num_shards, args.model_name)
+    else:
+        test_model(
+            model_name=args.model_name,
+            test_file=args.test_file,
+            test_images=args.test_images,
+            num_samples=args.num_samples,
+            output_file=args.output_file,
+            batch_size=args.batch_size,
+            max_new_tokens=args.max_new_tokens,
+            shard_index=args.shard_index,
+            num_shards=args.num_shards,
+            stop_at_answer=args.stop_at_answer,
+            constrain_answer=args.constrain_answer
+        )
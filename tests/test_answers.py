@@ -0,0 +1,120 @@
+"""
+Properties of the shared answer extractor used by GRPO rewards and evaluation
+"""
+import random
+import string
+
+import pytest
+
+from common import extract_answer, ends_with_answer, has_answer_format
+
+QUOTE_STYLES = ["", "'", '"']
+KEY_STYLES = ["answer", "'answer'", '"answer"']
+SPACINGS = ["", " ", "  ", "\n"]
+
+
+def answer_object(value, key="answer", quote="'", space=" "):
+    return "{" + space + key + space + ":" + space + quote + value + quote + space + "}"
+
+
+def random_values(count=200, seed=0):
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + " .,%$-'"
+    values = []
+    for _ in range(count):
+        value = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 20))).strip()
+        if value:
+            values.append(value)
+    return values
+
+
+@pytest.mark.parametrize("key", KEY_STYLES)
+@pytest.mark.parametrize("quote", QUOTE_STYLES)
+@pytest.mark.parametrize("space", SPACINGS)
+def test_quote_and_spacing_styles_round_trip(key, quote, space):
+    for value in ["12", "3.5", "Yes", "United States", "42%"]:
+        text = f"The chart shows it. {answer_object(value, key, quote, space)}"
+        assert extract_answer(text) == value
+        assert ends_with_answer(text)
+
+
+@pytest.mark.parametrize("quote", ['"', "'"])
+def test_random_values_round_trip(quote):
+    for value in random_values():
+        if quote in value:
+            continue
+        assert extract_answer("reasoning " + answer_object(value, quote=quote)) == value
+
+
+def test_apostrophe_inside_double_quotes():
+    assert extract_answer('so {answer: "Men\'s"}') == "Men's"
+
+
+def test_numeric_and_unquoted_values():
+    assert extract_answer("{answer: 12}") == "12"
+    assert extract_answer("{answer: -0.75}") == "-0.75"
+    assert extract_answer("{answer: Yes}") == "Yes"
+
+
+def test_last_answer_object_wins():
+    text = "First guess {answer: '10'} but rechecking {answer: '12'}"
+    assert extract_answer(text) == "12"
+
+
+def test_answer_word_after_the_object_is_skipped():
+    text = "{answer: '12'} is the answer"
+    assert extract_answer(text) == "12"
+    assert not ends_with_answer(text)
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "no answer here",
+    "the answer is 12",
+    "{answer: '12'",
+    "answer: '12'}",
+    "{question: '12'}",
+])
+def test_missing_or_unclosed_object(text):
+    assert extract_answer(text) == ""
+    assert not ends_with_answer(text)
+
+
+def test_nested_braces_are_not_an_answer():
+    assert extract_answer("{answer: {value: 12}}") == ""
+
+
+def test_ends_with_answer_ignores_trailing_whitespace():
+    assert ends_with_answer("reasoning {answer: '12'}  \n")
+    assert not ends_with_answer("reasoning {answer: '12'} done")
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("{answer: '12'}", True),
+    ('{"answer": "12"}', True),
+    ("{ answer: '12'}", False),
+    ("{'answer': '12'}", False),
+    ("no object", False),
+])
+def test_has_answer_format_markers(text, expected):
+    assert has_answer_format(text) == expected
+
+
+def test_format_marker_implies_extractable_answer():
+    for value in random_values(seed=1):
+        for text in (f"{{answer: \"{value}\"}}", f'{{"answer": "{value}"}}'):
+            if '"' in value:
+                continue
+            assert has_answer_format(text)
+            assert extract_answer(text) == value
+
+
+def test_grpo_and_evaluation_share_the_extractor():
+    pytest.importorskip("trl")
+    import test_model
+    from grpo import rewards
+
+    assert rewards.extract_answer is extract_answer
+    assert rewards.has_answer_format is has_answer_format
+    assert test_model.extract_answer is extract_answer
+    assert test_model.has_answer_format is has_answer_format
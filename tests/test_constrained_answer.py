@@ -0,0 +1,146 @@
+"""
+Answer-object automaton and the ConstrainedAnswer logits processor
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from common.generation import ConstrainedAnswer, _advance_answer
+
+OPEN = ("open", 0, "", "")
+
+
+class ToyTokenizer:
+    """Word-piece tokenizer over a fixed vocabulary, with the interface the processors use"""
+
+    special_tokens = ["<eos>", "<think>", "</think>"]
+    pieces = [
+        "{", "}", "{answer", "answer", "\"", "'", ":", " ", "\n", "is", "the", "set", "x",
+        "1", "2", "12", ",", "}.", "\"}", "{\"",
+    ]
+    unk_token_id = None
+
+    def __init__(self):
+        self.vocab = self.special_tokens + self.pieces
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def get_vocab(self):
+        return {token: token_id for token_id, token in enumerate(self.vocab)}
+
+    def convert_tokens_to_ids(self, tokens):
+        return [self.vocab.index(token) if token in self.vocab else None for token in tokens]
+
+    def decode(self, ids, skip_special_tokens=False):
+        ids = ids.tolist() if isinstance(ids, torch.Tensor) else ids
+        return "".join(
+            self.vocab[token_id] for token_id in ids
+            if not (skip_special_tokens and self.vocab[token_id] in self.special_tokens)
+        )
+
+    def batch_decode(self, sequences, skip_special_tokens=False):
+        return [self.decode(ids, skip_special_tokens) for ids in sequences]
+
+    def encode(self, pieces):
+        return [self.vocab.index(piece) for piece in pieces]
+
+
+@pytest.fixture
+def tokenizer():
+    return ToyTokenizer()
+
+
+def allowed_after(processor, tokenizer, pieces):
+    """Tokens left with a finite score after ``pieces`` were generated"""
+    input_ids = torch.tensor([tokenizer.encode(pieces)])
+    scores = processor(input_ids, torch.zeros(1, len(tokenizer)))
+    return {tokenizer.vocab[token_id] for token_id in torch.isfinite(scores[0]).nonzero().flatten().tolist()}
+
+
+def feed(state, *pieces):
+    for piece in pieces:
+        state = _advance_answer(state, piece)
+        if state is None:
+            return None
+    return state
+
+
+@pytest.mark.parametrize("text", [
+    "answer: '12'}",
+    "\"answer\": \"Asia Pacific\"}",
+    " 'answer' : 12 }",
+    "answer:12}",
+])
+def test_advance_answer_accepts(text):
+    assert _advance_answer(OPEN, text)[0] == "done"
+    # Split at every position, the automaton reaches the same state
+    for split in range(len(text)):
+        assert feed(OPEN, text[:split], text[split:]) == _advance_answer(OPEN, text)
+
+
+@pytest.mark.parametrize("text", [
+    "1, 2}",
+    "answr: 1}",
+    "answer 12}",
+    "answer: '1{2'}",
+    "answer: '1\n2'}",
+    "answer: '12'} more",
+])
+def test_advance_answer_rejects(text):
+    assert _advance_answer(OPEN, text) is None
+
+
+def test_advance_answer_phases():
+    assert _advance_answer(OPEN, "ans") == ("key", 3, "", "")
+    assert _advance_answer(OPEN, "\"answer\"") == ("colon", 6, "\"", "")
+    assert _advance_answer(OPEN, "answer: \"") == ("value", 6, "", "\"")
+    assert _advance_answer(OPEN, "answer: 'x'") == ("close", 6, "", "'")
+
+
+def test_reasoning_braces_stay_unconstrained(tokenizer):
+    processor = ConstrainedAnswer(tokenizer, eos_token_id=0)
+
+    # Without think tokens a brace is prose until the answer key follows it
+    assert allowed_after(processor, tokenizer, ["the", " ", "set", " ", "{"]) == set(tokenizer.vocab)
+    assert allowed_after(processor, tokenizer, ["{", "1", ","]) == set(tokenizer.vocab)
+    # Inside the think block even the answer key does not arm the constraint
+    assert allowed_after(processor, tokenizer, ["<think>", "{answer", ":"]) == set(tokenizer.vocab)
+    assert processor.constrained == 0
+
+
+def test_answer_key_arms_the_constraint(tokenizer):
+    processor = ConstrainedAnswer(tokenizer, eos_token_id=0)
+
+    allowed = allowed_after(processor, tokenizer, ["is", " ", "{answer"])
+    assert allowed == {":", " ", "\n"}
+    allowed = allowed_after(processor, tokenizer, ["{\"", "answer"])
+    assert allowed == {"\""}
+    allowed = allowed_after(processor, tokenizer, ["{answer", ":", " ", "'", "12"])
+    assert "'" in allowed and "1" in allowed
+    assert not {"{", "}", "\n", "<eos>"} & allowed
+    # Once the object is closed only end-of-sequence is left
+    assert allowed_after(processor, tokenizer, ["{answer", ":", "12", "}"]) == {"<eos>"}
+    assert processor.stopped == 1
+
+
+def test_brace_after_think_arms_immediately(tokenizer):
+    processor = ConstrainedAnswer(tokenizer, eos_token_id=0)
+
+    allowed = allowed_after(processor, tokenizer, ["<think>", "x", "</think>", "{"])
+    assert allowed == {"answer", "\"", "'", " ", "\n"}
+    assert processor.constrained == 1
+
+
+def test_long_answer_is_closed(tokenizer):
+    processor = ConstrainedAnswer(tokenizer, eos_token_id=0, max_answer_tokens=4)
+
+    allowed = allowed_after(processor, tokenizer, ["{answer", ":", " ", "\"", "1", "2", "1"])
+    # Only tokens that end the value are left
+    assert allowed == {"\"", "\"}"}
+
+
+def test_finished_rows_are_left_alone(tokenizer):
+    processor = ConstrainedAnswer(tokenizer, eos_token_id=0)
+
+    assert allowed_after(processor, tokenizer, ["{answer", ":", "1", "}", "<eos>", "<eos>"]) == set(tokenizer.vocab)
@@ -0,0 +1,42 @@
+"""
+Shared-prefix generation on a tiny random Qwen3-VL
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from common import generate_with_shared_prefix
+
+NUM_GENERATIONS = 3
+
+
+def make_group_inputs(processor, images, questions):
+    texts, group_images = [], []
+    for question, image in zip(questions, images):
+        conversation = [{"role": "user", "content": [{"type": "image"}, {"type": "text", "text": question}]}]
+        text = processor.apply_chat_template(conversation, tokenize=False, add_generation_prompt=True)
+        texts.extend([text] * NUM_GENERATIONS)
+        group_images.extend([image] * NUM_GENERATIONS)
+    padding_side = processor.tokenizer.padding_side
+    processor.tokenizer.padding_side = "left"
+    try:
+        return processor(text=texts, images=group_images, padding=True, return_tensors="pt")
+    finally:
+        processor.tokenizer.padding_side = padding_side
+
+
+def test_shared_prefix_matches_generate(tiny_model, tiny_processor, chart_images):
+    # Prompts and images of different sizes, so left padding and per-row RoPE offsets differ across groups
+    inputs = make_group_inputs(
+        tiny_processor,
+        chart_images[:2],
+        ["What is the value of the highest bar?", "Which year?"]
+    )
+    assert inputs["attention_mask"].min() == 0
+
+    generation_kwargs = dict(max_new_tokens=12, do_sample=False)
+    expected = tiny_model.generate(**inputs, **generation_kwargs)
+    shared = generate_with_shared_prefix(tiny_model, NUM_GENERATIONS, **inputs, **generation_kwargs)
+
+    torch.testing.assert_close(shared, expected, rtol=0, atol=0)
+
@@ -0,0 +1,76 @@
+"""
+Zero-std group filtering and oversampling in FilteredGRPOTrainer
+"""
+from collections import defaultdict
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+pytest.importorskip("trl")
+
+from trl import GRPOTrainer
+
+from grpo.trainer import FilteredGRPOTrainer
+
+NUM_GENERATIONS = 4
+
+
+def make_trainer(oversample_factor, filter_zero_std=True):
+    # Only the attributes _generate_and_score_completions reads; no model is loaded
+    trainer = FilteredGRPOTrainer.__new__(FilteredGRPOTrainer)
+    trainer.model = SimpleNamespace(training=True)
+    trainer.beta = 0.0
+    trainer.rollout_store = None
+    trainer.difficulty_tracker = None
+    trainer._rollout_keys = None
+    trainer.filter_zero_std = filter_zero_std
+    trainer.oversample_factor = oversample_factor
+    trainer.num_generations = NUM_GENERATIONS
+    trainer.accelerator = SimpleNamespace(gather=lambda tensor: tensor)
+    trainer._metrics = {"train": defaultdict(list)}
+    return trainer
+
+
+def make_output(advantages, completion_lengths, max_length=8):
+    completion_mask = (torch.arange(max_length) < torch.tensor(completion_lengths).unsqueeze(1)).int()
+    return {
+        "prompt_ids": torch.zeros(len(advantages), 3, dtype=torch.long),
+        "completion_ids": torch.ones(len(advantages), max_length, dtype=torch.long),
+        "completion_mask": completion_mask,
+        "advantages": torch.tensor(advantages),
+        "num_items_in_batch": completion_mask.sum(),
+    }
+
+
+def generate(trainer, output, monkeypatch):
+    monkeypatch.setattr(GRPOTrainer, "_generate_and_score_completions", lambda self, inputs: output)
+    return trainer._generate_and_score_completions([{}] * output["advantages"].size(0))
+
+
+def test_oversampling_normalizer_counts_kept_tokens(monkeypatch):
+    # Four informative groups of which the batch keeps two
+    advantages = [1.0, -1.0, 0.5, -0.5] * 4
+    lengths = [1, 2, 3, 4, 5, 6, 7, 8, 2, 2, 2, 2, 8, 8, 8, 8]
+    output = generate(make_trainer(oversample_factor=2), make_output(advantages, lengths), monkeypatch)
+
+    assert output["completion_mask"].size(0) == 2 * NUM_GENERATIONS
+    assert int(output["num_items_in_batch"]) == int(output["completion_mask"].sum()) == sum(lengths[:8])
+
+
+def test_oversampling_without_filtering_counts_kept_tokens(monkeypatch):
+    advantages = [0.0] * 4 + [1.0, -1.0, 0.5, -0.5] * 3
+    lengths = [8] * 4 + [1, 2, 3, 4] * 3
+    trainer = make_trainer(oversample_factor=2, filter_zero_std=False)
+    output = generate(trainer, make_output(advantages, lengths), monkeypatch)
+
+    assert int(output["num_items_in_batch"]) == int(output["completion_mask"].sum()) == 2 * sum([1, 2, 3, 4])
+
+
+def test_masked_groups_are_left_out_of_the_normalizer(monkeypatch):
+    advantages = [1.0, -1.0, 0.5, -0.5] + [0.0] * 4
+    lengths = [1, 2, 3, 4, 8, 8, 8, 8]
+    output = generate(make_trainer(oversample_factor=1), make_output(advantages, lengths), monkeypatch)
+
+    assert output["completion_mask"][NUM_GENERATIONS:].sum() == 0
+    assert int(output["num_items_in_batch"]) == sum([1, 2, 3, 4])
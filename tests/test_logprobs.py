@@ -0,0 +1,60 @@
+"""
+Chunked log-probs in place of TRL's fused LM-head kernel
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("trl")
+
+import trl.trainer.utils as trl_utils
+from transformers import Qwen3Config, Qwen3ForCausalLM
+from trl.trainer.utils import add_fused_lm_head
+
+from grpo.logprobs import check_trl_kernel_hooks, chunked_logprob_kernel, chunked_selective_log_softmax
+
+
+def test_chunked_matches_full_log_softmax():
+    torch.manual_seed(0)
+    hidden = torch.randn(10, 8, requires_grad=True)
+    weight = torch.randn(50, 8)
+    targets = torch.randint(0, 50, (10,))
+
+    log_probs, entropy, *_ = chunked_selective_log_softmax(
+        hidden, weight, None, targets, temperature=0.7, chunk_size=3, outputs=("log_probs", "entropy")
+    )
+    log_softmax = (hidden @ weight.T / 0.7).log_softmax(dim=-1)
+    torch.testing.assert_close(log_probs, log_softmax.gather(-1, targets.unsqueeze(-1)).squeeze(-1))
+    torch.testing.assert_close(entropy, -(log_softmax.exp() * log_softmax).sum(dim=-1))
+
+    # Checkpointed chunks still backpropagate to the hidden states
+    log_probs.sum().backward()
+    assert hidden.grad is not None and hidden.grad.abs().sum() > 0
+
+
+def test_fused_lm_head_uses_chunked_kernel():
+    config = Qwen3Config(
+        vocab_size=64, hidden_size=32, intermediate_size=64, num_hidden_layers=1,
+        num_attention_heads=2, num_key_value_heads=1, head_dim=16
+    )
+    torch.manual_seed(0)
+    model = Qwen3ForCausalLM(config).eval()
+    add_fused_lm_head(model, outputs=("log_probs", "entropy"))
+    input_ids = torch.randint(0, 64, (2, 7))
+
+    with torch.no_grad():
+        log_softmax = model(input_ids=input_ids).logits[:, :-1].float().log_softmax(dim=-1)
+        with chunked_logprob_kernel(chunk_size=4):
+            fused = model(input_ids=input_ids, labels=input_ids, fused_lm_head=True)
+
+    expected = log_softmax.gather(-1, input_ids[:, 1:].unsqueeze(-1)).squeeze(-1)
+    torch.testing.assert_close(fused.log_probs, expected)
+    torch.testing.assert_close(fused.entropy, -(log_softmax.exp() * log_softmax).sum(dim=-1))
+
+
+def test_missing_trl_globals_fail_early(monkeypatch):
+    monkeypatch.delattr(trl_utils, "_CHUNKED_LOGPROB_CHUNK_SIZE")
+    with pytest.raises(RuntimeError, match="_CHUNKED_LOGPROB_CHUNK_SIZE"):
+        check_trl_kernel_hooks()
+    with pytest.raises(RuntimeError):
+        with chunked_logprob_kernel():
+            pass
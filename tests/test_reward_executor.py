@@ -0,0 +1,60 @@
+"""
+Timeout handling of the RewardExecutor backends
+"""
+import time
+
+import numpy as np
+
+from grpo.reward_executor import RewardExecutor, RewardTask
+
+
+def constant_reward(responses):
+    return np.ones(len(responses), dtype=np.float32)
+
+
+def hanging_reward(responses):
+    time.sleep(30)
+    return np.ones(len(responses), dtype=np.float32)
+
+
+def slow_reward(responses):
+    time.sleep(0.05)
+    return np.ones(len(responses), dtype=np.float32)
+
+
+def test_serial_reports_overrun(capsys):
+    executor = RewardExecutor(backend="serial", timeout=0.01)
+    results = executor.run({"slow": RewardTask(slow_reward, (["a", "b"],))}, 2)
+
+    # The value is kept: the serial backend cannot cut a call short
+    np.testing.assert_array_equal(results["slow"], [1.0, 1.0])
+    assert not executor.last_failed.any()
+    assert "cannot enforce timeouts" in capsys.readouterr().out
+
+
+def test_process_backend_terminates_hung_worker():
+    executor = RewardExecutor(backend="process", max_workers=1, timeout=0.5)
+    try:
+        # Warm up so the worker process exists before the hung call
+        executor.run({"ok": RewardTask(constant_reward, (["a"],))}, 1)
+        processes = list(executor.pool._processes.values())
+        assert processes
+        start = time.perf_counter()
+        results = executor.run(
+            {"hung": RewardTask(hanging_reward, (["a"],)), "ok": RewardTask(constant_reward, (["a"],))}, 1
+        )
+        assert time.perf_counter() - start < 10
+
+        np.testing.assert_array_equal(results["hung"], [0.0])
+        assert executor.last_failed.all()
+        assert executor.stats["hung"].timeouts == 1
+        # The hung worker is killed and the next run gets a fresh pool
+        assert executor._pool is None
+        for process in processes:
+            process.join(timeout=5)
+            assert not process.is_alive()
+
+        results = executor.run({"ok": RewardTask(constant_reward, (["a", "b"],))}, 2)
+        np.testing.assert_array_equal(results["ok"], [1.0, 1.0])
+    finally:
+        executor.shutdown()
@@ -0,0 +1,35 @@
+"""
+ChartQA relaxed accuracy
+"""
+import pytest
+
+from common import relaxed_match
+
+
+@pytest.mark.parametrize("prediction, target", [
+    ("12", "12"),
+    ("12.5", "12"),
+    ("$2,094.6", "2094.6"),
+    ("2094.6 million", "2094.6"),
+    ("2 million", "2000 thousand"),
+    ("1.2bn", "1200 million"),
+    ("20%", "0.2"),
+    ("(15)", "15"),
+    ("United States", "united states"),
+    ("Men's", "mens"),
+])
+def test_matches(prediction, target):
+    assert relaxed_match(prediction, target)
+
+
+@pytest.mark.parametrize("prediction, target", [
+    ("14", "12"),
+    ("1,5", "15"),
+    ("1,50", "150"),
+    ("2 million", "2 billion"),
+    ("3k", "3 million"),
+    ("", ""),
+    ("Canada", "United States"),
+])
+def test_mismatches(prediction, target):
+    assert not relaxed_match(prediction, target)
@@ -0,0 +1,147 @@
+"""
+MicroBatcher and serve_jsonl with a stub generate_batch
+"""
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("torch")
+
+import serve
+
+
+class StubGenerate:
+    """Answers every question with itself and records the size of every batch"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batch_sizes = []
+        self.lock = threading.Lock()
+
+    def __call__(self, model, processor, texts, images, max_new_tokens=256, answer_stop=None):
+        with self.lock:
+            self.batch_sizes.append(len(texts))
+        time.sleep(self.delay)
+        responses = [f"<think>chart</think>{{answer: '{text}'}}" for text in texts]
+        return responses, [len(response) for response in responses]
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = StubGenerate()
+    monkeypatch.setattr(serve, "generate_batch", stub)
+    return stub
+
+
+@pytest.fixture
+def image_dir(tmp_path, chart_images):
+    directory = tmp_path / "png"
+    directory.mkdir()
+    for i, image in enumerate(chart_images):
+        image.save(directory / f"chart_{i}.png")
+    return directory
+
+
+def make_batcher(image_dir, **kwargs):
+    # The chat text is the question itself, so the stub's answer names its request
+    processor = SimpleNamespace(
+        apply_chat_template=lambda conversation, **kwargs: conversation[-1]["content"][-1]["text"]
+    )
+    return serve.MicroBatcher(None, processor, image_dir=str(image_dir), **kwargs)
+
+
+def request(i):
+    return {"id": i, "image": f"chart_{i % 3}.png", "question": f"q{i}"}
+
+
+def test_batches_fill_up_to_max_batch_size(stub, image_dir):
+    batcher = make_batcher(image_dir, max_batch_size=4, max_wait_ms=500)
+    futures = [batcher.submit(request(i)) for i in range(10)]
+    results = [future.result(timeout=10) for future in futures]
+    batcher.close()
+
+    assert [result["answer"] for result in results] == [f"q{i}" for i in range(10)]
+    assert stub.batch_sizes == [4, 4, 2]
+    assert [result["batch_size"] for result in results] == [4] * 8 + [2] * 2
+    assert batcher.stats.summary()["requests"] == 10
+
+
+def test_lone_request_waits_for_the_deadline(stub, image_dir):
+    batcher = make_batcher(image_dir, max_batch_size=8, max_wait_ms=100)
+    start = time.perf_counter()
+    result = batcher.submit(request(0)).result(timeout=10)
+    elapsed = time.perf_counter() - start
+
+    # A later request misses the first batch and gets its own
+    late = batcher.submit(request(1)).result(timeout=10)
+    batcher.close()
+
+    assert result["batch_size"] == 1 and late["batch_size"] == 1
+    assert 0.1 <= elapsed < 5
+    assert result["latency_ms"] >= 100
+    assert stub.batch_sizes == [1, 1]
+
+
+def test_close_drains_queued_requests(stub, image_dir):
+    stub.delay = 0.05
+    batcher = make_batcher(image_dir, max_batch_size=2, max_wait_ms=1000)
+    futures = [batcher.submit(request(i)) for i in range(7)]
+    batcher.close()
+
+    assert all(future.done() for future in futures)
+    assert [future.result()["id"] for future in futures] == list(range(7))
+    assert sum(stub.batch_sizes) == 7 and max(stub.batch_sizes) <= 2
+
+
+def test_images_outside_image_dir_are_rejected(stub, image_dir, tmp_path):
+    (tmp_path / "secret.png").write_bytes(b"")
+    os.symlink(tmp_path / "secret.png", image_dir / "link.png")
+    batcher = make_batcher(image_dir)
+    try:
+        for image in ["../secret.png", str(tmp_path / "secret.png"), "link.png"]:
+            with pytest.raises(ValueError, match="outside the image directory"):
+                batcher.submit({"image": image, "question": "q"})
+        with pytest.raises(ValueError, match="needs an 'image'"):
+            batcher.submit({"question": "q"})
+    finally:
+        batcher.close()
+    assert stub.batch_sizes == []
+
+
+def test_unreadable_image_fails_only_its_request(stub, image_dir):
+    batcher = make_batcher(image_dir, max_batch_size=4, max_wait_ms=200)
+    missing = batcher.submit({"id": "missing", "image": "missing.png", "question": "q"})
+    answered = batcher.submit(request(1))
+    batcher.close()
+
+    with pytest.raises(FileNotFoundError):
+        missing.result()
+    assert answered.result()["answer"] == "q1"
+    assert stub.batch_sizes == [1]
+
+
+def test_serve_jsonl_streams_answers_and_errors(stub, image_dir, tmp_path):
+    input_file = tmp_path / "requests.jsonl"
+    output_file = tmp_path / "answers.jsonl"
+    lines = [
+        json.dumps(request(0)),
+        "not json",
+        "",
+        json.dumps({"image": "../outside.png", "question": "q"}),
+        json.dumps({"image": "chart_1.png", "question": "no id"}),
+    ]
+    input_file.write_text("\n".join(lines) + "\n")
+
+    stats = serve.serve_jsonl(make_batcher(image_dir, max_wait_ms=50), str(input_file), str(output_file))
+
+    records = {record["id"]: record for record in map(json.loads, output_file.read_text().splitlines())}
+    assert records[0]["answer"] == "q0"
+    assert "error" in records[1]
+    assert "outside the image directory" in records[3]["error"]
+    # Requests without an id are named by their line number
+    assert records[4]["answer"] == "no id"
+    assert stats["requests"] == 2
@@ -0,0 +1,71 @@
+"""
+Cached vision features against the pixel path on a tiny random Qwen3-VL
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from sft import (
+    QwenCompletionCollator,
+    SystemPromptConfig,
+    VisionFeatureStore,
+    cached_encoder_outputs,
+    precompute_vision_features,
+    process_single_item,
+    vision_fingerprint,
+)
+
+
+@pytest.fixture
+def frozen_vision(tiny_model):
+    """The tiny model with its vision tower frozen, as LoRA leaves it"""
+    vision_params = [param for name, param in tiny_model.named_parameters() if "visual." in name]
+    for param in vision_params:
+        param.requires_grad_(False)
+    yield tiny_model
+    for param in vision_params:
+        param.requires_grad_(True)
+
+
+@pytest.fixture
+def samples(tiny_processor, chart_images, tmp_path):
+    items = []
+    for i, image in enumerate(chart_images):
+        image.save(tmp_path / f"chart_{i}.png")
+        items.append({
+            "image": f"chart_{i}.png",
+            "question": "Which year shows the highest bar?",
+            "think": "The chart shows the highest bar.",
+            "label": str(2000 + i)
+        })
+    processed = [
+        process_single_item(item, str(tmp_path), SystemPromptConfig().prompt, tiny_processor) for item in items
+    ]
+    # Feature store entries are keyed by the preprocessing cache key
+    return [dict(sample, cache_key=f"sample-{i}") for i, sample in enumerate(processed)]
+
+
+def forward(model, batch):
+    batch = dict(batch)
+    # The test processor returns no token types; Qwen3-VL needs them to place the image tokens
+    batch["mm_token_type_ids"] = (batch["input_ids"] == model.config.image_token_id).int()
+    if "image_embeds" in batch:
+        batch["mm_encoder_outputs"] = cached_encoder_outputs(batch.pop("image_embeds"), batch.pop("deepstack_embeds"))
+    with torch.no_grad():
+        return model(**batch)
+
+
+def test_cached_features_match_pixel_forward(frozen_vision, tiny_processor, samples, tmp_path):
+    store = VisionFeatureStore(str(tmp_path / "vision"), vision_fingerprint(frozen_vision))
+    assert precompute_vision_features(frozen_vision, samples, store, batch_size=2) == len(samples)
+    assert precompute_vision_features(frozen_vision, samples, store) == 0
+
+    plain = QwenCompletionCollator(processor=tiny_processor)(samples)
+    cached = QwenCompletionCollator(processor=tiny_processor, feature_store=store)(samples)
+    assert "pixel_values" not in cached and "image_embeds" in cached
+
+    expected = forward(frozen_vision, plain)
+    actual = forward(frozen_vision, cached)
+
+    torch.testing.assert_close(actual.logits, expected.logits)
+    torch.testing.assert_close(actual.loss, expected.loss)